@@ -0,0 +1,15 @@
+# The package directory name is not importable, tests import it as `flights_scrape_scheduler`
+import importlib.util
+import os
+import sys
+
+
+PACKAGE_DIR = os.path.join(os.path.dirname(__file__), 'flights-scrape-scheduler')
+
+spec = importlib.util.spec_from_file_location(
+    'flights_scrape_scheduler', os.path.join(PACKAGE_DIR, '__init__.py'),
+    submodule_search_locations=[PACKAGE_DIR]
+)
+package = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = package
+spec.loader.exec_module(package)
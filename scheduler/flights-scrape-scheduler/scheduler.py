@@ -1,5 +1,7 @@
 # google-chrome-stable --allow-running-insecure-content
-# gunicorn -b '0.0.0.0:8090' --workers=1 --env=AIRPORTS=WAW,ALC,MAN --env=END_DATE=2025-08-01 'scheduler.scheduler:make_app()'
+# gunicorn -b '0.0.0.0:8090' --workers=1 --threads=32 --env=AIRPORTS=WAW,ALC,MAN --env=END_DATE=2025-08-01 'scheduler.scheduler:make_app()'
+# many processes sharing the jobs:
+# gunicorn -b '0.0.0.0:8090' --workers=4 --threads=32 --env=JOBS_DB=jobs.sqlite --env=AIRPORTS=WAW,ALC,MAN 'scheduler.scheduler:make_app()'
 
 import json
 import logging
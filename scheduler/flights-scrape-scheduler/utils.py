@@ -1,10 +1,17 @@
-from datetime import UTC, datetime
+import atexit
+from collections import deque
+from contextlib import contextmanager
+from heapq import heappop, heappush
 import json
 from functools import wraps
 import logging
+import os
+import sqlite3
 from sys import exc_info
+from threading import Event, Lock, Thread, local
+from time import monotonic, sleep, time
 from traceback import format_exception
-from typing import Dict
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
 from uuid import uuid4
 
 from flask import jsonify, request
@@ -14,7 +21,7 @@ from pydantic import BaseModel
 def _parse_args(args: Dict[str, str]):
     parsed = {}
     for k, v in args.items():
-        if v[0] in ('[', '{') and v[-1] in (']', '}'):
+        if v and v[0] in ('[', '{') and v[-1] in (']', '}'):
             try:
                 parsed[k] = json.loads(v)
             except Exception as e:
@@ -41,7 +48,11 @@ def safe_format_json(o):
         return o
 
 
-def json_request(func):
+# format_result turns results (and error bodies) into JSON-serializable values
+def json_request(func=None, *, format_result: Callable = safe_format_json):
+    if func is None:
+        return lambda func: json_request(func, format_result=format_result)
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
         try:
@@ -53,15 +64,15 @@ def json_request(func):
             kwargs.update(
                 _parse_args(request.args)
             )
-            return jsonify(safe_format_json(
+            return jsonify(format_result(
                 await func(*args, **kwargs)
             )), 200
         except ValueError as e:
-            return jsonify(safe_format_json(dict(
+            return jsonify(format_result(dict(
                 error=str(e),
             ))), 400
         except Exception as e:
-            return jsonify(safe_format_json(dict(
+            return jsonify(format_result(dict(
                 stack=format_exception(*exc_info()),
                 error=str(e),
                 type=type(e).__name__,
@@ -70,14 +81,38 @@ def json_request(func):
     return wrapper
 
 
-def new_id():
-    return str(uuid4())
+MAX_BATCH_SIZE = 100
+MAX_WAIT_S = 60.
+
+
+def parse_batch_size(n) -> int:
+    try:
+        n = int(n)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid batch size: {n!r}')
+    if not 1 <= n <= MAX_BATCH_SIZE:
+        raise ValueError(f'Batch size must be in 1..{MAX_BATCH_SIZE}, got {n}')
+    return n
 
 
-def save_jobs(fname, jobs):
-    with open(fname, 'w') as f:
-        json.dump(safe_format_json(jobs), f)
-        logging.info(f'Saved {len(jobs)} jobs as `{fname}`')
+def parse_wait_s(wait_s) -> float:
+    try:
+        wait_s = float(wait_s)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid wait time: {wait_s!r}')
+    if not 0 <= wait_s <= MAX_WAIT_S:
+        raise ValueError(f'Wait time must be in 0..{MAX_WAIT_S} s, got {wait_s}')
+    return wait_s
+
+
+def parse_job_ids(job_ids) -> List[str]:
+    if not isinstance(job_ids, list) or not all(isinstance(job_id, str) for job_id in job_ids):
+        raise ValueError(f'job_ids must be a list of job ids, got {job_ids!r}')
+    return job_ids
+
+
+def new_id():
+    return str(uuid4())
 
 
 def get_all_subclasses(base_cls):
@@ -89,29 +124,497 @@ def get_all_subclasses(base_cls):
     return all_subclasses
 
 
+def parse_job(job, subclasses):
+    job = dict(job)
+    job_type = job.pop('type_')
+    if job_type not in subclasses:
+        raise ValueError(f'Unknown job type: {job_type}')
+    return subclasses[job_type].model_validate(job)
+
+
 def load_jobs(fname, base_cls):
     subclasses = get_all_subclasses(base_cls)
     with open(fname) as f:
         jobs = {}
         for job_id, job in json.load(f).items():
-            job_type = job.pop('type_')
-            if job_type not in subclasses:
-                raise ValueError(f'Unknown job type: {job_type}')
-            jobs[job_id] = subclasses[job_type].model_validate(job)
+            jobs[job_id] = parse_job(job, subclasses)
         logging.info(f'Loaded {len(jobs)} jobs from `{fname}`')
     return jobs
 
 
-def fetch_free_job(jobs, jobs_locked):
-    for job_id in reversed(tuple(jobs.keys())):
-        if job_id not in jobs_locked:
-            job = jobs[job_id]
-            jobs_locked[job_id] = datetime.now(UTC)
-            return job
+# Append-only log of added and completed jobs, one JSON record per line.
+# Records reach the OS on every write and the disk within `sync_s`. The sync thread also compacts
+# the log to the live jobs when `compaction_snapshot` returns them. Leases are not logged, after
+# a restart leased jobs are handed out again.
+class JobJournal:
+    def __init__(self, fname: str, base_cls, sync_s: float = 1.):
+        self.fname = fname
+        self.sync_s = sync_s
+        self.records = 0
+        # () -> None or (live jobs, log offset they are taken at), set by the queue
+        self.compaction_snapshot: Callable[[], Optional[Tuple[Iterable[BaseModel], int]]] = lambda: None
+        self._subclasses = get_all_subclasses(base_cls)
+        self._file = None
+        self._dirty = False
+        self._lock = Lock()
+
+    # Jobs of the log, a last record without its line end was torn by a crash and ends it.
+    # Any other broken record is corruption and raises ValueError.
+    def replay(self) -> Tuple[Dict[str, BaseModel], int]:
+        jobs = {}
+        valid_size = 0
+        self.records = 0
+        with open(self.fname, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    logging.warning(f'Dropping torn journal record in `{self.fname}`')
+                    break
+                try:
+                    record = json.loads(line)
+                    if record['op'] == 'add':
+                        job = parse_job(record['job'], self._subclasses)
+                        jobs[job.id] = job
+                    elif record['op'] == 'complete':
+                        jobs.pop(record['id'], None)
+                    else:
+                        raise ValueError(f'Unknown op: {record["op"]}')
+                except (KeyError, TypeError, ValueError) as e:
+                    logging.error(f'Corrupt record {self.records + 1} in `{self.fname}`: {e}')
+                    raise ValueError(f'Corrupt record {self.records + 1} in `{self.fname}`') from e
+                valid_size += len(line)
+                self.records += 1
+        return jobs, valid_size
+
+    # Replays the log and opens it for appending, a torn record is cut off
+    def load(self) -> Dict[str, BaseModel]:
+        jobs = {}
+        try:
+            jobs, valid_size = self.replay()
+            with open(self.fname, 'r+b') as f:
+                f.truncate(valid_size)
+        except FileNotFoundError:
+            pass
+        logging.info(f'Loaded {len(jobs)} jobs from {self.records} records of `{self.fname}`')
+
+        self._file = open(self.fname, 'ab')
+        Thread(target=self._sync_loop, daemon=True).start()
+        return jobs
+
+    def _write(self, records: Iterable[Dict]):
+        data = ''.join(json.dumps(record) + '\n' for record in records)
+        with self._lock:
+            self._file.write(data.encode())
+            self._file.flush()
+            self._dirty = True
+            self.records += data.count('\n')
+
+    def added(self, jobs: Iterable[BaseModel]):
+        self._write(dict(op='add', job=safe_format_json(job)) for job in jobs)
+
+    def completed(self, job_ids: Iterable[str]):
+        self._write(dict(op='complete', id=job_id) for job_id in job_ids)
+
+    # Log size, the offset the next record is written at
+    def tell(self) -> int:
+        with self._lock:
+            return self._file.tell()
+
+    def sync(self):
+        with self._lock:
+            if self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def _sync_loop(self):
+        while True:
+            sleep(self.sync_s)
+            try:
+                self.sync()
+                snapshot = self.compaction_snapshot()
+                if snapshot is not None:
+                    self.compact(*snapshot)
+            except Exception:
+                logging.exception(f'Failed to sync `{self.fname}`')
+
+    # Rewrites the log as `jobs`, the live jobs at log offset `offset`, and the records written since
+    def compact(self, jobs: Iterable[BaseModel], offset: int):
+        tmp_fname = f'{self.fname}.tmp'
+        records = 0
+        with open(tmp_fname, 'wb') as f:
+            for job in jobs:
+                f.write((json.dumps(dict(op='add', job=safe_format_json(job))) + '\n').encode())
+                records += 1
+            with self._lock:
+                with open(self.fname, 'rb') as log:
+                    log.seek(offset)
+                    tail = log.read()
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+                os.replace(tmp_fname, self.fname)
+                self._file.close()
+                self._file = open(self.fname, 'ab')
+                self._dirty = False
+                self.records = records + tail.count(b'\n')
+        logging.info(f'Compacted `{self.fname}` to {self.records} records')
+
+
+class _Waiter:
+    def __init__(self, n: int):
+        self.n = n
+        self.jobs: List[BaseModel] = []
+        self.event = Event()
+
+
+# Jobs handed out newest first, a fetched job is leased to one worker until it is completed
+# or its lease expires and it goes back to the queue at its old position.
+# The ready queue and the lease expiry queue are heaps, stale entries (completed jobs, renewed
+# leases) are skipped when they come up, so fetch, complete and expire are O(log n).
+# A fetch with wait_s parks the calling thread until jobs come in, waiting fetches get them
+# in arrival order.
+class JobQueue:
+    def __init__(self, lease_s: float = 60 * 4, compact_records: int = 4096):
+        self.lease_s = lease_s
+        self.compact_records = compact_records
+        self.journal: Optional[JobJournal] = None
+        self.jobs: Dict[str, BaseModel] = {}
+        self._order: Dict[str, int] = {}
+        self._ready: List[Tuple[int, str]] = []
+        self._leases: Dict[str, int] = {}
+        self._lease_expiry: List[Tuple[float, int, str]] = []
+        self._next_order = 0
+        self._next_lease = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    @property
+    def leased(self) -> int:
+        return len(self._leases)
+
+    # Loads the jobs of `journal` and logs every later change to it
+    def open_journal(self, journal: JobJournal):
+        with self._lock:
+            journal.compaction_snapshot = self._compaction_snapshot
+            for job in journal.load().values():
+                self._add(job)
+            self.journal = journal
+
+    # The live jobs in queue order once the log is mostly completed jobs. Taken under the queue
+    # lock with the log offset, records written later are changes on top of them.
+    def _compaction_snapshot(self) -> Optional[Tuple[List[BaseModel], int]]:
+        with self._lock:
+            if self.journal.records <= max(self.compact_records, 2 * len(self.jobs)):
+                return None
+            return list(self.jobs.values()), self.journal.tell()
+
+    def add(self, job: BaseModel):
+        self.update((job,))
+
+    def update(self, jobs: Iterable[BaseModel]):
+        with self._lock:
+            jobs = tuple(jobs)
+            for job in jobs:
+                self._add(job)
+            if self.journal is not None:
+                self.journal.added(jobs)
+            self._hand_out(monotonic())
 
+    def _add(self, job: BaseModel):
+        if job.id in self.jobs:
+            self.jobs[job.id] = job
+            return
+        self.jobs[job.id] = job
+        self._order[job.id] = self._next_order
+        heappush(self._ready, (-self._next_order, job.id))
+        self._next_order += 1
 
-def clear_job_locks(jobs_locked, timeout_s = 60 * 4):
-    cur_time = datetime.now(UTC)
-    for job_id, lock_time in tuple(jobs_locked.items()):
-        if (cur_time - lock_time).total_seconds() > timeout_s:
-            jobs_locked.pop(job_id)
+    def _expire_leases(self, cur_time: float):
+        while self._lease_expiry and self._lease_expiry[0][0] <= cur_time:
+            _, lease, job_id = heappop(self._lease_expiry)
+            if self._leases.get(job_id) == lease:
+                del self._leases[job_id]
+                heappush(self._ready, (-self._order[job_id], job_id))
+
+    def _lease(self, n: int, cur_time: float) -> List[BaseModel]:
+        jobs = []
+        while self._ready and len(jobs) < n:
+            _, job_id = heappop(self._ready)
+            if job_id in self.jobs and job_id not in self._leases:
+                self._leases[job_id] = self._next_lease
+                heappush(self._lease_expiry, (cur_time + self.lease_s, self._next_lease, job_id))
+                self._next_lease += 1
+                jobs.append(self.jobs[job_id])
+        return jobs
+
+    # Ready jobs go to the longest waiting fetches first
+    def _hand_out(self, cur_time: float):
+        while self._waiters and self._ready:
+            jobs = self._lease(self._waiters[0].n, cur_time)
+            if not jobs:
+                break
+            waiter = self._waiters.popleft()
+            waiter.jobs = jobs
+            waiter.event.set()
+            self._wake_first_waiter()
+
+    # The first waiter waits for the earliest lease expiry, it has to recheck it after new leases
+    def _wake_first_waiter(self):
+        if self._waiters:
+            self._waiters[0].event.set()
+
+    def fetch(self, wait_s: float = 0.) -> Optional[BaseModel]:
+        jobs = self.fetch_many(1, wait_s)
+        return jobs[0] if jobs else None
+
+    # Leases up to n jobs at once, all of them with the same expiry. With no job ready it waits
+    # up to wait_s for new jobs or expiring leases.
+    def fetch_many(self, n: int, wait_s: float = 0.) -> List[BaseModel]:
+        with self._lock:
+            cur_time = monotonic()
+            self._expire_leases(cur_time)
+            self._hand_out(cur_time)
+            # earlier waiters go first
+            jobs = [] if self._waiters else self._lease(n, cur_time)
+            if jobs or wait_s <= 0:
+                self._wake_first_waiter()
+                return jobs
+            waiter = _Waiter(n)
+            self._waiters.append(waiter)
+
+        deadline = cur_time + wait_s
+        while True:
+            with self._lock:
+                cur_time = monotonic()
+                if not waiter.jobs:
+                    self._expire_leases(cur_time)
+                    self._hand_out(cur_time)
+                if waiter.jobs or cur_time >= deadline:
+                    if not waiter.jobs:
+                        self._waiters.remove(waiter)
+                        self._wake_first_waiter()
+                    return waiter.jobs
+                waiter.event.clear()
+                timeout = deadline - cur_time
+                if self._lease_expiry:
+                    timeout = min(timeout, max(self._lease_expiry[0][0] - cur_time, 0.))
+            waiter.event.wait(timeout)
+
+    def complete(self, job_id: str):
+        self.complete_many((job_id,))
+
+    def complete_many(self, job_ids: Iterable[str]):
+        with self._lock:
+            completed = []
+            for job_id in job_ids:
+                self._leases.pop(job_id, None)
+                self._order.pop(job_id, None)
+                if self.jobs.pop(job_id, None) is not None:
+                    completed.append(job_id)
+            if completed and self.journal is not None:
+                self.journal.completed(completed)
+
+
+# JobQueue over an SQLite database in WAL mode shared by many scheduler processes, each queue
+# `name` is a set of rows. A lease is one UPDATE claiming the newest rows whose lease expired,
+# so processes never hand out the same job. Leases use the wall clock, all processes have to run
+# on one host. Waiting fetches of a process are served in arrival order by one poller thread,
+# it leases again when another connection commits (PRAGMA data_version, checked every poll_s),
+# when the next lease expires or right away when this process adds jobs.
+class SqliteJobQueue:
+    def __init__(self, fname: str, name: str, base_cls, lease_s: float = 60 * 4, poll_s: float = .1):
+        self.fname = fname
+        self.name = name
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self._subclasses = get_all_subclasses(base_cls)
+        self._local = local()
+        self._waiters: Deque[_Waiter] = deque()
+        self._waiters_lock = Lock()
+        self._poller: Optional[Thread] = None
+        self._wake_poller = Event()
+        with self._transaction() as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    job TEXT NOT NULL,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    UNIQUE (queue, id)
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_queue_seq ON jobs (queue, seq)')
+            db.execute('CREATE TABLE IF NOT EXISTS queues (name TEXT PRIMARY KEY)')
+
+    # One connection per thread, statements outside _transaction commit on their own
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.fname, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self, begin: str = 'BEGIN'):
+        db = self._connection()
+        db.execute(begin)
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    # Creates the queue with the jobs of make_jobs in one transaction, other processes see it
+    # with all of them or not at all. True for the one process that created it.
+    def create(self, make_jobs: Callable[[], Iterable[BaseModel]]) -> bool:
+        with self._transaction('BEGIN IMMEDIATE') as db:
+            created = db.execute(
+                'INSERT OR IGNORE INTO queues (name) VALUES (?)', (self.name,)
+            ).rowcount == 1
+            if created:
+                self._insert(db, make_jobs())
+        if created:
+            self._wake_poller.set()
+        return created
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM jobs WHERE queue = ?', (self.name,)
+        ).fetchone()[0]
+
+    @property
+    def leased(self) -> int:
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM jobs WHERE queue = ? AND lease_until > ?', (self.name, time())
+        ).fetchone()[0]
+
+    def _insert(self, db: sqlite3.Connection, jobs: Iterable[BaseModel]):
+        db.executemany('''
+            INSERT INTO jobs (queue, id, job) VALUES (?, ?, ?)
+            ON CONFLICT (queue, id) DO UPDATE SET job = excluded.job
+        ''', (
+            (self.name, job.id, json.dumps(safe_format_json(job))) for job in jobs
+        ))
+
+    def add(self, job: BaseModel):
+        self.update((job,))
+
+    def update(self, jobs: Iterable[BaseModel]):
+        with self._transaction() as db:
+            self._insert(db, jobs)
+        self._wake_poller.set()
+
+    def _lease(self, n: int) -> List[BaseModel]:
+        cur_time = time()
+        rows = self._connection().execute('''
+            UPDATE jobs SET lease_until = ? WHERE seq IN (
+                SELECT seq FROM jobs WHERE queue = ? AND lease_until <= ? ORDER BY seq DESC LIMIT ?
+            ) RETURNING seq, job
+        ''', (cur_time + self.lease_s, self.name, cur_time, n)).fetchall()
+        rows.sort(reverse=True)
+        return [parse_job(json.loads(job), self._subclasses) for _, job in rows]
+
+    def _next_expiry(self) -> float:
+        next_expiry = self._connection().execute(
+            'SELECT MIN(lease_until) FROM jobs WHERE queue = ? AND lease_until > ?', (self.name, time())
+        ).fetchone()[0]
+        return float('inf') if next_expiry is None else next_expiry
+
+    # Leases jobs for the waiting fetches in arrival order, with the waiters lock held
+    def _hand_out(self):
+        while self._waiters:
+            jobs = self._lease(self._waiters[0].n)
+            if not jobs:
+                break
+            waiter = self._waiters.popleft()
+            waiter.jobs = jobs
+            waiter.event.set()
+
+    def _poll(self):
+        db = self._connection()
+        data_version = None
+        next_expiry = 0.
+        woken = True
+        while True:
+            self._wake_poller.clear()
+            cur_data_version = db.execute('PRAGMA data_version').fetchone()[0]
+            with self._waiters_lock:
+                if not self._waiters:
+                    self._poller = None
+                    return
+                if cur_data_version != data_version or time() >= next_expiry or woken:
+                    self._hand_out()
+                    next_expiry = self._next_expiry()
+            data_version = cur_data_version
+            woken = self._wake_poller.wait(max(min(self.poll_s, next_expiry - time()), 0.))
+
+    def fetch(self, wait_s: float = 0.) -> Optional[BaseModel]:
+        jobs = self.fetch_many(1, wait_s)
+        return jobs[0] if jobs else None
+
+    def fetch_many(self, n: int, wait_s: float = 0.) -> List[BaseModel]:
+        with self._waiters_lock:
+            # earlier waiters go first
+            jobs = [] if self._waiters else self._lease(n)
+            if jobs or wait_s <= 0:
+                return jobs
+            waiter = _Waiter(n)
+            self._waiters.append(waiter)
+            if self._poller is None:
+                self._poller = Thread(target=self._poll, daemon=True)
+                self._poller.start()
+
+        waiter.event.wait(wait_s)
+        with self._waiters_lock:
+            if not waiter.jobs:
+                self._waiters.remove(waiter)
+            return waiter.jobs
+
+    def complete(self, job_id: str):
+        self.complete_many((job_id,))
+
+    def complete_many(self, job_ids: Iterable[str]):
+        with self._transaction() as db:
+            db.executemany(
+                'DELETE FROM jobs WHERE queue = ? AND id = ?', ((self.name, job_id) for job_id in job_ids)
+            )
+
+
+# Jobs of the `{name}.json` file saved by older versions or the jobs made by `make_jobs`
+def _initial_jobs(name: str, base_cls, make_jobs) -> Iterable[BaseModel]:
+    try:
+        return load_jobs(f'{name}.json', base_cls).values()
+    except FileNotFoundError:
+        return make_jobs()
+
+
+# Jobs of the `{name}.journal` log, a new log starts with the initial jobs (see _initial_jobs).
+# With JOBS_DB set the queue is kept in that SQLite database instead, shared by all scheduler
+# processes, a new queue there starts with the jobs of the log or the initial jobs.
+def open_job_queue(name: str, base_cls, make_jobs):
+    db_fname = os.environ.get('JOBS_DB')
+    journal_fname = f'{name}.journal'
+    if db_fname:
+        def seed_jobs():
+            try:
+                return JobJournal(journal_fname, base_cls).replay()[0].values()
+            except FileNotFoundError:
+                return _initial_jobs(name, base_cls, make_jobs)
+
+        jobs = SqliteJobQueue(db_fname, name, base_cls)
+        jobs.create(seed_jobs)
+        return jobs
+
+    jobs = JobQueue()
+    is_new = not os.path.exists(journal_fname)
+    jobs.open_journal(JobJournal(journal_fname, base_cls))
+    if is_new:
+        jobs.update(_initial_jobs(name, base_cls, make_jobs))
+    atexit.register(jobs.journal.sync)
+    return jobs
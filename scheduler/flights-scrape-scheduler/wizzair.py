@@ -1,20 +1,18 @@
-import atexit
 from datetime import UTC, datetime, timedelta
-from functools import partial
 from os import environ
-from typing import Dict, Tuple
+from typing import List, Tuple
 
 from flask import Blueprint
 from pydantic import BaseModel
 
-from .utils import clear_job_locks, fetch_free_job, json_request, load_jobs, new_id, save_jobs
+from .utils import json_request, new_id, open_job_queue, parse_batch_size, parse_job_ids, parse_wait_s
 
 
 wizzair_blueprint = Blueprint('wizzair', __name__, url_prefix='/wizzair')
 
 
-JOBS: Dict = {}
-JOBS_LOCKED: Dict[str, datetime] = {}
+# JobQueue or SqliteJobQueue, opened by make_blueprint
+JOBS = None
 END_DATE = 'z'
 
 
@@ -45,33 +43,35 @@ def make_jobs(src_codes: Tuple[str, ...], dst_codes: Tuple[str, ...], start_date
 
 @wizzair_blueprint.route('/fetch_job', methods=['POST'])
 @json_request
-async def fetch_job():
-    result = fetch_free_job(JOBS, JOBS_LOCKED)
-    if result is not None:
-        return result
-
-    clear_job_locks(JOBS_LOCKED)
-    return fetch_free_job(JOBS, JOBS_LOCKED)
+async def fetch_job(wait_s=0):
+    return JOBS.fetch(parse_wait_s(wait_s))
 
 
 @wizzair_blueprint.route('/complete_job', methods=['POST'])
 @json_request
 async def complete_job(job_id):
-    JOBS_LOCKED.pop(job_id, None)
-    JOBS.pop(job_id, None)
+    JOBS.complete(job_id)
 
 
-def make_blueprint():
-    fname = 'wizzair_jobs.json'
-    airports = tuple(environ['AIRPORTS'].split(','))
+# `/fetch_jobs?n=K` leases up to K jobs in one call, with `wait_s` set an empty queue
+# holds the request until jobs come in (the request thread waits, run with --threads)
+@wizzair_blueprint.route('/fetch_jobs', methods=['POST'])
+@json_request
+async def fetch_jobs(n=1, wait_s=0):
+    return JOBS.fetch_many(parse_batch_size(n), parse_wait_s(wait_s))
+
+
+@wizzair_blueprint.route('/complete_jobs', methods=['POST'])
+@json_request
+async def complete_jobs(job_ids: List[str]):
+    JOBS.complete_many(parse_job_ids(job_ids))
 
-    try:
-        JOBS.update(load_jobs(fname, Job))
-    except FileNotFoundError:
-        JOBS.update({
-            str(job.id): job
-            for job in make_jobs(airports, airports, datetime.now(UTC).date(), 8, 60)
-        })
 
-    atexit.register(partial(save_jobs, fname, JOBS))
+def make_blueprint():
+    global JOBS
+
+    airports = tuple(environ['AIRPORTS'].split(','))
+    JOBS = open_job_queue('wizzair_jobs', Job, lambda: make_jobs(
+        airports, airports, datetime.now(UTC).date(), 8, 60
+    ))
     return wizzair_blueprint
@@ -0,0 +1,97 @@
+import json
+import logging
+from time import monotonic, sleep
+
+import pytest
+from pydantic import BaseModel
+
+from flights_scrape_scheduler.utils import JobJournal, JobQueue
+
+
+class Job(BaseModel):
+    id: str
+
+
+class NamedJob(Job):
+    name: str
+
+
+def open_queue(fname, sync_s=1., compact_records=4096):
+    jobs = JobQueue(compact_records=compact_records)
+    jobs.open_journal(JobJournal(str(fname), Job, sync_s=sync_s))
+    return jobs
+
+
+def queue_jobs(jobs):
+    return list(iter(jobs.fetch, None))
+
+
+def test_replay(tmp_path):
+    fname = tmp_path / 'jobs.journal'
+    jobs = open_queue(fname)
+    jobs.update([Job(id='a'), NamedJob(id='b', name='x'), Job(id='c')])
+    jobs.add(NamedJob(id='a', name='y'))
+    jobs.complete('c')
+    jobs.journal.sync()
+
+    reopened = open_queue(fname)
+    assert reopened.jobs == jobs.jobs
+    assert reopened.jobs['a'] == NamedJob(id='a', name='y')
+    assert [job.id for job in queue_jobs(reopened)] == ['b', 'a']
+    assert reopened.journal.records == 5
+
+
+def test_torn_tail(tmp_path, caplog):
+    fname = tmp_path / 'jobs.journal'
+    open_queue(fname).update([Job(id='a'), Job(id='b')])
+    # a record cut right before its line end is still torn
+    with open(fname, 'a') as f:
+        f.write(json.dumps(dict(op='complete', id='a')))
+
+    with caplog.at_level(logging.WARNING):
+        jobs = open_queue(fname)
+    assert 'torn' in caplog.text
+    assert set(jobs.jobs) == {'a', 'b'}
+    jobs.complete('b')
+    assert set(open_queue(fname).jobs) == {'a'}
+
+
+def test_corrupt_record(tmp_path, caplog):
+    fname = tmp_path / 'jobs.journal'
+    open_queue(fname).update([Job(id='a'), Job(id='b')])
+    lines = fname.read_text().splitlines(keepends=True)
+    fname.write_text(lines[0] + '{"op": "add", "jo\n' + lines[1])
+
+    with caplog.at_level(logging.ERROR), pytest.raises(ValueError, match='Corrupt record 2'):
+        open_queue(fname)
+    assert 'Corrupt record 2' in caplog.text
+
+
+def test_compact(tmp_path):
+    fname = tmp_path / 'jobs.journal'
+    jobs = open_queue(fname)
+    jobs.update(Job(id=str(i)) for i in range(10))
+    jobs.complete_many(map(str, range(6)))
+    snapshot, offset = list(jobs.jobs.values()), jobs.journal.tell()
+    # records written after the snapshot stay on top of it
+    jobs.update([Job(id='a')])
+    jobs.complete('6')
+    jobs.journal.compact(snapshot, offset)
+    assert jobs.journal.records == 6
+    jobs.complete('7')
+
+    reopened = open_queue(fname)
+    assert reopened.journal.records == 7
+    assert [job.id for job in queue_jobs(reopened)] == ['a', '9', '8']
+
+
+def test_compact_on_sync(tmp_path):
+    fname = tmp_path / 'jobs.journal'
+    jobs = open_queue(fname, sync_s=.01, compact_records=8)
+    jobs.update(Job(id=str(i)) for i in range(10))
+    jobs.complete_many(map(str, range(9)))
+    deadline = monotonic() + 5.
+    while jobs.journal.records > 1 and monotonic() < deadline:
+        sleep(.01)
+    assert jobs.journal.records == 1
+    assert open_queue(fname).jobs == jobs.jobs
@@ -0,0 +1,167 @@
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+from flask import Flask
+from pydantic import BaseModel
+
+from flights_scrape_scheduler import utils, wizzair
+from flights_scrape_scheduler.utils import JobQueue
+
+
+class Job(BaseModel):
+    id: str
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils, 'monotonic', clock)
+    return clock
+
+
+def make_queue(ids, lease_s=10.):
+    jobs = JobQueue(lease_s=lease_s)
+    jobs.update(Job(id=job_id) for job_id in ids)
+    return jobs
+
+
+def fetch_ids(jobs, n=1):
+    return [job.id for job in jobs.fetch_many(n)]
+
+
+def test_ready_order(clock):
+    jobs = make_queue('abcd')
+    assert fetch_ids(jobs) == ['d']
+    jobs.add(Job(id='e'))
+    # an updated job keeps its place
+    jobs.add(Job(id='b'))
+    assert fetch_ids(jobs, 2) == ['e', 'c']
+    assert fetch_ids(jobs, 5) == ['b', 'a']
+    assert jobs.fetch() is None
+    assert (len(jobs), jobs.leased) == (5, 5)
+
+
+def test_lease_expiry(clock):
+    jobs = make_queue('abc')
+    assert fetch_ids(jobs, 2) == ['c', 'b']
+    clock.time = 5.
+    assert fetch_ids(jobs) == ['a']
+    jobs.complete('b')
+
+    # expired leases go back at their old place, completed jobs do not come back
+    clock.time = 10.
+    assert fetch_ids(jobs, 3) == ['c']
+    clock.time = 15.
+    assert fetch_ids(jobs, 3) == ['a']
+
+    # the first lease of c expiring again is stale, c stays leased until its new lease expires
+    clock.time = 19.
+    assert jobs.fetch() is None
+    assert jobs.leased == 2
+    clock.time = 20.
+    assert fetch_ids(jobs, 3) == ['c']
+
+
+def test_complete(clock):
+    jobs = make_queue('abc')
+    jobs.complete('c')
+    jobs.complete('unknown')
+    assert fetch_ids(jobs, 3) == ['b', 'a']
+    jobs.complete_many(['a', 'b'])
+    assert (len(jobs), jobs.leased) == (0, 0)
+    clock.time = 100.
+    assert jobs.fetch() is None
+
+
+def test_batch(clock):
+    jobs = make_queue(map(str, range(10)), lease_s=10.)
+    assert fetch_ids(jobs, 4) == ['9', '8', '7', '6']
+    clock.time = 5.
+    assert fetch_ids(jobs, 4) == ['5', '4', '3', '2']
+    jobs.complete_many(['9', '8', '5', '4'])
+
+    # a batch lease expires as a whole
+    clock.time = 10.
+    assert fetch_ids(jobs, 10) == ['7', '6', '1', '0']
+    clock.time = 15.
+    assert fetch_ids(jobs, 10) == ['3', '2']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(wizzair, 'JOBS', make_queue(map(str, range(5))))
+    app = Flask(__name__)
+    app.register_blueprint(wizzair.wizzair_blueprint)
+    return app.test_client()
+
+
+def test_batch_endpoints(client):
+    r = client.post('/wizzair/fetch_jobs', json=dict(n=3))
+    assert r.status_code == 200
+    assert [job['id'] for job in r.json] == ['4', '3', '2']
+    assert client.post('/wizzair/fetch_jobs', json=dict(n=0)).status_code == 400
+
+    # a string is not taken for a list of one letter ids
+    assert client.post('/wizzair/complete_jobs', json=dict(job_ids='43')).status_code == 400
+    assert client.post('/wizzair/complete_jobs', json=dict(job_ids=[4, 3])).status_code == 400
+    assert len(wizzair.JOBS) == 5
+    assert client.post('/wizzair/complete_jobs', json=dict(job_ids=['4', '3'])).status_code == 200
+    assert len(wizzair.JOBS) == 3
+
+
+def start_waiters(jobs, count, n=1, wait_s=5.):
+    results = [None] * count
+    threads = []
+    for i in range(count):
+        def wait(i=i):
+            results[i] = [job.id for job in jobs.fetch_many(n, wait_s)]
+        threads.append(Thread(target=wait))
+        threads[-1].start()
+        # waiters queue up in start order
+        while len(jobs._waiters) <= i:
+            sleep(.001)
+    return results, threads
+
+
+def test_long_poll_fifo():
+    jobs = JobQueue()
+    results, threads = start_waiters(jobs, 3)
+    for job_id in 'abc':
+        jobs.add(Job(id=job_id))
+        # a fetch that does not wait can not take a job from the waiters
+        assert jobs.fetch() is None
+    for thread in threads:
+        thread.join()
+    assert results == [['a'], ['b'], ['c']]
+
+    results, threads = start_waiters(jobs, 2, n=2)
+    jobs.update(Job(id=job_id) for job_id in 'defgh')
+    for thread in threads:
+        thread.join()
+    assert results == [['h', 'g'], ['f', 'e']]
+    assert fetch_ids(jobs, 5) == ['d']
+
+
+def test_long_poll_lease_expiry():
+    jobs = make_queue('a', lease_s=.2)
+    assert fetch_ids(jobs) == ['a']
+    start_time = monotonic()
+    assert jobs.fetch(wait_s=5.).id == 'a'
+    assert .2 <= monotonic() - start_time < 2.
+
+
+def test_long_poll_timeout():
+    jobs = JobQueue()
+    start_time = monotonic()
+    assert jobs.fetch(wait_s=.1) is None
+    assert monotonic() - start_time >= .1
+    assert not jobs._waiters
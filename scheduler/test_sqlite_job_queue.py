@@ -0,0 +1,109 @@
+import json
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+from pydantic import BaseModel
+
+from flights_scrape_scheduler.utils import JobJournal, SqliteJobQueue, open_job_queue, safe_format_json
+
+
+class Job(BaseModel):
+    id: str
+
+
+def make_jobs(ids):
+    return [Job(id=str(job_id)) for job_id in ids]
+
+
+def open_queue(tmp_path, **kwargs):
+    return SqliteJobQueue(str(tmp_path / 'jobs.sqlite'), 'jobs', Job, **kwargs)
+
+
+def test_create(tmp_path):
+    def failing_jobs():
+        yield Job(id='a')
+        raise RuntimeError('make_jobs failed')
+
+    # jobs are added with the queue or not at all
+    with pytest.raises(RuntimeError):
+        open_queue(tmp_path).create(failing_jobs)
+    assert len(open_queue(tmp_path)) == 0
+
+    assert open_queue(tmp_path).create(lambda: make_jobs(range(5)))
+    assert not open_queue(tmp_path).create(lambda: pytest.fail('the queue is created once'))
+    assert len(open_queue(tmp_path)) == 5
+
+
+def test_no_duplicate_leases(tmp_path):
+    open_queue(tmp_path).create(lambda: make_jobs(range(500)))
+    queues = [open_queue(tmp_path), open_queue(tmp_path)]
+    leased = []
+
+    def work(jobs):
+        while batch := jobs.fetch_many(7):
+            leased.extend(job.id for job in batch)
+            jobs.complete_many([job.id for job in batch])
+
+    threads = [Thread(target=work, args=(jobs,)) for jobs in queues for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(leased, key=int) == [str(i) for i in range(500)]
+    assert len(queues[0]) == 0
+
+
+def test_long_poll(tmp_path):
+    jobs = open_queue(tmp_path, lease_s=.3)
+    jobs.create(list)
+    results = [None] * 3
+    threads = []
+    for i in range(3):
+        def wait(i=i):
+            results[i] = [job.id for job in jobs.fetch_many(2, wait_s=5.)]
+        threads.append(Thread(target=wait))
+        threads[-1].start()
+        while len(jobs._waiters) <= i:
+            sleep(.001)
+
+    # jobs added through another connection go to the waiters in arrival order
+    other = open_queue(tmp_path)
+    other.update(make_jobs('abc'))
+    for thread in threads[:2]:
+        thread.join()
+    other.update(make_jobs('d'))
+    threads[2].join()
+    assert results == [['c', 'b'], ['a'], ['d']]
+    assert not jobs._waiters
+
+    # a waiting fetch gets the newest job whose lease expires
+    start_time = monotonic()
+    assert jobs.fetch(wait_s=5.).id == 'c'
+    assert .1 < monotonic() - start_time < 2.
+
+
+def test_long_poll_timeout(tmp_path):
+    jobs = open_queue(tmp_path)
+    jobs.create(list)
+    start_time = monotonic()
+    assert jobs.fetch(wait_s=.1) is None
+    assert monotonic() - start_time >= .1
+    assert not jobs._waiters
+
+
+@pytest.mark.parametrize('source', ['journal', 'json', 'make_jobs'])
+def test_open_job_queue_seed(tmp_path, monkeypatch, source):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('JOBS_DB', 'jobs.sqlite')
+    if source == 'journal':
+        journal = JobJournal('jobs.journal', Job)
+        journal.load()
+        journal.added(make_jobs('ab'))
+    if source in ('journal', 'json'):
+        with open('jobs.json', 'w') as f:
+            json.dump({job.id: safe_format_json(job) for job in make_jobs('cd')}, f)
+
+    jobs = open_job_queue('jobs', Job, lambda: make_jobs('ef'))
+    expected = dict(journal='ab', json='cd', make_jobs='ef')[source]
+    assert sorted(job.id for job in iter(jobs.fetch, None)) == list(expected)
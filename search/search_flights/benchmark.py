@@ -0,0 +1,136 @@
+# python -m search_flights.benchmark --airports 20,50,100 --flights-per-day 1,2,4 --search-interval 1,3 > bench.jsonl
+# Prints one JSON object per case, times are wall seconds, memory is the peak RSS of the case process,
+# the search counters (see SearchStats) are summed over the searches of the case
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import json
+import resource
+from time import perf_counter
+from typing import Dict
+
+import numpy as np
+
+from .flight_optim import FlightIndex, SearchStats, find_best_single_trip
+from .settings import make_search_settings
+
+
+# Speed in map units per day, airports are spread over a 1x1 map
+CRUISE_SPEED = 16.
+DAY_START, DAY_END = 5 / 24, 23 / 24
+
+
+def make_flight_columns(
+    airports: int, flights_per_day: int, days: int,
+    routes_per_airport: int = 20, seed: int = 0
+) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    position = rng.random((airports, 2))
+
+    routes_per_airport = min(routes_per_airport, airports - 1)
+    src = np.repeat(np.arange(airports), routes_per_airport)
+    # random distinct destinations other than the source
+    dst = np.argsort(rng.random((airports, airports - 1)), axis=1)[:, :routes_per_airport]
+    dst = (dst + np.arange(airports)[:, None] + 1) % airports
+    dst = dst.ravel()
+    distance = np.linalg.norm(position[src] - position[dst], axis=1)
+
+    # every route is flown flights_per_day times a day
+    n = len(src) * flights_per_day * days
+    route = np.tile(np.repeat(np.arange(len(src)), flights_per_day), days)
+    day = np.repeat(np.arange(days), len(src) * flights_per_day)
+    day_start_time = rng.uniform(DAY_START, DAY_END, n)
+    duration = (.5 / 24 + distance[route] / CRUISE_SPEED) * rng.lognormal(0, .1, n)
+    # fares grow with distance and vary a lot between days
+    cost = (15 + 150 * distance[route]) * rng.lognormal(0, .5, n)
+
+    return dict(
+        id=np.arange(n, dtype=np.int32),
+        src=src[route].astype(np.int32),
+        dst=dst[route].astype(np.int32),
+        start_time=(day + day_start_time).astype(np.float32),
+        day_start_time=day_start_time.astype(np.float32),
+        day_end_time=((day_start_time + duration) % 1).astype(np.float32),
+        duration=duration.astype(np.float32),
+        cost=cost.astype(np.float32),
+    )
+
+
+def _timed(func, *args, **kwargs):
+    t = perf_counter()
+    r = func(*args, **kwargs)
+    return r, perf_counter() - t
+
+
+def run_case(
+    airports: int, flights_per_day: int, search_interval: float,
+    days: int = 30, searches: int = 5, seed: int = 0
+) -> Dict:
+    base_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    columns, generate_s = _timed(make_flight_columns, airports, flights_per_day, days, seed=seed)
+
+    flights = FlightIndex()
+    _, push_s = _timed(flights.push_flights, *columns.values(), sort=False)
+    _, sort_s = _timed(flights.sort_flights)
+
+    all_airports = set(range(airports))
+    selected, select_s = _timed(flights.select_flights, all_airports, all_airports, 0, days)
+
+    settings = make_search_settings(dict(search_interval=search_interval))
+    start_cities = np.random.default_rng(seed).choice(airports, min(searches, airports), replace=False)
+    search_s = []
+    stats = SearchStats()
+    for start_city in start_cities.tolist():
+        _, t = _timed(find_best_single_trip, start_city, 0., selected, settings, {}, stats=stats)
+        search_s.append(t)
+
+    return dict(
+        airports=airports,
+        flights_per_day=flights_per_day,
+        search_interval=search_interval,
+        days=days,
+        seed=seed,
+        flights=len(flights),
+        selected=len(selected),
+        generate_s=generate_s,
+        push_s=push_s,
+        sort_s=sort_s,
+        select_s=select_s,
+        searches=len(search_s),
+        search_s=sum(search_s),
+        search_max_s=max(search_s),
+        **stats.as_dict(),
+        base_rss_kb=base_rss_kb,
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+
+def _values(type_):
+    return lambda s: tuple(map(type_, s.split(',')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='flight_optim search scaling benchmark')
+    parser.add_argument('--airports', type=_values(int), default=(20, 50, 100))
+    parser.add_argument('--flights-per-day', type=_values(int), default=(1, 2, 4))
+    parser.add_argument('--search-interval', type=_values(float), default=(1., 3.))
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--searches', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for airports, flights_per_day, search_interval in product(
+        args.airports, args.flights_per_day, args.search_interval
+    ):
+        # a fresh process per case keeps the peak RSS of cases separate
+        with ProcessPoolExecutor(1) as pool:
+            result = pool.submit(
+                run_case, airports, flights_per_day, search_interval,
+                args.days, args.searches, args.seed
+            ).result()
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+from collections import defaultdict
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from .flight_optim import FlightIndex
+from .load_flights import (
+    EPOCH, FLIGHT_PARSERS, SNAPSHOT_COLUMNS, STREAM_PARSERS, days_since_epoch,
+    dedup_rows, iterate_files_flights, list_json_xz, merge_columns, number_parsed_flights,
+    push_columns, rows_to_columns
+)
+from .interning import CodeTable, InternTable
+from .price_history import PriceHistory
+
+
+CACHE_VERSION = 4
+
+# All scraped snapshots are kept, times are absolute days since EPOCH - float32 is too coarse for that.
+# flight_number holds InternTable flight ids, InternTable.flight_code turns them back into codes
+CACHE_COLUMNS = SNAPSHOT_COLUMNS | {'start_time': np.float64}
+
+FLIGHT_KEY = np.dtype([('flight_number', np.int32), ('start_time', np.float64)])
+
+
+def _flight_keys(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    keys = np.empty(len(columns['flight_number']), dtype=FLIGHT_KEY)
+    keys['flight_number'] = columns['flight_number']
+    keys['start_time'] = columns['start_time']
+    return keys
+
+
+# Ids of the cached snapshots stay: a known (flight_number, start_time) reuses its id,
+# new flights get the next ids in order of first appearance
+def _number_flights(columns: Dict[str, np.ndarray], new_columns: Dict[str, np.ndarray]) -> np.ndarray:
+    nknown = int(columns['id'].max()) + 1 if len(columns['id']) else 0
+    known = np.empty(nknown, dtype=FLIGHT_KEY)
+    known[columns['id']] = _flight_keys(columns)
+    order = np.argsort(known)
+    known = known[order]
+
+    keys = _flight_keys(new_columns)
+    pos = np.minimum(np.searchsorted(known, keys), max(nknown - 1, 0))
+    found = known[pos] == keys if nknown else np.zeros(len(keys), dtype=bool)
+    ids = np.empty(len(keys), dtype=np.int32)
+    ids[found] = order[pos[found]]
+
+    _, first, inverse = np.unique(keys[~found], return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int32)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(first), dtype=np.int32)
+    ids[~found] = nknown + rank[inverse.reshape(-1)]
+    return ids
+
+
+# Airport and flight number ids come from `interns` (by default a table inside cache_dir),
+# pass the same InternTable to the loaders and search to share ids with them
+class FlightCache:
+    def __init__(self, cache_dir: str, interns: Optional[InternTable] = None):
+        self.cache_dir = cache_dir
+        self.interns = interns if interns is not None else InternTable(os.path.join(cache_dir, 'interns'))
+        # (dedup policy, cache generation, cache size, kept rows) of the last indexed cache state
+        self._kept = None
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _load_manifest(self):
+        try:
+            with open(self._path('manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._empty_manifest()
+
+    # generation counts the rebuilds, rows of a generation only ever get appended.
+    # rows is the length of every column: columns are replaced one by one and the manifest last,
+    # after a crash in between they do not match it.
+    def _empty_manifest(self, generation: int = 0):
+        return dict(version=CACHE_VERSION, generation=generation, rows=0, files={})
+
+    def _save_manifest(self, manifest):
+        tmp_path = self._path('manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path('manifest.json'))
+
+    def _save_column(self, name, values):
+        tmp_path = self._path(f'{name}.tmp.npy')
+        np.save(tmp_path, values)
+        os.replace(tmp_path, self._path(f'{name}.npy'))
+
+    def _read_columns(self, mmap_mode: Optional[str] = 'r') -> Dict[str, np.ndarray]:
+        columns = {}
+        for name, dtype in CACHE_COLUMNS.items():
+            try:
+                columns[name] = np.load(self._path(f'{name}.npy'), mmap_mode=mmap_mode)
+            except FileNotFoundError:
+                columns[name] = np.empty(0, dtype=dtype)
+        return columns
+
+    @staticmethod
+    def _columns_match(manifest, columns: Dict[str, np.ndarray]) -> bool:
+        return all(len(column) == manifest.get('rows') for column in columns.values())
+
+    def load_columns(self, mmap_mode: Optional[str] = 'r') -> Dict[str, np.ndarray]:
+        columns = self._read_columns(mmap_mode)
+        if not self._columns_match(self._load_manifest(), columns):
+            raise ValueError(f'Columns of `{self.cache_dir}` do not match its manifest, update() rebuilds them')
+        return columns
+
+    def load_cities(self) -> CodeTable:
+        return self.interns.airports
+
+    # sources: provider name (FLIGHT_PARSERS key) -> dataset directory
+    # Only files missing from the manifest are parsed, a changed or removed file rebuilds the cache,
+    # as do columns left out of step with the manifest by an interrupted update
+    def update(
+        self, sources: Dict[str, str], processes: Optional[int] = 1, stream: bool = False
+    ) -> int:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self._load_manifest()
+        cached_files = manifest['files']
+
+        current_files = {}
+        for provider, root_dir in sources.items():
+            for file_path in list_json_xz(root_dir):
+                current_files[file_path] = (provider, os.path.getmtime(file_path))
+
+        rebuild = manifest.get('version') != CACHE_VERSION or any(
+            file_path not in current_files or current_files[file_path][1] != mtime
+            for file_path, mtime in cached_files.items()
+        )
+        if not rebuild:
+            columns = self._read_columns(mmap_mode=None)
+            rebuild = not self._columns_match(manifest, columns)
+        if rebuild:
+            logging.info(f'Dataset files or cached columns changed, rebuilding `{self.cache_dir}`')
+            manifest = self._empty_manifest(manifest.get('generation', 0) + 1)
+            cached_files = manifest['files']
+            columns = {
+                name: np.empty(0, dtype=dtype) for name, dtype in CACHE_COLUMNS.items()
+            }
+
+        new_files = defaultdict(list)
+        for file_path, (provider, _) in current_files.items():
+            if file_path not in cached_files:
+                new_files[provider].append(file_path)
+        if not new_files:
+            # Every cached file was removed: the emptied cache is saved, not rechecked on each call
+            if rebuild:
+                for name, values in columns.items():
+                    self._save_column(name, values)
+                self._save_manifest(manifest)
+            return 0
+
+        rows = []
+        for provider, files in new_files.items():
+            stream_provider = stream and provider in STREAM_PARSERS
+            parser = STREAM_PARSERS[provider] if stream_provider else FLIGHT_PARSERS[provider]
+            rows.extend(number_parsed_flights(
+                iterate_files_flights(files, parser, EPOCH, processes, stream=stream_provider),
+                self.interns.airports, {}
+            ))
+
+        new_columns = rows_to_columns(rows, CACHE_COLUMNS)
+        new_columns['flight_number'] = self.interns.intern_flight_numbers(
+            new_columns['flight_number']
+        ).astype(np.int32)
+        new_columns['id'] = _number_flights(columns, new_columns)
+        self.interns.save()
+        for name, values in new_columns.items():
+            self._save_column(name, np.concatenate((columns[name], values)))
+
+        for provider, files in new_files.items():
+            for file_path in files:
+                cached_files[file_path] = current_files[file_path][1]
+        manifest['rows'] = len(columns['id']) + len(rows)
+        self._save_manifest(manifest)
+        logging.info(f'Cached {len(rows)} flights from {sum(map(len, new_files.values()))} new files')
+        return len(rows)
+
+    # Cache row of the snapshot kept in the index for every flight id, -1 for none
+    def _kept_rows(self, columns: Dict[str, np.ndarray], dedup: str, generation: int) -> np.ndarray:
+        if self._kept is not None and self._kept[:3] == (dedup, generation, len(columns['id'])):
+            return self._kept[3]
+        rows = dedup_rows(columns, dedup)
+        kept = np.full(int(columns['id'].max()) + 1 if len(rows) else 0, -1, dtype=np.int64)
+        kept[columns['id'][rows]] = rows
+        self._kept = (dedup, generation, len(columns['id']), kept)
+        return kept
+
+    def load_index(
+        self, flights: FlightIndex, datetime_base: datetime, dedup: Optional[str] = 'latest'
+    ) -> CodeTable:
+        generation = self._load_manifest().get('generation', 0)
+        columns = self.load_columns()
+        if dedup is not None:
+            kept = self._kept_rows(columns, dedup, generation)
+            rows = np.sort(kept[kept >= 0])
+            columns = {name: c[rows] for name, c in columns.items()}
+        columns['start_time'] = columns['start_time'] - days_since_epoch(datetime_base)
+        push_columns(flights, columns)
+        return self.load_cities()
+
+    # Brings an index built by load_index up to date with new scrape files without a reload:
+    # only the new snapshots and the ones kept for their flights are deduplicated,
+    # superseded flights are removed and the new winners merged into the sorted index
+    def update_index(
+        self, flights: FlightIndex, datetime_base: datetime, sources: Dict[str, str],
+        processes: Optional[int] = 1, dedup: Optional[str] = 'latest', stream: bool = False
+    ) -> int:
+        generation = self._load_manifest().get('generation', 0)
+        columns = self.load_columns()
+        old_size = len(columns['id'])
+        kept = self._kept_rows(columns, dedup, generation) if dedup is not None else None
+        new_size = self.update(sources, processes, stream)
+        # a rebuild renumbers the rows, the index is loaded again
+        rebuilt = self._load_manifest().get('generation', 0) != generation
+        if not new_size and not rebuilt:
+            return 0
+
+        columns = self.load_columns()
+        if rebuilt or len(columns['id']) != old_size + new_size:
+            flights.clear()
+            self.load_index(flights, datetime_base, dedup)
+            flights.sort_flights()
+            return new_size
+
+        rows = np.arange(old_size, old_size + new_size)
+        if dedup is not None:
+            new_ids = columns['id'][rows]
+            kept = np.concatenate((kept, np.full(max(int(new_ids.max()) + 1 - len(kept), 0), -1)))
+            old_rows = kept[np.unique(new_ids)]
+            rows = np.concatenate((old_rows[old_rows >= 0], rows))
+            rows = rows[dedup_rows({name: c[rows] for name, c in columns.items()}, dedup)]
+            ids = columns['id'][rows]
+            changed = rows != kept[ids]
+            rows, ids = rows[changed], ids[changed]
+            flights.remove_flights(ids[kept[ids] >= 0].astype(np.int32))
+            kept[ids] = rows
+            self._kept = (dedup, generation, len(columns['id']), kept)
+
+        columns = {name: c[rows] for name, c in columns.items()}
+        columns['start_time'] = columns['start_time'] - days_since_epoch(datetime_base)
+        merge_columns(flights, columns)
+        return new_size
+
+    # Times in the history are absolute days since EPOCH
+    def load_price_history(self) -> PriceHistory:
+        return PriceHistory(self.load_columns())
@@ -1,10 +1,17 @@
+from libc.string cimport memcpy, memset
 from libcpp cimport bool
 from libcpp.vector cimport vector
 from libcpp.map cimport map as map_cc
+from libcpp.set cimport set as set_cc
 from .flight_optim_ccexport cimport (
     flight_t, travel_t, vertex_t, flight_time_t, flight_duration_t, cost_t,
     compute_day_scores as compute_day_scores_cc, find_best_single_trip as find_best_single_trip_cc,
+    find_best_single_trips as find_best_single_trips_cc, TripQuery as TripQueryCC,
+    SearchStats as SearchStatsCC,
+    find_pareto_trips as find_pareto_trips_cc, ParetoTravel as ParetoTravelCC,
+    find_connections as find_connections_cc, ConnectionSearchSettings as ConnectionSearchSettingsCC,
     Flight as FlightCC, FlightTravel as FlightTravelCC, FlightIndex as FlightIndexCC,
+    FlightIndexView as FlightIndexViewCC,
     DiffCostSettings as DiffCostSettingsCC,
     DayScorer as DayScorerCC,
     TravelCoverSettings as TravelCoverSettingsCC,
@@ -129,12 +136,62 @@ cdef class FlightTravel:
         )
 
 
+cdef class ParetoTravel:
+    cdef ParetoTravelCC cc_obj
+
+    @property
+    def travel(self) -> FlightTravel:
+        travel = FlightTravel()
+        travel.cc_obj = self.cc_obj.travel
+        return travel
+
+    @property
+    def price(self) -> cost_t:
+        return self.cc_obj.price
+
+    @property
+    def duration(self) -> flight_duration_t:
+        return self.cc_obj.duration
+
+    @property
+    def penalty(self) -> cost_t:
+        return self.cc_obj.penalty
+
+    @property
+    def front(self) -> bool:
+        return self.cc_obj.front
+
+    def __repr__(self):
+        return (
+            f"ParetoTravel(travel={self.travel!r}, price={self.price}, "
+            f"duration={self.duration}, penalty={self.penalty}, front={self.front})"
+        )
+
+
 cdef class FlightsList:
     cdef vector[FlightCC] flights
 
     cdef size(self):
         return self.flights.size()
 
+    def __len__(self):
+        return self.flights.size()
+
+    @property
+    def nbytes(self) -> int:
+        return self.flights.size() * sizeof(FlightCC)
+
+    # Flights with the given ids in list order, e.g. the last_flight of found travels
+    cpdef list find_flights(self, ids):
+        cdef set_cc[flight_t] ids_set = ids
+        r = []
+        for i in range(self.flights.size()):
+            if ids_set.count(self.flights[i].id):
+                f = Flight()
+                f.cc_obj = self.flights[i]
+                r.append(f)
+        return r
+
     def __repr__(self):
         return (
             f"FlightsList(len={self.size()})"
@@ -153,6 +210,22 @@ cdef class TravelsList:
         )
 
 
+cdef size_t _columns_size(
+    const flight_t[::1] id, const vertex_t[::1] src, const vertex_t[::1] dst,
+    const flight_time_t[::1] start_time, const flight_time_t[::1] day_start_time,
+    const flight_time_t[::1] day_end_time, const flight_duration_t[::1] duration,
+    const cost_t[::1] cost
+) except? 0:
+    cdef size_t n = id.shape[0]
+    for column_size in (
+        src.shape[0], dst.shape[0], start_time.shape[0], day_start_time.shape[0],
+        day_end_time.shape[0], duration.shape[0], cost.shape[0]
+    ):
+        if column_size != n:
+            raise ValueError("All flight columns must have the same length")
+    return n
+
+
 cdef class FlightIndex:
     cdef FlightIndexCC flight_index
 
@@ -166,6 +239,55 @@ cdef class FlightIndex:
             day_end_time, duration, cost
         )
 
+    # Columns may be any C-contiguous buffers: int32 for id/src/dst, float32 for the rest
+    cpdef push_flights(
+        self, const flight_t[::1] id, const vertex_t[::1] src, const vertex_t[::1] dst,
+        const flight_time_t[::1] start_time, const flight_time_t[::1] day_start_time,
+        const flight_time_t[::1] day_end_time, const flight_duration_t[::1] duration,
+        const cost_t[::1] cost, bool sort = True
+    ):
+        cdef size_t n = _columns_size(
+            id, src, dst, start_time, day_start_time, day_end_time, duration, cost
+        )
+        if n:
+            with nogil:
+                self.flight_index.push_flights(
+                    n, &id[0], &src[0], &dst[0], &start_time[0], &day_start_time[0],
+                    &day_end_time[0], &duration[0], &cost[0]
+                )
+        if sort:
+            with nogil:
+                self.flight_index.sort_flights()
+
+    # Adds a batch to a live index: the batch is sorted on its own and merged into the sorted flights
+    cpdef merge_flights(
+        self, const flight_t[::1] id, const vertex_t[::1] src, const vertex_t[::1] dst,
+        const flight_time_t[::1] start_time, const flight_time_t[::1] day_start_time,
+        const flight_time_t[::1] day_end_time, const flight_duration_t[::1] duration,
+        const cost_t[::1] cost
+    ):
+        cdef size_t n = _columns_size(
+            id, src, dst, start_time, day_start_time, day_end_time, duration, cost
+        )
+        if n:
+            with nogil:
+                self.flight_index.merge_flights(
+                    n, &id[0], &src[0], &dst[0], &start_time[0], &day_start_time[0],
+                    &day_end_time[0], &duration[0], &cost[0]
+                )
+
+    cpdef remove_flights(self, const flight_t[::1] ids):
+        if ids.shape[0]:
+            with nogil:
+                self.flight_index.remove_flights(ids.shape[0], &ids[0])
+
+    cpdef clear(self):
+        self.flight_index.clear()
+
+    @property
+    def version(self) -> int:
+        return self.flight_index.get_version()
+
     cpdef sort_flights(self):
         self.flight_index.sort_flights()
 
@@ -177,12 +299,37 @@ cdef class FlightIndex:
         cdef vector[vertex_t] dst_v = dst
 
         r = FlightsList()
-        r.flights = self.flight_index.select_flights(
-            src_v.data(), src_v.size(), dst_v.data(), dst_v.size(),
-            start_time, end_time
-        )
+        with nogil:
+            r.flights = self.flight_index.select_flights(
+                src_v.data(), src_v.size(), dst_v.data(), dst_v.size(),
+                start_time, end_time
+            )
         return r
 
+    def __len__(self):
+        return self.flight_index.size()
+
+    # Number of source slots in the exported source offsets (largest source id + 1)
+    @property
+    def nsources(self) -> int:
+        if not self.flight_index.is_sorted():
+            raise ValueError("Flights set must be sorted")
+        return self.flight_index.get_source_offsets().size() - 1
+
+    # Copies the sorted flights (len(self) * FLIGHT_NBYTES bytes) and the nsources + 1
+    # source offsets into the given buffers, FlightIndexView serves selections from them
+    cpdef export(self, unsigned char[::1] flights, size_t[::1] source_offsets):
+        cdef size_t nsources = self.nsources
+        cdef size_t n = self.flight_index.size()
+        if flights.shape[0] != n * sizeof(FlightCC) or source_offsets.shape[0] != nsources + 1:
+            raise ValueError("Export buffers do not match the index size")
+        if n:
+            memcpy(&flights[0], self.flight_index.get_flights().data(), n * sizeof(FlightCC))
+        memcpy(
+            &source_offsets[0], self.flight_index.get_source_offsets().data(),
+            (nsources + 1) * sizeof(size_t)
+        )
+
     def __repr__(self):
         return (
             f"FlightsIndex(len={self.flight_index.size()})"
@@ -195,6 +342,58 @@ cdef class FlightIndex:
             yield f
 
 
+FLIGHT_NBYTES = sizeof(FlightCC)
+
+
+# Read-only index over buffers filled by FlightIndex.export, e.g. memory-mapped files,
+# the buffers are kept referenced and never copied
+cdef class FlightIndexView:
+    cdef FlightIndexViewCC flight_index
+    cdef const unsigned char[::1] _flights
+    cdef const size_t[::1] _source_offsets
+    cdef readonly unsigned long version
+
+    def __init__(
+        self, const unsigned char[::1] flights, const size_t[::1] source_offsets,
+        unsigned long version = 0
+    ):
+        cdef size_t n = flights.shape[0] // sizeof(FlightCC)
+        if flights.shape[0] % sizeof(FlightCC):
+            raise ValueError(f"Flights buffer size must be a multiple of {sizeof(FlightCC)}")
+        if source_offsets.shape[0] < 1 or source_offsets[source_offsets.shape[0] - 1] != n:
+            raise ValueError("Source offsets do not match the flights buffer")
+        self._flights = flights
+        self._source_offsets = source_offsets
+        self.version = version
+        self.flight_index = FlightIndexViewCC(
+            <const FlightCC *>&flights[0] if n else NULL, n,
+            &source_offsets[0], source_offsets.shape[0] - 1
+        )
+
+    def __len__(self):
+        return self.flight_index.size()
+
+    cpdef FlightsList select_flights(
+        self, src: set[vertex_t], dst: set[vertex_t],
+        start_time: flight_time_t, end_time: flight_time_t
+    ):
+        cdef vector[vertex_t] src_v = src
+        cdef vector[vertex_t] dst_v = dst
+
+        r = FlightsList()
+        with nogil:
+            r.flights = self.flight_index.select_flights(
+                src_v.data(), src_v.size(), dst_v.data(), dst_v.size(),
+                start_time, end_time
+            )
+        return r
+
+    def __repr__(self):
+        return (
+            f"FlightIndexView(len={self.flight_index.size()}, version={self.version})"
+        )
+
+
 cdef class DiffCostSettings:
     cdef DiffCostSettingsCC cc_obj
     cdef bool _const
@@ -266,6 +465,18 @@ cdef class DayScorer:
         cdef vector[cost_t] day_costs_v = day_costs
         self.cc_obj = compute_day_scores_cc(day_costs_v.data(), day_costs_v.size(), start_time, day_factor)
 
+    @property
+    def day_costs_agg(self) -> Tuple[cost_t, ...]:
+        return tuple(self.cc_obj.day_costs_agg)
+
+    @property
+    def start_time(self) -> flight_time_t:
+        return self.cc_obj.start_time
+
+    @property
+    def day_factor(self) -> flight_duration_t:
+        return self.cc_obj.day_factor
+
     def __repr__(self):
         return (
             f"DayScorer(\n"
@@ -675,12 +886,206 @@ cdef class TravelSearchSettings:
         )
 
 
-cpdef list[FlightTravel] find_best_single_trip(
-    start_city: vertex_t, start_time: flight_time_t,
-    flights: FlightsList,
-    settings: TravelSearchSettings,
-    city_costs: dict[vertex_t, cost_t]
-):
+cdef class ConnectionSearchSettings:
+    cdef ConnectionSearchSettingsCC cc_obj
+    cdef bool _const
+
+    def __init__(
+        self, *,
+        min_connection_time: flight_duration_t = 2 / 24,
+        max_duration: flight_duration_t = 3.,
+        max_flights: int = 4,
+        wait_time: DiffCostSettings = None,
+        move_cost: cost_t = 0.,
+        const_: bool = False
+    ):
+        self.cc_obj.min_connection_time = min_connection_time
+        self.cc_obj.max_duration = max_duration
+        self.cc_obj.max_flights = max_flights
+        if wait_time is not None:
+            self.cc_obj.wait_time = wait_time.cc_obj
+        self.cc_obj.move_cost = move_cost
+        self._const = const_
+
+    @property
+    def const(self) -> bool:
+        return self._const
+
+    @const.setter
+    def const(self, value: bool):
+        if self._const and not value:
+            raise ValueError("Cannot make a const object mutable!")
+        self._const = value
+
+    @property
+    def min_connection_time(self) -> flight_duration_t:
+        return self.cc_obj.min_connection_time
+
+    @min_connection_time.setter
+    def min_connection_time(self, value: flight_duration_t):
+        if self._const:
+            raise AttributeError("Cannot modify a const ConnectionSearchSettings object")
+        self.cc_obj.min_connection_time = value
+
+    @property
+    def max_duration(self) -> flight_duration_t:
+        return self.cc_obj.max_duration
+
+    @max_duration.setter
+    def max_duration(self, value: flight_duration_t):
+        if self._const:
+            raise AttributeError("Cannot modify a const ConnectionSearchSettings object")
+        self.cc_obj.max_duration = value
+
+    @property
+    def max_flights(self) -> int:
+        return self.cc_obj.max_flights
+
+    @max_flights.setter
+    def max_flights(self, value: int):
+        if self._const:
+            raise AttributeError("Cannot modify a const ConnectionSearchSettings object")
+        self.cc_obj.max_flights = value
+
+    @property
+    def wait_time(self) -> DiffCostSettings:
+        r = DiffCostSettings()
+        r.cc_obj = self.cc_obj.wait_time
+        r.const = True
+        return r
+
+    @wait_time.setter
+    def wait_time(self, value: DiffCostSettings):
+        if self._const:
+            raise AttributeError("Cannot modify a const ConnectionSearchSettings object")
+        self.cc_obj.wait_time = value.cc_obj
+
+    @property
+    def move_cost(self) -> cost_t:
+        return self.cc_obj.move_cost
+
+    @move_cost.setter
+    def move_cost(self, value: cost_t):
+        if self._const:
+            raise AttributeError("Cannot modify a const ConnectionSearchSettings object")
+        self.cc_obj.move_cost = value
+
+    def __repr__(self):
+        return (
+            f"ConnectionSearchSettings(\n"
+            f"  min_connection_time={self.min_connection_time!r},\n"
+            f"  max_duration={self.max_duration!r},\n"
+            f"  max_flights={self.max_flights!r},\n"
+            f"  wait_time={self.wait_time!r},\n"
+            f"  move_cost={self.move_cost!r}\n)"
+        )
+
+
+# Search counters, pass one to find_best_single_trip(s) to collect them. Counters add up over
+# the searches it is passed to, peak_frontier keeps the maximum.
+cdef class SearchStats:
+    cdef SearchStatsCC cc_obj
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        memset(&self.cc_obj, 0, sizeof(SearchStatsCC))
+
+    cdef add(self, const SearchStatsCC &stats):
+        self.cc_obj.flights_scanned += stats.flights_scanned
+        self.cc_obj.travels_scanned += stats.travels_scanned
+        self.cc_obj.travels_expanded += stats.travels_expanded
+        self.cc_obj.no_travel += stats.no_travel
+        self.cc_obj.pruned_back += stats.pruned_back
+        self.cc_obj.pruned_forward += stats.pruned_forward
+        self.cc_obj.replaced += stats.replaced
+        self.cc_obj.pruned_top_k += stats.pruned_top_k
+        self.cc_obj.peak_frontier = max(self.cc_obj.peak_frontier, stats.peak_frontier)
+        self.cc_obj.start_phase_seconds += stats.start_phase_seconds
+        self.cc_obj.end_phase_seconds += stats.end_phase_seconds
+
+    # Flights tried as a travel extension
+    @property
+    def flights_scanned(self) -> int:
+        return self.cc_obj.flights_scanned
+
+    # Earlier travels checked in the wait windows
+    @property
+    def travels_scanned(self) -> int:
+        return self.cc_obj.travels_scanned
+
+    # Extensions built from the best earlier travel
+    @property
+    def travels_expanded(self) -> int:
+        return self.cc_obj.travels_expanded
+
+    # Flights with no earlier travel to continue
+    @property
+    def no_travel(self) -> int:
+        return self.cc_obj.no_travel
+
+    # Extensions covered by an earlier cheaper travel (back_cost_factor)
+    @property
+    def pruned_back(self) -> int:
+        return self.cc_obj.pruned_back
+
+    # Extensions covered by a later travel (forward_cost_factor)
+    @property
+    def pruned_forward(self) -> int:
+        return self.cc_obj.pruned_forward
+
+    # Kept travels dropped when covered by a new one
+    @property
+    def replaced(self) -> int:
+        return self.cc_obj.replaced
+
+    # Extensions that could not make it into the top_k trips
+    @property
+    def pruned_top_k(self) -> int:
+        return self.cc_obj.pruned_top_k
+
+    # Most travels kept at once by a search phase
+    @property
+    def peak_frontier(self) -> int:
+        return self.cc_obj.peak_frontier
+
+    @property
+    def start_phase_seconds(self) -> float:
+        return self.cc_obj.start_phase_seconds
+
+    @property
+    def end_phase_seconds(self) -> float:
+        return self.cc_obj.end_phase_seconds
+
+    def as_dict(self) -> dict:
+        return dict(
+            flights_scanned=self.flights_scanned,
+            travels_scanned=self.travels_scanned,
+            travels_expanded=self.travels_expanded,
+            no_travel=self.no_travel,
+            pruned_back=self.pruned_back,
+            pruned_forward=self.pruned_forward,
+            replaced=self.replaced,
+            pruned_top_k=self.pruned_top_k,
+            peak_frontier=self.peak_frontier,
+            start_phase_seconds=self.start_phase_seconds,
+            end_phase_seconds=self.end_phase_seconds,
+        )
+
+    def __repr__(self):
+        return "SearchStats(" + ", ".join(f"{k}={v}" for k, v in self.as_dict().items()) + ")"
+
+
+cdef const vector[FlightCC] *_flights_vector(flights) except NULL:
+    if isinstance(flights, FlightIndex):
+        return &(<FlightIndex>flights).flight_index.get_flights()
+    elif isinstance(flights, FlightsList):
+        return &(<FlightsList>flights).flights
+    raise TypeError("flights must be a FlightIndex or FlightsList")
+
+
+cdef map_cc[vertex_t, cost_t] _city_costs_cc(city_costs: dict[vertex_t, cost_t]) except *:
     cdef map_cc[vertex_t, cost_t] city_costs_cc
     cdef vertex_t py_key
     cdef cost_t py_value
@@ -690,13 +1095,127 @@ cpdef list[FlightTravel] find_best_single_trip(
         if not isinstance(py_value, (int, float)):
             raise TypeError("Dictionary keys values must be float city costs")
         city_costs_cc[py_key] = py_value
+    return city_costs_cc
+
 
+cdef list _travels_list(const vector[FlightTravelCC] &travels_cc):
     r = []
-    for travel_cc in find_best_single_trip_cc(
-        start_city, start_time, flights.flights,
-        settings.cc_obj, city_costs_cc
-    ):
+    for i in range(travels_cc.size()):
         travel = FlightTravel()
-        travel.cc_obj = travel_cc
+        travel.cc_obj = travels_cc[i]
         r.append(travel)
     return r
+
+
+# Trips leave start_city no earlier than start_time.
+# With top_k > 0 only the top_k cheapest trips (and the travels they are built of) are returned,
+# partial trips that can not make it into the top are pruned during the search
+cpdef list[FlightTravel] find_best_single_trip(
+    start_city: vertex_t, start_time: flight_time_t,
+    flights: FlightsList,
+    settings: TravelSearchSettings,
+    city_costs: dict[vertex_t, cost_t],
+    top_k: int = 0,
+    stats: SearchStats = None
+):
+    if top_k < 0:
+        raise ValueError("top_k must be >= 0")
+    cdef map_cc[vertex_t, cost_t] city_costs_cc = _city_costs_cc(city_costs)
+    cdef SearchStatsCC *stats_cc = NULL
+    if stats is not None:
+        stats_cc = &stats.cc_obj
+    return _travels_list(find_best_single_trip_cc(
+        start_city, start_time, flights.flights,
+        settings.cc_obj, city_costs_cc, top_k, stats_cc
+    ))
+
+
+# Runs (start_city, start_time, settings) queries over shared flights on `threads` native threads
+# (all cores when 0) with the GIL released, results are in query order, top_k applies to each query.
+# Like find_best_single_trip, trips of a query leave start_city no earlier than its start_time.
+# `flights` is a FlightsList or a whole FlightIndex, it must not be modified during the call.
+# `stats` collects the counters of all queries.
+cpdef list[list[FlightTravel]] find_best_single_trips(
+    queries: list,
+    flights,
+    city_costs: dict[vertex_t, cost_t],
+    threads: int = 0,
+    top_k: int = 0,
+    stats: SearchStats = None
+):
+    if top_k < 0:
+        raise ValueError("top_k must be >= 0")
+    cdef vector[TripQueryCC] queries_cc
+    cdef TripQueryCC query_cc
+    query_cc.top_k = top_k
+    query_cc.stats = NULL
+    for start_city, start_time, settings in queries:
+        if not isinstance(settings, TravelSearchSettings):
+            raise TypeError("Query settings must be TravelSearchSettings")
+        query_cc.start_city = start_city
+        query_cc.start_time = start_time
+        query_cc.settings = (<TravelSearchSettings>settings).cc_obj
+        queries_cc.push_back(query_cc)
+
+    cdef const vector[FlightCC] *flights_cc = _flights_vector(flights)
+
+    cdef map_cc[vertex_t, cost_t] city_costs_cc = _city_costs_cc(city_costs)
+    cdef int nthreads = threads
+    # every query counts into its own stats, they are added up after the search
+    cdef vector[SearchStatsCC] stats_cc
+    if stats is not None:
+        stats_cc.resize(queries_cc.size())
+        for i in range(queries_cc.size()):
+            memset(&stats_cc[i], 0, sizeof(SearchStatsCC))
+            queries_cc[i].stats = &stats_cc[i]
+    cdef vector[vector[FlightTravelCC]] results_cc
+    with nogil:
+        results_cc = find_best_single_trips_cc(queries_cc, flights_cc[0], city_costs_cc, nthreads)
+    for i in range(stats_cc.size()):
+        stats.add(stats_cc[i])
+    return [_travels_list(travels_cc) for travels_cc in results_cc]
+
+
+# Trips of the find_best_single_trip search that are Pareto-optimal over price (flights and city costs),
+# travel time (flight and connection time, the stay excluded) and penalty (the other cost terms,
+# travel.cost = price + penalty), the first flight departs at start_time or later.
+# Front trips have front set, the rest are the travels they continue.
+cpdef list[ParetoTravel] find_pareto_trips(
+    start_city: vertex_t, start_time: flight_time_t,
+    flights,
+    settings: TravelSearchSettings,
+    city_costs: dict[vertex_t, cost_t]
+):
+    if settings is None:
+        raise TypeError("settings must be TravelSearchSettings")
+    cdef const vector[FlightCC] *flights_cc = _flights_vector(flights)
+    cdef map_cc[vertex_t, cost_t] city_costs_cc = _city_costs_cc(city_costs)
+    cdef vector[ParetoTravelCC] travels_cc
+    with nogil:
+        travels_cc = find_pareto_trips_cc(start_city, start_time, flights_cc[0], settings.cc_obj, city_costs_cc)
+    r = []
+    for i in range(travels_cc.size()):
+        travel = ParetoTravel()
+        travel.cc_obj = travels_cc[i]
+        r.append(travel)
+    return r
+
+
+# Pareto-optimal (arrival time, cost) itineraries from start_city to end_city departing after
+# start_time, with self-transfers between any flights (e.g. across carriers).
+# Returns the final travels (end_vertex == end_city) and the travels they continue,
+# follow last_travel to walk an itinerary back.
+cpdef list[FlightTravel] find_connections(
+    start_city: vertex_t, start_time: flight_time_t, end_city: vertex_t,
+    flights,
+    settings: ConnectionSearchSettings
+):
+    if settings is None:
+        raise TypeError("settings must be ConnectionSearchSettings")
+    if start_city < 0 or end_city < 0:
+        raise ValueError("City ids must be >= 0")
+    cdef const vector[FlightCC] *flights_cc = _flights_vector(flights)
+    cdef vector[FlightTravelCC] travels_cc
+    with nogil:
+        travels_cc = find_connections_cc(start_city, start_time, end_city, flights_cc[0], settings.cc_obj)
+    return _travels_list(travels_cc)
@@ -1,3 +1,4 @@
+from libcpp cimport bool
 from libcpp.vector cimport vector
 from libcpp.map cimport map as map_cc
 
@@ -41,13 +42,43 @@ cdef extern from "flight_store.cc":
             flight_time_t start_time, flight_time_t day_start_time,
             flight_time_t day_end_time, flight_duration_t duration, cost_t cost
         )
-        void sort_flights()
+        void push_flights(
+            size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+            const flight_time_t *start_time, const flight_time_t *day_start_time,
+            const flight_time_t *day_end_time, const flight_duration_t *duration,
+            const cost_t *cost
+        ) nogil
+        void merge_flights(
+            size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+            const flight_time_t *start_time, const flight_time_t *day_start_time,
+            const flight_time_t *day_end_time, const flight_duration_t *duration,
+            const cost_t *cost
+        ) nogil
+        void remove_flights(size_t n, const flight_t *ids) nogil
+        void clear()
+        void sort_flights() nogil
         vector[Flight] select_flights(
             const vertex_t *src_vs, int nsrc_v,
             const vertex_t *dst_vs, int ndst_v,
             flight_time_t start_time, flight_time_t end_time
-        ) const
+        ) except + nogil const
         int size()
+        unsigned long get_version()
+        bool is_sorted()
+        const vector[size_t] &get_source_offsets()
+
+    cdef cppclass FlightIndexView:
+        FlightIndexView()
+        FlightIndexView(
+            const Flight *flights, size_t nflights,
+            const size_t *source_offsets, size_t nsources
+        )
+        vector[Flight] select_flights(
+            const vertex_t *src_vs, int nsrc_v,
+            const vertex_t *dst_vs, int ndst_v,
+            flight_time_t start_time, flight_time_t end_time
+        ) nogil const
+        size_t size()
 
 
 cdef extern from "optimizer.cc":
@@ -89,14 +120,70 @@ cdef extern from "optimizer.cc":
         TravelCoverSettings cover_settings
         cost_t move_cost
 
+    ctypedef struct ParetoTravel:
+        FlightTravel travel
+        cost_t price
+        flight_duration_t duration
+        cost_t penalty
+        bool front
+
+    ctypedef struct ConnectionSearchSettings:
+        flight_duration_t min_connection_time
+        flight_duration_t max_duration
+        int max_flights
+        DiffCostSettings wait_time
+        cost_t move_cost
+
+    ctypedef struct SearchStats:
+        size_t flights_scanned
+        size_t travels_scanned
+        size_t travels_expanded
+        size_t no_travel
+        size_t pruned_back
+        size_t pruned_forward
+        size_t replaced
+        size_t pruned_top_k
+        size_t peak_frontier
+        double start_phase_seconds
+        double end_phase_seconds
+
+    ctypedef struct TripQuery:
+        vertex_t start_city
+        flight_time_t start_time
+        TravelSearchSettings settings
+        size_t top_k
+        SearchStats *stats
+
     cdef DayScorer compute_day_scores(
         const cost_t *day_costs, int ndays,
         flight_time_t start_time, flight_duration_t day_factor
     )
 
     cdef vector[FlightTravel] find_best_single_trip(
+        vertex_t start_city, flight_time_t start_time,
+        const vector[Flight] &flights,
+        const TravelSearchSettings &settings,
+        const map_cc[vertex_t, cost_t] &city_costs,
+        size_t top_k,
+        SearchStats *stats
+    ) except +
+
+    cdef vector[vector[FlightTravel]] find_best_single_trips(
+        const vector[TripQuery] &queries,
+        const vector[Flight] &flights,
+        const map_cc[vertex_t, cost_t] &city_costs,
+        int nthreads
+    ) except + nogil
+
+    cdef vector[ParetoTravel] find_pareto_trips(
         vertex_t start_city, flight_time_t start_time,
         const vector[Flight] &flights,
         const TravelSearchSettings &settings,
         const map_cc[vertex_t, cost_t] &city_costs
-    )
+    ) except + nogil
+
+    cdef vector[FlightTravel] find_connections(
+        vertex_t start_city, flight_time_t start_time, vertex_t end_city,
+        const vector[Flight] &flights,
+        const ConnectionSearchSettings &settings
+    ) except + nogil
@@ -2,7 +2,7 @@
 
 #include <algorithm>
 #include <stdexcept>
-#include <iostream>
+#include <utility>
 
 
 void FlightIndex::push_flight(
@@ -10,6 +10,7 @@ void FlightIndex::push_flight(
     flight_time_t day_start_time, flight_time_t day_end_time,
     flight_duration_t duration, cost_t cost) {
   sorted = false;
+  version++;
   flights.push_back({
       .id = id,
       .src = src,
@@ -22,10 +23,89 @@ void FlightIndex::push_flight(
   });
 }
 
+void FlightIndex::push_flights(
+    std::size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+    const flight_time_t *start_time, const flight_time_t *day_start_time,
+    const flight_time_t *day_end_time, const flight_duration_t *duration,
+    const cost_t *cost) {
+  sorted = false;
+  version++;
+  flights.reserve(flights.size() + n);
+  for (std::size_t i = 0; i < n; i++) {
+    flights.push_back({
+        .id = id[i],
+        .src = src[i],
+        .dst = dst[i],
+        .start_time = start_time[i],
+        .day_start_time = day_start_time[i],
+        .day_end_time = day_end_time[i],
+        .duration = duration[i],
+        .cost = cost[i],
+    });
+  }
+}
+
+void FlightIndex::merge_flights(
+    std::size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+    const flight_time_t *start_time, const flight_time_t *day_start_time,
+    const flight_time_t *day_end_time, const flight_duration_t *duration,
+    const cost_t *cost) {
+  auto was_sorted = sorted;
+  auto old_size = flights.size();
+  push_flights(
+      n, id, src, dst, start_time, day_start_time, day_end_time, duration, cost);
+  if (!was_sorted) {
+    sort_flights();
+    return;
+  }
+
+  // Sort only the new batch and merge it with the already sorted flights
+  auto mid = flights.begin() + old_size;
+  std::sort(mid, flights.end(), FlightCompareSource());
+  std::inplace_merge(flights.begin(), mid, flights.end(), FlightCompareSource());
+  sorted = true;
+  update_source_offsets();
+}
+
+void FlightIndex::remove_flights(std::size_t n, const flight_t *ids) {
+  std::vector<flight_t> remove_ids(ids, ids + n);
+  std::sort(remove_ids.begin(), remove_ids.end());
+  // Keeps the order of the remaining flights, so the index stays sorted
+  auto end = std::remove_if(flights.begin(), flights.end(), [&](const Flight &f) {
+    return std::binary_search(remove_ids.begin(), remove_ids.end(), f.id);
+  });
+  if (end != flights.end()) {
+    flights.erase(end, flights.end());
+    version++;
+    if (sorted) {
+      update_source_offsets();
+    }
+  }
+}
+
+void FlightIndex::clear() {
+  flights.clear();
+  source_offsets.clear();
+  sorted = false;
+  version++;
+}
+
 void FlightIndex::sort_flights() {
     if (!sorted) {
-        std::sort(flights.begin(), flights.end(), FlightCompareVertex());
+        std::sort(flights.begin(), flights.end(), FlightCompareSource());
         sorted = true;
+        update_source_offsets();
+    }
+}
+
+void FlightIndex::update_source_offsets() {
+    vertex_t nsrc = flights.empty() ? 0 : flights.back().src + 1;
+    source_offsets.assign(nsrc + 1, 0);
+    for (const auto &flight : flights) {
+        source_offsets[flight.src + 1]++;
+    }
+    for (vertex_t src = 0; src < nsrc; src++) {
+        source_offsets[src + 1] += source_offsets[src];
     }
 }
 
@@ -37,27 +117,59 @@ std::vector<Flight> FlightIndex::select_flights(
     if (!sorted) {
         throw std::invalid_argument("Flights set must be sorted");
     }
+    return select_source_flights(
+        flights.data(), source_offsets.data(), source_offsets.size() - 1,
+        src_vs, nsrc_v, dst_vs, ndst_v, start_time, end_time
+    );
+}
 
-    std::vector<Flight> out;
+std::vector<Flight> select_source_flights(
+    const Flight *flights, const std::size_t *source_offsets, std::size_t nsources,
+    const vertex_t *src_vs, int nsrc_v,
+    const vertex_t *dst_vs, int ndst_v,
+    flight_time_t start_time, flight_time_t end_time
+) {
+    std::vector<bool> dst_mask;
+    for (int j=0; j<ndst_v; j++) {
+        if (dst_vs[j] >= 0) {
+            if (dst_vs[j] >= (vertex_t)dst_mask.size()) {
+                dst_mask.resize(dst_vs[j] + 1);
+            }
+            dst_mask[dst_vs[j]] = true;
+        }
+    }
+
+    // Time windows of every source, found by binary search in the source's flights
+    std::vector<std::pair<std::size_t, std::size_t>> windows;
+    std::size_t max_size = 0;
     Flight search_flight;
     for (int i=0; i<nsrc_v; i++) {
-        search_flight.src = src_vs[i];
-        for (int j=0; j<ndst_v; j++) {
-            search_flight.dst = dst_vs[j];
-            search_flight.start_time = start_time;
-            auto start = std::lower_bound(
-                flights.begin(), flights.end(), search_flight, FlightCompareVertex()
-            );
-            search_flight.start_time = end_time;
-            auto end = std::upper_bound(
-                flights.begin(), flights.end(), search_flight, FlightCompareVertex()
-            );
-            if (start != end) {
-                out.reserve(out.size() + std::distance(start, end));
-                out.insert(out.end(), start, end);
+        auto src = src_vs[i];
+        if (src < 0 || (std::size_t)src >= nsources) {
+            continue;
+        }
+        auto src_begin = flights + source_offsets[src];
+        auto src_end = flights + source_offsets[src + 1];
+        search_flight.src = src;
+        search_flight.start_time = start_time;
+        auto start = std::lower_bound(src_begin, src_end, search_flight, FlightCompareSourceTime());
+        search_flight.start_time = end_time;
+        auto end = std::upper_bound(start, src_end, search_flight, FlightCompareSourceTime());
+        if (start != end) {
+            windows.emplace_back(start - flights, end - flights);
+            max_size += end - start;
+        }
+    }
+
+    std::vector<Flight> out;
+    out.reserve(max_size);
+    for (auto [start, end] : windows) {
+        for (auto pos = start; pos < end; pos++) {
+            const auto &flight = flights[pos];
+            if (flight.dst >= 0 && flight.dst < (vertex_t)dst_mask.size() && dst_mask[flight.dst]) {
+                out.push_back(flight);
             }
         }
     }
-    std::cout << out.size() << std::endl;
     return out;
 }
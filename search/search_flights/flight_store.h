@@ -2,21 +2,49 @@
 #include <vector>
 
 
-struct FlightCompareVertex {
+// Flights of one source are contiguous and ordered by the time selections use
+struct FlightCompareSource {
     inline bool operator()(const Flight& a, const Flight& b) const {
         if (a.src != b.src) {
             return a.src < b.src;
         }
-        if (a.dst != b.dst) {
-            return a.dst < b.dst;
+        auto a_time = a.start_time + a.duration;
+        auto b_time = b.start_time + b.duration;
+        if (a_time != b_time) {
+            return a_time < b_time;
+        }
+        return a.dst < b.dst;
+    }
+};
+
+struct FlightCompareSourceTime {
+    inline bool operator()(const Flight& a, const Flight& b) const {
+        if (a.src != b.src) {
+            return a.src < b.src;
         }
         return a.start_time + a.duration < b.start_time + b.duration;
     }
 };
 
+// Flights of `src_vs` sources to `dst_vs` destinations arriving in [start_time, end_time],
+// `flights` are sorted with FlightCompareSource and indexed by `source_offsets`
+std::vector<Flight> select_source_flights(
+    const Flight *flights, const std::size_t *source_offsets, std::size_t nsources,
+    const vertex_t *src_vs, int nsrc_v,
+    const vertex_t *dst_vs, int ndst_v,
+    flight_time_t start_time, flight_time_t end_time
+);
+
 class FlightIndex {
     std::vector<Flight> flights;
     bool sorted = false;
+    // Bumped on every change of the flights data
+    unsigned long version = 0;
+    // Flights departing from `src` are flights[source_offsets[src]:source_offsets[src+1]]
+    // while sorted
+    std::vector<std::size_t> source_offsets;
+
+    void update_source_offsets();
 
     public:
 
@@ -32,6 +60,20 @@ class FlightIndex {
         flight_time_t day_end_time, flight_duration_t duration,
         cost_t cost
     );
+    void push_flights(
+        std::size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+        const flight_time_t *start_time, const flight_time_t *day_start_time,
+        const flight_time_t *day_end_time, const flight_duration_t *duration,
+        const cost_t *cost
+    );
+    void merge_flights(
+        std::size_t n, const flight_t *id, const vertex_t *src, const vertex_t *dst,
+        const flight_time_t *start_time, const flight_time_t *day_start_time,
+        const flight_time_t *day_end_time, const flight_duration_t *duration,
+        const cost_t *cost
+    );
+    void remove_flights(std::size_t n, const flight_t *ids);
+    void clear();
     void sort_flights();
     std::vector<Flight> select_flights(
         const vertex_t *src_vs, int nsrc_v,
@@ -41,4 +83,42 @@ class FlightIndex {
     inline auto size() {
         return flights.size();
     }
+    inline auto get_version() const {
+        return version;
+    }
+    inline bool is_sorted() const {
+        return sorted;
+    }
+    inline const auto &get_source_offsets() const {
+        return source_offsets;
+    }
+};
+
+// Read-only sorted flights and source offsets in external memory, e.g. exported by a FlightIndex
+// to files that many processes map
+class FlightIndexView {
+    const Flight *flights = nullptr;
+    std::size_t nflights = 0;
+    const std::size_t *source_offsets = nullptr;
+    std::size_t nsources = 0;
+
+    public:
+
+    FlightIndexView() {}
+    FlightIndexView(
+        const Flight *flights, std::size_t nflights,
+        const std::size_t *source_offsets, std::size_t nsources
+    ) : flights(flights), nflights(nflights), source_offsets(source_offsets), nsources(nsources) {}
+    inline std::vector<Flight> select_flights(
+        const vertex_t *src_vs, int nsrc_v,
+        const vertex_t *dst_vs, int ndst_v,
+        flight_time_t start_time, flight_time_t end_time
+    ) const {
+        return select_source_flights(
+            flights, source_offsets, nsources, src_vs, nsrc_v, dst_vs, ndst_v, start_time, end_time
+        );
+    }
+    inline auto size() const {
+        return nflights;
+    }
 };
@@ -0,0 +1,162 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+
+FLIGHT_NUMBER_BASE = int(1e4)
+
+
+def code_to_key(code: str) -> int:
+    return int(code, 36)
+
+
+def key_to_code(key: int, width: int) -> str:
+    return np.base_repr(key, 36).rjust(width, '0')
+
+
+# Append-only id <-> key table, both directions are plain array lookups.
+# `codes` maps id -> key, `ids` maps key -> id (-1 when not interned).
+# String codes (airports, carriers) use their base 36 value as key, so the table
+# can also stand in for the `city_idx` dict used by the loaders.
+class CodeTable:
+    def __init__(self, codes: np.ndarray, ids: np.ndarray, width: int = 0):
+        self.codes = codes
+        self.ids = ids
+        self.width = width
+
+    @classmethod
+    def empty(cls, key_space: int = 0, width: int = 0):
+        return cls(np.empty(0, dtype=np.int32), np.full(key_space, -1, dtype=np.int32), width)
+
+    @classmethod
+    def load(cls, path_prefix: str, key_space: int = 0, width: int = 0, mmap_mode: Optional[str] = 'c'):
+        try:
+            return cls(
+                np.load(f'{path_prefix}_codes.npy', mmap_mode=mmap_mode),
+                np.load(f'{path_prefix}_ids.npy', mmap_mode=mmap_mode),
+                width
+            )
+        except FileNotFoundError:
+            return cls.empty(key_space, width)
+
+    def save(self, path_prefix: str):
+        for name, values in (('codes', self.codes), ('ids', self.ids)):
+            tmp_path = f'{path_prefix}_{name}.tmp.npy'
+            np.save(tmp_path, values)
+            os.replace(tmp_path, f'{path_prefix}_{name}.npy')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return f'CodeTable(len={len(self)}, key_space={len(self.ids)})'
+
+    def get_id(self, key: int) -> int:
+        if 0 <= key < len(self.ids):
+            return int(self.ids[key])
+        return -1
+
+    def get_key(self, id: int) -> int:
+        return int(self.codes[id])
+
+    def _grow(self, key_space: int):
+        if key_space > len(self.ids):
+            self.ids = np.concatenate((
+                self.ids, np.full(key_space - len(self.ids), -1, dtype=np.int32)
+            ))
+
+    def intern(self, key: int) -> int:
+        id = self.get_id(key)
+        if id < 0:
+            self._grow(key + 1)
+            id = len(self.codes)
+            self.codes = np.append(self.codes, np.int32(key))
+            self.ids[key] = id
+        return id
+
+    def lookup_keys(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys)
+        ids = np.full(keys.shape, -1, dtype=np.int32)
+        known = keys < len(self.ids)
+        ids[known] = self.ids[keys[known]]
+        return ids
+
+    def intern_keys(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys)
+        if len(keys):
+            self._grow(int(keys.max()) + 1)
+            # np.unique keeps the new ids independent of the input order
+            new_keys = np.unique(keys[self.ids[keys] < 0])
+            self.ids[new_keys] = np.arange(len(self.codes), len(self.codes) + len(new_keys))
+            self.codes = np.concatenate((self.codes, new_keys.astype(np.int32)))
+        return self.ids[keys]
+
+    # dict-like access by string code
+    def __contains__(self, code: str):
+        return self.get_id(code_to_key(code)) >= 0
+
+    def __getitem__(self, code: str) -> int:
+        id = self.get_id(code_to_key(code))
+        if id < 0:
+            raise KeyError(code)
+        return id
+
+    def __setitem__(self, code: str, id: int):
+        if id != len(self) or code in self:
+            raise ValueError(f'Interned ids are append-only, cannot set {code} to {id}')
+        self.intern(code_to_key(code))
+
+    def code(self, id: int) -> str:
+        return key_to_code(self.get_key(id), self.width)
+
+    def keys(self):
+        return [self.code(id) for id in range(len(self))]
+
+    def items(self):
+        return [(self.code(id), id) for id in range(len(self))]
+
+
+# Persistent airport, carrier and flight number ids shared by the loaders, caches and search.
+# Flight numbers use the flight_id_to_int encoding (carrier * 1e4 + number) and are
+# stored as dense ids of (carrier id, number).
+class InternTable:
+    def __init__(self, root_dir: str, mmap_mode: Optional[str] = 'c'):
+        self.root_dir = root_dir
+        self.airports = CodeTable.load(self._path('airports'), 36 ** 3, 3, mmap_mode)
+        self.carriers = CodeTable.load(self._path('carriers'), 36 ** 2, 2, mmap_mode)
+        self.flights = CodeTable.load(self._path('flights'), 0, 0, mmap_mode)
+
+    def _path(self, name):
+        return os.path.join(self.root_dir, name)
+
+    def __repr__(self):
+        return (
+            f'InternTable(airports={len(self.airports)}, carriers={len(self.carriers)}, '
+            f'flights={len(self.flights)})'
+        )
+
+    def save(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        self.airports.save(self._path('airports'))
+        self.carriers.save(self._path('carriers'))
+        self.flights.save(self._path('flights'))
+
+    def _flight_keys(self, flight_numbers: np.ndarray) -> np.ndarray:
+        carrier_ids = self.carriers.intern_keys(flight_numbers // FLIGHT_NUMBER_BASE)
+        return carrier_ids.astype(np.int64) * FLIGHT_NUMBER_BASE + flight_numbers % FLIGHT_NUMBER_BASE
+
+    def intern_flight_number(self, flight_number: int) -> int:
+        carrier_id = self.carriers.intern(flight_number // FLIGHT_NUMBER_BASE)
+        return self.flights.intern(carrier_id * FLIGHT_NUMBER_BASE + flight_number % FLIGHT_NUMBER_BASE)
+
+    def intern_flight_numbers(self, flight_numbers: np.ndarray) -> np.ndarray:
+        return self.flights.intern_keys(self._flight_keys(np.asarray(flight_numbers, dtype=np.int64)))
+
+    def flight_number(self, flight_id: int) -> int:
+        carrier_id, number = divmod(self.flights.get_key(flight_id), FLIGHT_NUMBER_BASE)
+        return self.carriers.get_key(carrier_id) * FLIGHT_NUMBER_BASE + number
+
+    def flight_code(self, flight_id: int) -> str:
+        carrier_id, number = divmod(self.flights.get_key(flight_id), FLIGHT_NUMBER_BASE)
+        return f'{self.carriers.code(carrier_id)}{number}'
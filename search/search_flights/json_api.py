@@ -0,0 +1,47 @@
+import json
+from functools import wraps
+from sys import exc_info
+from traceback import format_exception
+from typing import Callable, Dict
+
+from flask import jsonify, request
+
+
+def parse_args(args: Dict[str, str]):
+    parsed = {}
+    for k, v in args.items():
+        if v and v[0] in ('[', '{') and v[-1] in (']', '}'):
+            try:
+                parsed[k] = json.loads(v)
+            except Exception as e:
+                raise ValueError(f'Failed to parse JSON for {k}: {e}') from e
+        else:
+            parsed[k] = v
+    return parsed
+
+
+# Async Flask view decorator of the search server: the view gets the JSON body of a POST and
+# the query arguments as keyword arguments, its result is returned as JSON.
+# ValueError is a 400 response, any other error a 500 one with the stack.
+# format_result turns results (and error bodies) into JSON-serializable values.
+def json_request(func=None, *, format_result: Callable = lambda o: o):
+    if func is None:
+        return lambda func: json_request(func, format_result=format_result)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            if request.method == 'POST' and request.data:
+                kwargs.update(json.loads(request.data))
+            kwargs.update(parse_args(request.args))
+            return jsonify(format_result(await func(*args, **kwargs))), 200
+        except ValueError as e:
+            return jsonify(format_result(dict(error=str(e)))), 400
+        except Exception as e:
+            return jsonify(format_result(dict(
+                stack=format_exception(*exc_info()),
+                error=str(e),
+                type=type(e).__name__,
+            ))), 500
+
+    return wrapper
@@ -0,0 +1,119 @@
+import json
+import re
+from typing import TextIO
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789+-.eE'
+_CONTAINER_TOKEN = re.compile(r'["\[\]{}]')
+_STRING_TOKEN = re.compile(r'["\\]')
+
+
+# Incremental reader for a JSON text stream. Containers are walked with iter_object / iter_array
+# and only the values read with value() are built, so memory stays bounded by the largest single
+# value read, not by the whole document.
+class JsonStream:
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int):
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill(self.chunk_size)
+
+    def _next(self, expected: str) -> str:
+        c = self.peek()
+        if not c or c not in expected:
+            raise ValueError(f'Expected one of `{expected}` at stream position, got `{c}`')
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number may continue in the next chunk
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(read_size)
+            read_size *= 2
+
+    # Scans past the next value without building it: only string bounds and brackets are tracked
+    def skip(self):
+        if self.peek() not in ('{', '[', '"'):
+            self.value()
+            return
+
+        depth = 0
+        in_string = False
+        pos = self.pos
+        while True:
+            match = (_STRING_TOKEN if in_string else _CONTAINER_TOKEN).search(self.buf, pos)
+            # an escape is only skipped together with the escaped character
+            if match is None or (match.group() == '\\' and match.end() == len(self.buf)):
+                if self.eof:
+                    raise ValueError('Unexpected end of stream inside a skipped value')
+                self.pos = match.start() if match is not None else len(self.buf)
+                self._fill(self.chunk_size)
+                pos = self.pos
+                continue
+
+            token = match.group()
+            pos = match.end()
+            if token == '\\':
+                pos += 1
+                continue
+            if token == '"':
+                in_string = not in_string
+            elif token in '[{':
+                depth += 1
+            else:
+                depth -= 1
+            if not in_string and not depth:
+                self.pos = pos
+                return
+
+    # Yields keys, the caller has to consume each value before resuming
+    def iter_object(self):
+        self._next('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._next(':')
+            yield key
+            if self._next(',}') == '}':
+                return
+
+    # Yields once per item, the caller has to consume each item before resuming
+    def iter_array(self):
+        self._next('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self._next(',]') == ']':
+                return
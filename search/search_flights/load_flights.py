@@ -1,21 +1,43 @@
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 import os
 import json
 import lzma as xz
 import logging
 from datetime import UTC, datetime, timedelta
-from typing import Dict
+from typing import Dict, Iterable, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
 
 from .flight_optim import FlightIndex
+from .json_stream import JsonStream
 
 
-def iterate_json_xz(root_dir: str):
-    for root, _, files in os.walk(root_dir):
-        for file in files:
+def list_json_xz(root_dir: str):
+    files = []
+    for root, _, root_files in os.walk(root_dir):
+        for file in root_files:
             if file.endswith('.json.xz'):
-                file_path = os.path.join(root, file)
-                with xz.open(file_path, 'rt', encoding='utf-8') as f:
-                    yield json.load(f)
+                files.append(os.path.join(root, file))
+    return sorted(files)
+
+
+def load_json_xz(file_path: str):
+    with xz.open(file_path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iterate_json_xz(root_dir: str):
+    for file_path in list_json_xz(root_dir):
+        yield load_json_xz(file_path)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def days_since_epoch(date: datetime):
+    return (date - EPOCH).total_seconds() / 86400
 
 
 def date_to_days(date_str, date_base):
@@ -35,6 +57,27 @@ def get_day_time(date_str):
     ).total_seconds() / 86400
 
 
+def _to_datetime64(date_strs: Sequence[str]):
+    return np.char.replace(np.asarray(date_strs, dtype=str), 'Z', '').astype('datetime64[us]')
+
+
+# Batched versions of date_to_days, _parse_time and get_day_time, results are bit-identical
+def dates_to_days(date_strs: Sequence[str], date_base: datetime):
+    base = np.datetime64(date_base.astimezone(UTC).replace(tzinfo=None), 'us')
+    return (_to_datetime64(date_strs) - base).astype(np.int64) / 10**6 / 86400
+
+
+def parse_times(time_strs: Sequence[str]):
+    # offsets repeat a lot, parse only the distinct ones
+    offsets, inverse = np.unique(np.asarray(time_strs, dtype=str), return_inverse=True)
+    return np.array([_parse_time(t) for t in offsets.tolist()], dtype=np.float64)[inverse]
+
+
+def get_day_times(date_strs: Sequence[str]):
+    dates = _to_datetime64(date_strs)
+    return (dates.astype('datetime64[s]') - dates.astype('datetime64[D]')).astype(np.int64) / 86400
+
+
 def city_to_num(idx, code):
     if code in idx:
         return idx[code]
@@ -47,40 +90,35 @@ def flight_id_to_int(flight_id):
     return int(clean_id[:2], 36) * int(1e4) + int(clean_id[2:],)
 
 
-# def int_to_flight_id(numeric_id):
-#     return (
-#         np.base_repr(numeric_id // int(1e6), 36).upper()
-#         + f'{numeric_id % int(1e6):04d}'
-#     )
+def _get_fetch_time(date_str, datetime_base):
+    if not date_str:
+        return float('-inf')
+    return date_to_days(date_str, datetime_base)
 
 
-def load_ryanair_flights(
-    flights: FlightIndex, root_dir, datetime_base,
-    city_idx: Dict, flight_id_idx: defaultdict[int]
-):
-    for data in iterate_json_xz(root_dir):
-        for t in data['booking']['trips'][0]['dates']:
-            for f in t['flights']:
-                if f.get('regularFare'):
-                    flight_id = flight_id_to_int(f['flightNumber'])
-                    flight_id_idx[flight_id] += 1
-                    flight_id = flight_id * 100 + flight_id_idx[flight_id]
-
-                    src = city_to_num(city_idx, f['segments'][0]['origin'])
-                    dst = city_to_num(city_idx, f['segments'][0]['destination'])
-                    date_start, date_end = f['timeUTC']
-                    date_start = date_to_days(date_start, datetime_base)
-                    date_end = date_to_days(date_end, datetime_base)
-                    day_start_time = get_day_time(f['time'][0])
-                    day_end_time = get_day_time(f['time'][1])
-                    price = f['regularFare']['fares'][0]['publishedFare']
-                    # print(flight_id, src, '->', dst, (date_end - date_start) * 24, f['segments'][0]['duration'], price)
-                    flights.push_flight(
-                        id=flight_id, src=src, dst=dst,
-                        start_time=date_start, day_start_time=day_start_time,
-                        day_end_time=day_end_time,
-                        duration=date_end - date_start, cost=price
-                    )
+# Parsers yield compact flight tuples:
+# (flight_number, src_code, dst_code, start_time, day_start_time, day_end_time, duration, cost, fetch_time)
+def parse_ryanair_flights(data, datetime_base):
+    flights = [
+        f for t in data['booking']['trips'][0]['dates']
+        for f in t['flights'] if f.get('regularFare')
+    ]
+    if not flights:
+        return
+
+    date_start = dates_to_days([f['timeUTC'][0] for f in flights], datetime_base)
+    date_end = dates_to_days([f['timeUTC'][1] for f in flights], datetime_base)
+    day_start_time = get_day_times([f['time'][0] for f in flights])
+    day_end_time = get_day_times([f['time'][1] for f in flights])
+    yield from zip(
+        (flight_id_to_int(f['flightNumber']) for f in flights),
+        (f['segments'][0]['origin'] for f in flights),
+        (f['segments'][0]['destination'] for f in flights),
+        date_start.tolist(), day_start_time.tolist(), day_end_time.tolist(),
+        (date_end - date_start).tolist(),
+        (f['regularFare']['fares'][0]['publishedFare'] for f in flights),
+        repeat(_get_fetch_time(data.get('fetch_date'), datetime_base))
+    )
 
 
 def _get_wizzair_prices(fares):
@@ -91,30 +129,338 @@ def _get_wizzair_prices(fares):
     return prices
 
 
+def _get_wizzair_flight_fields(flight):
+    prices = _get_wizzair_prices(flight['fares'])
+    logging.debug(f'{flight["carrierCode"]}{flight["flightNumber"]} prices {prices}')
+    if prices:
+        return (
+            flight['carrierCode'] + flight['flightNumber'],
+            flight['departureStation'], flight['arrivalStation'],
+            flight['departureDateTime'], flight['arrivalDateTime'],
+            flight['departureTimeUtcOffset'], flight['arrivalTimeUtcOffset'],
+            prices['basic']
+        )
+
+
+def _convert_wizzair_flights(flights, fetch_timestamp, datetime_base):
+    if not flights:
+        return
+
+    (
+        flight_numbers, src_codes, dst_codes, departures, arrivals,
+        departure_offsets, arrival_offsets, costs
+    ) = zip(*flights)
+    date_start = dates_to_days(departures, datetime_base) - parse_times(departure_offsets)
+    date_end = dates_to_days(arrivals, datetime_base) - parse_times(arrival_offsets)
+    yield from zip(
+        map(flight_id_to_int, flight_numbers), src_codes, dst_codes,
+        date_start.tolist(), get_day_times(departures).tolist(),
+        get_day_times(arrivals).tolist(), (date_end - date_start).tolist(), costs,
+        repeat(_get_fetch_time(fetch_timestamp, datetime_base))
+    )
+
+
+def parse_wizzair_flights(data, datetime_base):
+    flights = []
+    for flight in data['body'].get('outboundFlights') or ():
+        fields = _get_wizzair_flight_fields(flight)
+        if fields:
+            flights.append(fields)
+    yield from _convert_wizzair_flights(flights, data.get('fetch_timestamp'), datetime_base)
+
+
+# Same result as parse_wizzair_flights, but reads the file incrementally and builds
+# only single flights of `body.outboundFlights`, never the whole response
+def stream_wizzair_flights(f: TextIO, datetime_base):
+    flights = []
+    fetch_timestamp = None
+    stream = JsonStream(f)
+    for key in stream.iter_object():
+        if key == 'body' and stream.peek() == '{':
+            for body_key in stream.iter_object():
+                if body_key == 'outboundFlights' and stream.peek() == '[':
+                    for _ in stream.iter_array():
+                        fields = _get_wizzair_flight_fields(stream.value())
+                        if fields:
+                            flights.append(fields)
+                else:
+                    stream.skip()
+        elif key == 'fetch_timestamp':
+            fetch_timestamp = stream.value()
+        else:
+            stream.skip()
+    yield from _convert_wizzair_flights(flights, fetch_timestamp, datetime_base)
+
+
+STREAM_PARSERS = {
+    'wizzair': stream_wizzair_flights,
+}
+
+
+# stream - the parser reads a text file (STREAM_PARSERS), not the decoded JSON document
+def _parse_file_flights(file_path, parser, datetime_base, stream: bool = False):
+    if stream:
+        with xz.open(file_path, 'rt', encoding='utf-8') as f:
+            return tuple(parser(f, datetime_base))
+    return tuple(parser(load_json_xz(file_path), datetime_base))
+
+
+# Route and departure date predicate of the raw loaders (iterate_flights, load_*_flights), with
+# a DatasetManifest they skip the files that can not match. FlightCache caches every file and takes no filter.
+class FlightFilter:
+    def __init__(
+        self, src_codes: Optional[Iterable[str]] = None, dst_codes: Optional[Iterable[str]] = None,
+        start_date: Optional[datetime] = None, end_date: Optional[datetime] = None
+    ):
+        self.src_codes = frozenset(src_codes) if src_codes is not None else None
+        self.dst_codes = frozenset(dst_codes) if dst_codes is not None else None
+        self.start_time = days_since_epoch(start_date) if start_date is not None else -np.inf
+        self.end_time = days_since_epoch(end_date) if end_date is not None else np.inf
+
+    def __repr__(self):
+        return (
+            f"FlightFilter(src_codes={self.src_codes}, dst_codes={self.dst_codes}, "
+            f"start_time={self.start_time}, end_time={self.end_time})"
+        )
+
+    def match_route(self, src_code, dst_code):
+        return (
+            (self.src_codes is None or src_code in self.src_codes)
+            and (self.dst_codes is None or dst_code in self.dst_codes)
+        )
+
+    # start_range - absolute departure range as days since EPOCH
+    def match_file(self, routes, start_range):
+        return (
+            start_range[0] <= self.end_time and self.start_time <= start_range[1]
+            and any(self.match_route(src_code, dst_code) for src_code, dst_code in routes)
+        )
+
+    def filter_flights(self, parsed_flights, base_days):
+        start_time = self.start_time - base_days
+        end_time = self.end_time - base_days
+        for flight in parsed_flights:
+            if start_time <= flight[3] <= end_time and self.match_route(flight[1], flight[2]):
+                yield flight
+
+
+# Maps every scrape file of a dataset directory to its routes and departure range,
+# so loaders with a FlightFilter open only the files that can match.
+# Entries are added as a side effect of loading, new or modified files are always read.
+class DatasetManifest:
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, 'manifest.json')
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)['files']
+        except FileNotFoundError:
+            self.files = {}
+        self.changed = False
+
+    def _get_entry(self, file_path):
+        entry = self.files.get(os.path.relpath(file_path, self.root_dir))
+        if entry is not None and entry['mtime'] == os.path.getmtime(file_path):
+            return entry
+
+    def may_match(self, file_path, flight_filter: FlightFilter):
+        entry = self._get_entry(file_path)
+        return entry is None or flight_filter.match_file(entry['routes'], entry['start_range'])
+
+    def add_file(self, file_path, parsed_flights, base_days):
+        if self._get_entry(file_path) is not None:
+            return
+        start_times = [f[3] + base_days for f in parsed_flights]
+        self.files[os.path.relpath(file_path, self.root_dir)] = dict(
+            mtime=os.path.getmtime(file_path),
+            routes=sorted({(f[1], f[2]) for f in parsed_flights}),
+            start_range=(min(start_times), max(start_times)) if start_times else (np.inf, -np.inf),
+        )
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(files=self.files), f)
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+def _map_files_flights(
+    files, parser, datetime_base, processes: Optional[int] = 1, stream: bool = False
+):
+    parse_file = partial(_parse_file_flights, parser=parser, datetime_base=datetime_base, stream=stream)
+    if processes == 1:
+        yield from zip(files, map(parse_file, files))
+        return
+
+    # map() keeps file order, so numbering does not depend on worker scheduling
+    processes = processes or os.cpu_count()
+    chunksize = max(1, len(files) // (4 * processes))
+    with ProcessPoolExecutor(processes) as pool:
+        yield from zip(files, pool.map(parse_file, files, chunksize=chunksize))
+
+
+def iterate_files_flights(
+    files, parser, datetime_base, processes: Optional[int] = 1,
+    flight_filter: Optional[FlightFilter] = None, manifest: Optional[DatasetManifest] = None,
+    stream: bool = False
+):
+    if flight_filter is not None and manifest is not None:
+        files = [f for f in files if manifest.may_match(f, flight_filter)]
+
+    base_days = days_since_epoch(datetime_base)
+    for file_path, file_flights in _map_files_flights(files, parser, datetime_base, processes, stream):
+        if manifest is not None:
+            manifest.add_file(file_path, file_flights, base_days)
+        if flight_filter is not None:
+            file_flights = flight_filter.filter_flights(file_flights, base_days)
+        yield from file_flights
+
+    if manifest is not None:
+        manifest.save()
+
+
+def iterate_flights(
+    root_dir, parser, datetime_base, processes: Optional[int] = 1,
+    flight_filter: Optional[FlightFilter] = None, use_manifest: bool = True, stream: bool = False
+):
+    yield from iterate_files_flights(
+        list_json_xz(root_dir), parser, datetime_base, processes,
+        flight_filter, DatasetManifest(root_dir) if use_manifest else None, stream
+    )
+
+
+# Numbers flights by (flight_number, start_time) in order of first appearance: every snapshot
+# of a flight shares its id, pass the same flight_id_idx to number several loads consistently
+def number_parsed_flights(parsed_flights, city_idx: Dict, flight_id_idx: Dict[Tuple[int, float], int]):
+    for (
+        flight_number, src_code, dst_code, start_time,
+        day_start_time, day_end_time, duration, cost, fetch_time
+    ) in parsed_flights:
+        flight_id = flight_id_idx.get((flight_number, start_time))
+        if flight_id is None:
+            flight_id = flight_id_idx[flight_number, start_time] = len(flight_id_idx)
+        yield (
+            flight_id,
+            city_to_num(city_idx, src_code), city_to_num(city_idx, dst_code),
+            start_time, day_start_time, day_end_time, duration, cost,
+            flight_number, fetch_time
+        )
+
+
+FLIGHT_COLUMNS = {
+    'id': np.int32,
+    'src': np.int32,
+    'dst': np.int32,
+    'start_time': np.float32,
+    'day_start_time': np.float32,
+    'day_end_time': np.float32,
+    'duration': np.float32,
+    'cost': np.float32,
+}
+
+# Every scrape of a flight is a separate snapshot, id and fetch_time identify it
+SNAPSHOT_COLUMNS = FLIGHT_COLUMNS | {
+    'flight_number': np.int32,
+    'fetch_time': np.float64,
+}
+
+
+def rows_to_columns(rows, column_types: Dict = SNAPSHOT_COLUMNS):
+    values = tuple(zip(*rows)) if rows else ((),) * len(column_types)
+    return {
+        name: np.array(column, dtype=dtype)
+        for (name, dtype), column in zip(column_types.items(), values)
+    }
+
+
+def _index_columns(columns: Dict[str, np.ndarray]):
+    return {
+        name: np.ascontiguousarray(columns[name], dtype=dtype)
+        for name, dtype in FLIGHT_COLUMNS.items()
+    }
+
+
+def push_columns(flights: FlightIndex, columns: Dict[str, np.ndarray], sort: bool = False):
+    flights.push_flights(**_index_columns(columns), sort=sort)
+
+
+def merge_columns(flights: FlightIndex, columns: Dict[str, np.ndarray]):
+    flights.merge_flights(**_index_columns(columns))
+
+
+# Rows of the snapshots kept per (flight_number, start_time), in row order:
+# 'latest' - the newest by fetch_time, 'min_price' - the cheapest, None - keep all
+def dedup_rows(columns: Dict[str, np.ndarray], policy: Optional[str] = 'latest') -> np.ndarray:
+    flight_number = columns['flight_number']
+    start_time = columns['start_time']
+    if policy is None:
+        return np.arange(len(flight_number))
+    if policy == 'latest':
+        order = np.lexsort((-columns['fetch_time'], start_time, flight_number))
+    elif policy == 'min_price':
+        order = np.lexsort((-columns['fetch_time'], columns['cost'], start_time, flight_number))
+    else:
+        raise ValueError(f'Unknown dedup policy: {policy}')
+
+    flight_number = flight_number[order]
+    start_time = start_time[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (flight_number[1:] != flight_number[:-1]) | (start_time[1:] != start_time[:-1])
+    return np.sort(order[first])
+
+
+def dedup_columns(columns: Dict[str, np.ndarray], policy: Optional[str] = 'latest'):
+    if policy is None:
+        return columns
+    keep = dedup_rows(columns, policy)
+    return {
+        name: column[keep] for name, column in columns.items()
+    }
+
+
+def push_parsed_flights(
+    flights: FlightIndex, parsed_flights,
+    city_idx: Dict, flight_id_idx: Dict[Tuple[int, float], int],
+    dedup: Optional[str] = 'latest'
+):
+    push_columns(flights, dedup_columns(rows_to_columns(tuple(
+        number_parsed_flights(parsed_flights, city_idx, flight_id_idx)
+    )), dedup))
+
+
+def load_ryanair_flights(
+    flights: FlightIndex, root_dir, datetime_base,
+    city_idx: Dict, flight_id_idx: Dict[Tuple[int, float], int],
+    processes: Optional[int] = 1, dedup: Optional[str] = 'latest',
+    flight_filter: Optional[FlightFilter] = None
+):
+    push_parsed_flights(
+        flights, iterate_flights(
+            root_dir, parse_ryanair_flights, datetime_base, processes, flight_filter
+        ),
+        city_idx, flight_id_idx, dedup
+    )
+
+
 def load_wizzair_flights(
     flights: FlightIndex, root_dir, datetime_base,
-    city_idx: Dict, flight_id_idx: defaultdict[int]
+    city_idx: Dict, flight_id_idx: Dict[Tuple[int, float], int],
+    processes: Optional[int] = 1, dedup: Optional[str] = 'latest',
+    flight_filter: Optional[FlightFilter] = None, stream: bool = False
 ):
-    for data in iterate_json_xz(root_dir):
-        if data['body'].get('outboundFlights'):
-            for flight in data['body']['outboundFlights']:
-                flight_id = flight_id_to_int(flight['carrierCode'] + flight['flightNumber'])
-                flight_id_idx[flight_id] += 1
-                flight_id = flight_id * 100 + flight_id_idx[flight_id]
-
-                src = city_to_num(city_idx, flight['departureStation'])
-                dst = city_to_num(city_idx, flight['arrivalStation'])
-                date_start = date_to_days(flight['departureDateTime'], datetime_base) - _parse_time(flight['departureTimeUtcOffset'])
-                date_end = date_to_days(flight['arrivalDateTime'], datetime_base) - _parse_time(flight['arrivalTimeUtcOffset'])
-                day_start_time = get_day_time(flight['departureDateTime'])
-                day_end_time = get_day_time(flight['arrivalDateTime'])
-                prices = _get_wizzair_prices(flight['fares'])
-                print(flight_id, src, '->', dst, 'prices', prices)
-
-                if prices:
-                    flights.push_flight(
-                        id=flight_id, src=src, dst=dst,
-                        start_time=date_start, day_start_time=day_start_time,
-                        day_end_time=day_end_time,
-                        duration=date_end - date_start, cost=prices['basic']
-                    )
+    parser = stream_wizzair_flights if stream else parse_wizzair_flights
+    push_parsed_flights(
+        flights, iterate_flights(
+            root_dir, parser, datetime_base, processes, flight_filter, stream=stream
+        ),
+        city_idx, flight_id_idx, dedup
+    )
+
+
+FLIGHT_PARSERS = {
+    'ryanair': parse_ryanair_flights,
+    'wizzair': parse_wizzair_flights,
+}
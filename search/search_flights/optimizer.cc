@@ -1,10 +1,18 @@
 #include "optimizer.h"
 #include "flight_structure.h"
 
+#include <atomic>
+#include <chrono>
 #include <cstdio>
+#include <exception>
+#include <limits>
+#include <stdexcept>
+#include <thread>
 #include <utility>
 #include <set>
 #include <algorithm>
+#include <queue>
+#include <tuple>
 #include <vector>
 #include <iostream>
 
@@ -72,6 +80,7 @@ FlightTravel extend_best_travel(
     const DiffCostSettings &wait_time_scoring,
     const DiffCostSettings &flight_start_scoring,
     const DiffCostSettings &flight_duration_scoring,
+    SearchStats *stats = nullptr,
     int min_check_flights=8
 ) {
     FlightTravel search_travel;
@@ -87,6 +96,9 @@ FlightTravel extend_best_travel(
 
     FlightTravel best_travel;
     best_travel.cost = 1e9;
+    if (stats) {
+        stats->travels_scanned += it_end - it;
+    }
     for (; it != it_end; ++it) {
         const auto &travel = *it;
         if (travel.end_vertex != flight.src || travel.end_time > flight.start_time) {
@@ -129,7 +141,8 @@ FlightTravel extend_best_travel(
 
 bool push_travel(
     std::vector<FlightTravel> &travel_vec, const FlightTravel &new_travel,
-    const TravelCoverSettings &settings
+    const TravelCoverSettings &settings, SearchStats *stats = nullptr,
+    std::vector<FlightTravel> *removed = nullptr
 ) {
     auto search_end_time = new_travel.end_time - settings.time_back;
 
@@ -145,17 +158,23 @@ bool push_travel(
 
         if (time_diff >= 0) {
             if (cost_diff >= time_diff * settings.back_cost_factor) {
+                if (stats) {
+                    stats->pruned_back++;
+                }
                 return false;
             }
         } else {
             if (cost_diff >= -time_diff * settings.forward_cost_factor) {
+                if (stats) {
+                    stats->pruned_forward++;
+                }
                 return false;
             }
         }
-        ++it;
     }
 
     // Remove travels this one covers
+    auto travels_count = travel_vec.size();
     while (!travel_vec.empty()) {
         auto travel = travel_vec.back();
         auto time_diff = travel.end_time - new_travel.end_time;
@@ -163,11 +182,17 @@ bool push_travel(
 
         if (time_diff >= 0) {
             if (cost_diff >= time_diff * settings.back_cost_factor) {
+                if (removed) {
+                    removed->push_back(travel);
+                }
                 travel_vec.pop_back();
                 continue;
             }
         } else {
             if (cost_diff >= -time_diff * settings.forward_cost_factor) {
+                if (removed) {
+                    removed->push_back(travel);
+                }
                 travel_vec.pop_back();
                 continue;
             }
@@ -175,6 +200,10 @@ bool push_travel(
         break;
     }
 
+    if (stats) {
+        stats->replaced += travels_count - travel_vec.size();
+    }
+
     // Insert travel
     travel_vec.push_back(new_travel);
     return true;
@@ -200,24 +229,144 @@ FlightTravel get_start_travel(
   };
 }
 
+// The k best costs of the trips kept so far, k = 0 keeps no bound. A trip dropped later
+// by push_travel is erased, so the bound only counts trips that are still kept.
+class TopCosts {
+    std::size_t k;
+    std::multiset<cost_t> top;
+    std::multiset<cost_t> rest;
+    cost_t min_pruned = std::numeric_limits<cost_t>::infinity();
+
+    public:
+    TopCosts(std::size_t k) : k(k) {}
+
+    // Cost a new trip has to beat to enter the top k
+    cost_t bound() const {
+        if (!k || top.size() < k) {
+            return 1e9;
+        }
+        return *top.rbegin();
+    }
+
+    void push(cost_t cost) {
+        if (!k) {
+            return;
+        }
+        top.insert(cost);
+        if (top.size() > k) {
+            auto last = std::prev(top.end());
+            rest.insert(*last);
+            top.erase(last);
+        }
+    }
+
+    void erase(cost_t cost) {
+        if (!k) {
+            return;
+        }
+        auto it = rest.find(cost);
+        if (it != rest.end()) {
+            rest.erase(it);
+            return;
+        }
+        it = top.find(cost);
+        if (it != top.end()) {
+            top.erase(it);
+            if (!rest.empty()) {
+                top.insert(*rest.begin());
+                rest.erase(rest.begin());
+            }
+        }
+    }
+
+    void pruned(cost_t cost) {
+        min_pruned = std::min(min_pruned, cost);
+    }
+
+    // Lowest cost of a travel dropped by the bound, trips below it are the same as without pruning
+    cost_t get_min_pruned() const {
+        return min_pruned;
+    }
+};
+
+// Start travels leave start_cities no earlier than start_time.
+// With top_costs set every created travel is a trip candidate scored with end_scoring.
+// Extensions only add non-negative costs, so a travel costing more than the current
+// k-th best trip can not lead to a better one and is dropped before it is extended.
 auto extend_travels(
     const std::map<vertex_t, std::vector<FlightTravel>> &travels_mapping,
     const std::vector<Flight> &flights, const TravelExtendSettings &settings,
-    travel_t &travel_id_inc, const std::set<vertex_t> &start_cities = {}
+    travel_t &travel_id_inc, const std::set<vertex_t> &start_cities = {},
+    flight_time_t start_time = -std::numeric_limits<flight_time_t>::infinity(),
+    TopCosts *top_costs = nullptr, const DiffCostSettings &end_scoring = zero_cost,
+    SearchStats *stats = nullptr
 ) {
     std::vector<Flight> flights_by_time = flights;
     std::sort(flights_by_time.begin(), flights_by_time.end(), FlightCompareTime());
 
     std::vector<FlightTravel> created_travels;
     std::map<vertex_t, std::vector<FlightTravel>> new_travels_by_city;
+    std::size_t frontier_size = 0;
+    std::vector<FlightTravel> removed;
+    auto push_city_travel = [&](const FlightTravel &travel) {
+        auto &city_travels = new_travels_by_city[travel.end_vertex];
+        auto city_size = city_travels.size();
+        removed.clear();
+        if (!push_travel(city_travels, travel, settings.cover_settings, stats, top_costs ? &removed : nullptr)) {
+            return false;
+        }
+        for (const auto &removed_travel : removed) {
+            top_costs->erase(removed_travel.cost + score_diff(end_scoring, removed_travel.day_end_time));
+        }
+        if (stats) {
+            frontier_size += city_travels.size();
+            frontier_size -= city_size;
+            stats->peak_frontier = std::max(stats->peak_frontier, frontier_size);
+        }
+        return true;
+    };
+    auto push_extension = [&](FlightTravel &new_travel) {
+        if (new_travel.cost >= 1e8) {
+            if (stats) {
+                stats->no_travel++;
+            }
+            return;
+        }
+        if (stats) {
+            stats->travels_expanded++;
+        }
+        if (top_costs && new_travel.cost >= top_costs->bound()) {
+            top_costs->pruned(new_travel.cost);
+            if (stats) {
+                stats->pruned_top_k++;
+            }
+            return;
+        }
+        new_travel.id = travel_id_inc;
+        if (push_city_travel(new_travel)) {
+            created_travels.push_back(new_travel);
+            ++travel_id_inc;
+            if (top_costs) {
+                top_costs->push(new_travel.cost + score_diff(end_scoring, new_travel.day_end_time));
+            }
+        }
+    };
+
     for (const auto &flight : flights_by_time) {
+        if (stats) {
+            stats->flights_scanned++;
+        }
+
         // start travel
-        if (start_cities.count(flight.src)) {
+        if (flight.start_time >= start_time && start_cities.count(flight.src)) {
             auto start_travel = get_start_travel(
                 flight, settings.flight_start_day_time, settings.flight_duration);
             // std::cout << start_travel.cost << std::endl;
             start_travel.id = travel_id_inc;
-            if (push_travel(new_travels_by_city[flight.dst], start_travel, settings.cover_settings)) {
+            if (stats) {
+                stats->travels_expanded++;
+            }
+            if (push_city_travel(start_travel)) {
                 created_travels.push_back(start_travel);
                 ++travel_id_inc;
             }
@@ -231,17 +380,9 @@ auto extend_travels(
                 travels, flight, settings.search_interval,
                 settings.day_scorer, settings.move_cost, settings.first_flight_wait_time,
                 settings.flight_start_day_time,
-                settings.flight_duration
+                settings.flight_duration, stats
             );
-            if (new_travel_in.cost < 1e8) {
-                new_travel_in.id = travel_id_inc;
-                if (push_travel(
-                    new_travels_by_city[flight.dst], new_travel_in, settings.cover_settings
-                )) {
-                    created_travels.push_back(new_travel_in);
-                    ++travel_id_inc;
-                }
-            }
+            push_extension(new_travel_in);
         }
 
         // new travels continuation
@@ -252,17 +393,9 @@ auto extend_travels(
                 travels, flight, settings.search_interval,
                 settings.day_scorer, settings.move_cost, settings.flight_wait_time,
                 zero_cost,
-                settings.flight_duration
+                settings.flight_duration, stats
             );
-            if (new_travel_comp.cost < 1e8) {
-                new_travel_comp.id = travel_id_inc;
-                if (push_travel(
-                    new_travels_by_city[flight.dst], new_travel_comp, settings.cover_settings
-                )) {
-                    created_travels.push_back(new_travel_comp);
-                    ++travel_id_inc;
-                }
-            }
+            push_extension(new_travel_comp);
         }
     }
 
@@ -291,10 +424,19 @@ std::set<travel_t> select_used_travels(
     return used_travels;
 }
 
-void normalize_travel_ids(std::vector<FlightTravel> &travels) {
+inline FlightTravel &travel_of(FlightTravel &travel) {
+    return travel;
+}
+
+inline FlightTravel &travel_of(ParetoTravel &travel) {
+    return travel.travel;
+}
+
+template <typename Travel>
+void normalize_travel_ids(std::vector<Travel> &travels) {
     std::map<travel_t, travel_t> travel_map;
     for (std::size_t it=0; it<travels.size(); ++it) {
-        auto &travel = travels[it];
+        auto &travel = travel_of(travels[it]);
         travel_map[travel.id] = it;
         travel.id = it;
         if (travel.last_travel >= 0) {
@@ -307,9 +449,15 @@ std::vector<FlightTravel> find_best_single_trip(
     vertex_t start_city, flight_time_t start_time,
     const std::vector<Flight> &flights,
     const TravelSearchSettings &settings,
-    const std::map<vertex_t, cost_t> &city_costs
+    const std::map<vertex_t, cost_t> &city_costs,
+    std::size_t top_k,
+    SearchStats *stats
 ) {
+    if (start_city < 0) {
+        throw std::invalid_argument("start_city must be a city id >= 0");
+    }
     travel_t travel_id_inc = 0;
+    auto phase_start = std::chrono::steady_clock::now();
 
     std::map<travel_t, FlightTravel> all_travels;
     TravelExtendSettings start_extend_settings = {
@@ -323,7 +471,8 @@ std::vector<FlightTravel> find_best_single_trip(
         .move_cost = settings.move_cost,
     };
     auto [to_city_travels_ids, new_travels_to] = extend_travels(
-        {}, flights, start_extend_settings, travel_id_inc, {start_city}
+        {}, flights, start_extend_settings, travel_id_inc, {start_city}, start_time,
+        nullptr, zero_cost, stats
     );
     for (auto travel : new_travels_to) {
         auto cost_it = city_costs.find(travel.end_vertex);
@@ -351,16 +500,54 @@ std::vector<FlightTravel> find_best_single_trip(
         .cover_settings = settings.cover_settings,
         .move_cost = settings.move_cost,
     };
-    auto [from_city_travels_ids, new_travels_from] = extend_travels(
-        to_city_travels, flights, end_extend_settings, travel_id_inc
-    );
-    for (auto travel : new_travels_from) {
-        travel.cost += score_diff(settings.end_out_day_time, travel.day_end_time);
-        all_travels[travel.id] = travel;
+    TopCosts top_costs(top_k);
+    if (stats) {
+        auto now = std::chrono::steady_clock::now();
+        stats->start_phase_seconds += std::chrono::duration<double>(now - phase_start).count();
+        phase_start = now;
     }
-    std::vector<travel_t> from_city_travel_ids_list;
-    for (auto &city_travels : from_city_travels_ids) {
-        from_city_travel_ids_list.insert(from_city_travel_ids_list.end(), city_travels.second.begin(), city_travels.second.end());
+    auto end_travel_id = travel_id_inc;
+    auto find_end_travels = [&](TopCosts *top_costs) {
+        auto [from_city_travels_ids, new_travels_from] = extend_travels(
+            to_city_travels, flights, end_extend_settings, travel_id_inc, {},
+            -std::numeric_limits<flight_time_t>::infinity(), top_costs, settings.end_out_day_time, stats
+        );
+        for (auto travel : new_travels_from) {
+            travel.cost += score_diff(settings.end_out_day_time, travel.day_end_time);
+            all_travels[travel.id] = travel;
+        }
+        std::vector<travel_t> from_city_travel_ids_list;
+        for (auto &city_travels : from_city_travels_ids) {
+            from_city_travel_ids_list.insert(from_city_travel_ids_list.end(), city_travels.second.begin(), city_travels.second.end());
+        }
+        if (top_k && from_city_travel_ids_list.size() > top_k) {
+            auto cost_less = [&](travel_t a, travel_t b) {
+                return std::pair(all_travels[a].cost, a) < std::pair(all_travels[b].cost, b);
+            };
+            std::nth_element(
+                from_city_travel_ids_list.begin(), from_city_travel_ids_list.begin() + top_k,
+                from_city_travel_ids_list.end(), cost_less
+            );
+            from_city_travel_ids_list.resize(top_k);
+        }
+        return from_city_travel_ids_list;
+    };
+    auto from_city_travel_ids_list = find_end_travels(top_k ? &top_costs : nullptr);
+
+    // Pruning only changes travels costing at least the cheapest pruned one: when the k-th trip
+    // is not cheaper than that, a better trip may be missing and the phase runs again unbounded
+    if (top_k && top_costs.get_min_pruned() < std::numeric_limits<cost_t>::infinity()) {
+        auto kth_cost = std::numeric_limits<cost_t>::infinity();
+        if (from_city_travel_ids_list.size() == top_k) {
+            kth_cost = 0;
+            for (auto travel_id : from_city_travel_ids_list) {
+                kth_cost = std::max(kth_cost, all_travels[travel_id].cost);
+            }
+        }
+        if (kth_cost >= top_costs.get_min_pruned()) {
+            all_travels.erase(all_travels.lower_bound(end_travel_id), all_travels.end());
+            from_city_travel_ids_list = find_end_travels(nullptr);
+        }
     }
 
     std::vector<FlightTravel> res_travels;
@@ -369,5 +556,502 @@ std::vector<FlightTravel> find_best_single_trip(
     }
     std::sort(res_travels.begin(), res_travels.end(), TravelCompareTime());
     normalize_travel_ids(res_travels);
+    if (stats) {
+        stats->end_phase_seconds += std::chrono::duration<double>(
+            std::chrono::steady_clock::now() - phase_start
+        ).count();
+    }
+    return res_travels;
+}
+
+std::vector<std::vector<FlightTravel>> find_best_single_trips(
+    const std::vector<TripQuery> &queries,
+    const std::vector<Flight> &flights,
+    const std::map<vertex_t, cost_t> &city_costs,
+    int nthreads
+) {
+    std::vector<std::vector<FlightTravel>> results(queries.size());
+    if (nthreads <= 0) {
+        nthreads = std::max(1u, std::thread::hardware_concurrency());
+    }
+    nthreads = std::min<std::size_t>(nthreads, queries.size());
+
+    // Workers take queries one by one, results are stored at the query position
+    std::atomic<std::size_t> next_query = 0;
+    std::exception_ptr error;
+    std::atomic_flag error_set = ATOMIC_FLAG_INIT;
+    auto worker = [&]() {
+        try {
+            for (auto i = next_query++; i < queries.size(); i = next_query++) {
+                const auto &query = queries[i];
+                results[i] = find_best_single_trip(
+                    query.start_city, query.start_time, flights, query.settings, city_costs,
+                    query.top_k, query.stats
+                );
+            }
+        } catch (...) {
+            if (!error_set.test_and_set()) {
+                error = std::current_exception();
+            }
+            next_query = queries.size();
+        }
+    };
+
+    std::vector<std::thread> threads;
+    for (int i = 1; i < nthreads; i++) {
+        threads.emplace_back(worker);
+    }
+    worker();
+    for (auto &thread : threads) {
+        thread.join();
+    }
+    if (error) {
+        std::rethrow_exception(error);
+    }
+    return results;
+}
+
+// Travel a dominates b on all objectives when it ends no later and stays at least as good
+// for any continuation: waiting from a.end_time to b.end_time adds travel time, wait costs change
+// by at most wait_factor per day and the day scorer adds the cost of the days in between.
+// A travel may also end its phase, then end_scoring of its day end time is added to the penalty,
+// so a has to stay at least as good with and without it.
+inline bool pareto_dominates(
+    const ParetoTravel &a, const ParetoTravel &b,
+    cost_t wait_factor, const DayScorer &day_scorer, const DiffCostSettings &end_scoring
+) {
+    auto time_diff = b.travel.end_time - a.travel.end_time;
+    if (time_diff < 0 || a.price > b.price || a.duration + time_diff > b.duration) {
+        return false;
+    }
+    auto days_cost = std::max<cost_t>(
+        compute_days_cost(day_scorer, a.travel.end_time, b.travel.end_time, true), 0
+    );
+    auto penalty_slack = b.penalty - a.penalty - wait_factor * time_diff - days_cost;
+    return penalty_slack >= 0 && penalty_slack
+        + score_diff(end_scoring, b.travel.day_end_time) - score_diff(end_scoring, a.travel.day_end_time) >= 0;
+}
+
+// Travels in `travel_ids` (sorted by end time) that may continue with `flight`. The time window is
+// the one of extend_best_travel, its fallback to the last min_check_flights travels counts the travels
+// of `cover` (the ones the scalar search keeps for the city): the front keeps more travels, counting
+// them would reach less far back than the scalar search does.
+auto pareto_travels_window(
+    const std::vector<ParetoTravel> &travels, const std::vector<travel_t> &travel_ids,
+    const std::vector<FlightTravel> &cover,
+    const Flight &flight, flight_duration_t search_interval,
+    const DiffCostSettings &wait_time_scoring, int min_check_flights = 8
+) {
+    auto end_time_less = [&](travel_t id, flight_time_t end_time) {
+        return travels[id].travel.end_time < end_time;
+    };
+    auto it = std::lower_bound(
+        travel_ids.begin(), travel_ids.end(),
+        flight.start_time - wait_time_scoring.desired_value - search_interval, end_time_less
+    );
+    auto it_end = std::upper_bound(
+        travel_ids.begin(), travel_ids.end(),
+        std::min(flight.start_time - wait_time_scoring.desired_value + search_interval, flight.start_time),
+        [&](flight_time_t end_time, travel_t id) { return end_time < travels[id].travel.end_time; }
+    );
+    if (it_end - it < min_check_flights) {
+        it = it_end - std::min<std::ptrdiff_t>(min_check_flights, it_end - travel_ids.begin());
+    }
+    FlightTravel search_travel;
+    search_travel.end_time = std::min(
+        flight.start_time - wait_time_scoring.desired_value + search_interval, flight.start_time
+    );
+    auto cover_end = std::upper_bound(cover.begin(), cover.end(), search_travel, TravelCompareTime());
+    if (cover_end != cover.begin()) {
+        auto cover_it = cover_end - std::min<std::ptrdiff_t>(min_check_flights, cover_end - cover.begin());
+        it = std::min(it, std::lower_bound(travel_ids.begin(), it_end, cover_it->end_time, end_time_less));
+    }
+    return std::pair(it, it_end);
+}
+
+// Objectives of `travel` continued with `flight`, the cost terms are the ones of extend_best_travel.
+// A leg start counts only the flight time, a continuation also the wait.
+ParetoTravel extend_pareto_travel(
+    const ParetoTravel &travel, const Flight &flight, const TravelExtendSettings &settings,
+    const DiffCostSettings &wait_time_scoring, const DiffCostSettings &flight_start_scoring,
+    bool leg_start
+) {
+    ParetoTravel r = travel;
+    r.price += flight.cost;
+    r.penalty += compute_days_cost(
+        settings.day_scorer, travel.travel.end_time,
+        flight.start_time + flight.duration, travel.travel.flights_count
+    );
+    if (travel.travel.flights_count) {
+        r.penalty += settings.move_cost + score_diff(wait_time_scoring, travel.travel.end_time);
+    }
+    r.penalty += score_diff(flight_start_scoring, flight.day_start_time);
+    r.penalty += score_diff(settings.flight_duration, flight.duration);
+    r.duration += leg_start ? flight.duration : flight.start_time + flight.duration - travel.travel.end_time;
+    r.travel = {
+        .id = 0,
+        .last_flight = flight.id,
+        .last_travel = travel.travel.id,
+        .flights_count = travel.travel.flights_count + 1,
+        .end_time = flight.start_time + flight.duration,
+        .day_end_time = flight.day_end_time,
+        .cost = r.price + r.penalty,
+        .end_vertex = flight.dst,
+    };
+    return r;
+}
+
+// Multi-objective variant of extend_travels: every continuation that is not dominated by
+// a travel ending within cover_settings.time_back before it is kept, end_scoring is the day end
+// time score added to the travels that end the phase. The kept travels also go through push_travel
+// into the city covers, the travels the scalar search would keep, which set the search windows.
+void extend_pareto_travels(
+    std::vector<ParetoTravel> &travels,
+    const std::map<vertex_t, std::vector<travel_t>> &travels_mapping,
+    const std::map<vertex_t, std::vector<FlightTravel>> &travels_cover,
+    std::map<vertex_t, std::vector<travel_t>> &new_travels_by_city,
+    std::map<vertex_t, std::vector<FlightTravel>> &new_travels_cover,
+    const std::vector<Flight> &flights_by_time, const TravelExtendSettings &settings,
+    cost_t wait_factor, const DiffCostSettings &end_scoring,
+    const std::set<vertex_t> &start_cities = {},
+    flight_time_t start_time = -std::numeric_limits<flight_time_t>::infinity()
+) {
+    std::vector<ParetoTravel> candidates;
+    for (const auto &flight : flights_by_time) {
+        candidates.clear();
+        if (start_cities.count(flight.src) && flight.start_time >= start_time) {
+            auto start_travel = get_start_travel(
+                flight, settings.flight_start_day_time, settings.flight_duration);
+            candidates.push_back({
+                .travel = start_travel,
+                .price = flight.cost,
+                .duration = flight.duration,
+                .penalty = start_travel.cost - flight.cost,
+                .front = false,
+            });
+        }
+
+        const auto travels_it_in = travels_mapping.find(flight.src);
+        if (travels_it_in != travels_mapping.end()) {
+            auto [it, it_end] = pareto_travels_window(
+                travels, travels_it_in->second, travels_cover.at(flight.src), flight,
+                settings.search_interval, settings.first_flight_wait_time
+            );
+            for (; it != it_end; ++it) {
+                const auto &travel = travels[*it];
+                if (travel.travel.end_time <= flight.start_time) {
+                    candidates.push_back(extend_pareto_travel(
+                        travel, flight, settings, settings.first_flight_wait_time,
+                        settings.flight_start_day_time, true
+                    ));
+                }
+            }
+        }
+
+        const auto travels_it_comp = new_travels_by_city.find(flight.src);
+        if (travels_it_comp != new_travels_by_city.end()) {
+            auto [it, it_end] = pareto_travels_window(
+                travels, travels_it_comp->second, new_travels_cover[flight.src], flight,
+                settings.search_interval, settings.flight_wait_time
+            );
+            for (; it != it_end; ++it) {
+                const auto &travel = travels[*it];
+                if (travel.travel.end_time <= flight.start_time) {
+                    candidates.push_back(extend_pareto_travel(
+                        travel, flight, settings, settings.flight_wait_time, zero_cost, false
+                    ));
+                }
+            }
+        }
+
+        // all candidates end at the flight arrival, sorted like this one can only be dominated by the ones
+        // before it, which are already in the list when they are not dominated themselves
+        std::sort(candidates.begin(), candidates.end(), [&](const ParetoTravel &a, const ParetoTravel &b) {
+            return std::tuple(
+                a.price, a.duration, a.penalty, a.penalty + score_diff(end_scoring, a.travel.day_end_time)
+            ) < std::tuple(
+                b.price, b.duration, b.penalty, b.penalty + score_diff(end_scoring, b.travel.day_end_time)
+            );
+        });
+        // flights come by arrival time, so a new travel ends after all travels of its city
+        auto &city_travels = new_travels_by_city[flight.dst];
+        auto &city_cover = new_travels_cover[flight.dst];
+        for (auto &candidate : candidates) {
+            bool dominated = false;
+            for (auto it = city_travels.rbegin(); it != city_travels.rend(); ++it) {
+                const auto &travel = travels[*it];
+                if (travel.travel.end_time < candidate.travel.end_time - settings.cover_settings.time_back) {
+                    break;
+                }
+                if (pareto_dominates(travel, candidate, wait_factor, settings.day_scorer, end_scoring)) {
+                    dominated = true;
+                    break;
+                }
+            }
+            if (!dominated) {
+                candidate.travel.id = travels.size();
+                travels.push_back(candidate);
+                city_travels.push_back(candidate.travel.id);
+                push_travel(city_cover, candidate.travel, settings.cover_settings);
+            }
+        }
+    }
+}
+
+// Pareto-optimal trips over (price, travel time, schedule penalty) in one pass of the
+// find_best_single_trip search: price is the flights and city costs, travel time excludes the stay
+// and the penalty is every other cost term of the scalar search, so price + penalty is its cost.
+// Returns the front trips (front = true) and the travels they continue, sorted by end time.
+std::vector<ParetoTravel> find_pareto_trips(
+    vertex_t start_city, flight_time_t start_time,
+    const std::vector<Flight> &flights,
+    const TravelSearchSettings &settings,
+    const std::map<vertex_t, cost_t> &city_costs
+) {
+    if (start_city < 0) {
+        throw std::invalid_argument("start_city must be a city id >= 0");
+    }
+    std::vector<Flight> flights_by_time = flights;
+    std::sort(flights_by_time.begin(), flights_by_time.end(), FlightCompareTime());
+    auto wait_factor = std::max({
+        settings.wait_time.up_factor, settings.wait_time.down_factor,
+        settings.trip_duration.up_factor, settings.trip_duration.down_factor
+    });
+
+    std::vector<ParetoTravel> travels;
+    std::map<vertex_t, std::vector<travel_t>> to_city_travels;
+    std::map<vertex_t, std::vector<FlightTravel>> to_city_cover;
+    TravelExtendSettings start_extend_settings = {
+        .day_scorer = settings.day_scorer,
+        .search_interval = settings.search_interval,
+        .flight_start_day_time = settings.start_in_day_time,
+        .first_flight_wait_time = zero_cost,
+        .flight_wait_time = settings.wait_time,
+        .flight_duration = settings.flight_duration,
+        .cover_settings = settings.cover_settings,
+        .move_cost = settings.move_cost,
+    };
+    extend_pareto_travels(
+        travels, {}, {}, to_city_travels, to_city_cover, flights_by_time, start_extend_settings,
+        wait_factor, settings.start_out_day_time, {start_city}, start_time
+    );
+    for (auto &travel : travels) {
+        auto cost_it = city_costs.find(travel.travel.end_vertex);
+        if (cost_it != city_costs.end()) {
+            travel.price += cost_it->second;
+        }
+        travel.penalty += score_diff(settings.start_out_day_time, travel.travel.day_end_time);
+        travel.travel.cost = travel.price + travel.penalty;
+    }
+    auto to_travels_count = travels.size();
+
+    std::map<vertex_t, std::vector<travel_t>> from_city_travels;
+    std::map<vertex_t, std::vector<FlightTravel>> from_city_cover;
+    TravelExtendSettings end_extend_settings = {
+        .day_scorer = settings.day_scorer,
+        .search_interval = settings.search_interval,
+        .flight_start_day_time = settings.end_in_day_time,
+        .first_flight_wait_time = settings.trip_duration,
+        .flight_wait_time = settings.wait_time,
+        .flight_duration = settings.flight_duration,
+        .cover_settings = settings.cover_settings,
+        .move_cost = settings.move_cost,
+    };
+    extend_pareto_travels(
+        travels, to_city_travels, to_city_cover, from_city_travels, from_city_cover, flights_by_time,
+        end_extend_settings, wait_factor, settings.end_out_day_time
+    );
+    for (auto it = travels.begin() + to_travels_count; it != travels.end(); ++it) {
+        it->penalty += score_diff(settings.end_out_day_time, it->travel.day_end_time);
+        it->travel.cost = it->price + it->penalty;
+    }
+
+    // Final front over the objectives only, candidates by price so only earlier ones can dominate
+    std::vector<travel_t> trip_ids;
+    for (auto &city_travels : from_city_travels) {
+        trip_ids.insert(trip_ids.end(), city_travels.second.begin(), city_travels.second.end());
+    }
+    std::sort(trip_ids.begin(), trip_ids.end(), [&](travel_t a, travel_t b) {
+        return std::tuple(travels[a].price, travels[a].duration, travels[a].penalty, a)
+            < std::tuple(travels[b].price, travels[b].duration, travels[b].penalty, b);
+    });
+    std::vector<travel_t> front_ids;
+    for (auto id : trip_ids) {
+        const auto &trip = travels[id];
+        bool dominated = false;
+        for (auto front_id : front_ids) {
+            const auto &front_trip = travels[front_id];
+            if (front_trip.duration <= trip.duration && front_trip.penalty <= trip.penalty) {
+                dominated = true;
+                break;
+            }
+        }
+        if (!dominated) {
+            front_ids.push_back(id);
+        }
+    }
+
+    std::set<travel_t> used_travels;
+    for (auto id : front_ids) {
+        travels[id].front = true;
+        for (; id >= 0 && !used_travels.count(id); id = travels[id].travel.last_travel) {
+            used_travels.insert(id);
+        }
+    }
+    std::vector<ParetoTravel> res_travels;
+    for (auto id : used_travels) {
+        res_travels.push_back(travels[id]);
+    }
+    std::sort(res_travels.begin(), res_travels.end(), [](const ParetoTravel &a, const ParetoTravel &b) {
+        return a.travel.end_time < b.travel.end_time;
+    });
+    normalize_travel_ids(res_travels);
+    return res_travels;
+}
+
+// Itinerary a dominates b when it arrives no later, with no more flights and at a cost that stays
+// lower for any following departure: wait costs change by at most wait_factor per day of waiting
+inline bool connection_dominates(
+    const FlightTravel &a, const FlightTravel &b, cost_t wait_factor
+) {
+    return a.end_time <= b.end_time && a.flights_count <= b.flights_count
+        && a.cost + wait_factor * (b.end_time - a.end_time) <= b.cost;
+}
+
+// Pareto front of (arrival time, cost) itineraries from start_city to end_city with self-transfers
+// between any flights. Flights are scanned once by departure time (connection scan), every airport
+// keeps a frontier of non-dominated arrivals and a new arrival is dropped when it is dominated there
+// or when an itinerary already at end_city arrives earlier for less.
+// Returns the itineraries ending at end_city and the travels they continue, sorted by end time.
+std::vector<FlightTravel> find_connections(
+    vertex_t start_city, flight_time_t start_time, vertex_t end_city,
+    const std::vector<Flight> &flights,
+    const ConnectionSearchSettings &settings
+) {
+    auto end_time = start_time + settings.max_duration;
+    auto wait_factor = std::max(settings.wait_time.up_factor, settings.wait_time.down_factor);
+
+    std::vector<const Flight *> flights_by_start;
+    vertex_t nvertices = std::max(start_city, end_city) + 1;
+    for (const auto &flight : flights) {
+        if (flight.start_time >= start_time && flight.start_time + flight.duration <= end_time
+                && flight.src != end_city && flight.dst >= 0) {
+            flights_by_start.push_back(&flight);
+            nvertices = std::max(nvertices, std::max(flight.src, flight.dst) + 1);
+        }
+    }
+    std::sort(flights_by_start.begin(), flights_by_start.end(), [](const Flight *a, const Flight *b) {
+        return a->start_time < b->start_time;
+    });
+
+    // Label ids index `travels`, frontiers hold the ids sorted by end time
+    std::vector<FlightTravel> travels;
+    std::vector<std::vector<travel_t>> frontiers(nvertices);
+    auto &end_frontier = frontiers[end_city];
+    std::vector<FlightTravel> candidates;
+    for (const auto *flight : flights_by_start) {
+        // One label per flights count, a cheaper label with more flights can not replace one that
+        // may still take more flights within max_flights
+        candidates.clear();
+        auto push_candidate = [&](travel_t last_travel, int flights_count, cost_t cost) {
+            for (auto &candidate : candidates) {
+                if (candidate.flights_count == flights_count) {
+                    if (cost < candidate.cost) {
+                        candidate.last_travel = last_travel;
+                        candidate.cost = cost;
+                    }
+                    return;
+                }
+            }
+            candidates.push_back({
+                .id = 0,
+                .last_flight = flight->id,
+                .last_travel = last_travel,
+                .flights_count = flights_count,
+                .end_time = flight->start_time + flight->duration,
+                .day_end_time = flight->day_end_time,
+                .cost = cost,
+                .end_vertex = flight->dst,
+            });
+        };
+        if (flight->src == start_city) {
+            push_candidate(-1, 1, flight->cost);
+        }
+        for (auto travel_id : frontiers[flight->src]) {
+            const auto &travel = travels[travel_id];
+            auto wait_time = flight->start_time - travel.end_time;
+            if (wait_time < settings.min_connection_time) {
+                break;
+            }
+            if (travel.flights_count >= settings.max_flights) {
+                continue;
+            }
+            auto cost = travel.cost + flight->cost + settings.move_cost
+                + score_diff(settings.wait_time, wait_time);
+            push_candidate(travel.id, travel.flights_count + 1, cost);
+        }
+        // Only labels cheaper than every label with fewer flights are kept
+        std::sort(candidates.begin(), candidates.end(), [](const FlightTravel &a, const FlightTravel &b) {
+            return a.flights_count < b.flights_count;
+        });
+        cost_t min_cost = std::numeric_limits<cost_t>::infinity();
+        for (auto &best_travel : candidates) {
+            if (best_travel.cost >= min_cost) {
+                continue;
+            }
+            min_cost = best_travel.cost;
+
+            // Target pruning, later flights only add time and cost
+            bool dominated = false;
+            for (auto travel_id : end_frontier) {
+                const auto &travel = travels[travel_id];
+                if (travel.end_time <= best_travel.end_time && travel.cost <= best_travel.cost) {
+                    dominated = true;
+                    break;
+                }
+            }
+            // Itineraries are not continued from end_city, there only arrival time and cost count
+            auto &frontier = frontiers[flight->dst];
+            for (auto travel_id : frontier) {
+                if (dominated || flight->dst == end_city) {
+                    break;
+                }
+                dominated = connection_dominates(travels[travel_id], best_travel, wait_factor);
+            }
+            if (dominated) {
+                continue;
+            }
+
+            best_travel.id = travels.size();
+            travels.push_back(best_travel);
+            frontier.erase(std::remove_if(frontier.begin(), frontier.end(), [&](travel_t travel_id) {
+                const auto &travel = travels[travel_id];
+                if (flight->dst == end_city) {
+                    return best_travel.end_time <= travel.end_time && best_travel.cost <= travel.cost;
+                }
+                return connection_dominates(best_travel, travel, wait_factor);
+            }), frontier.end());
+            frontier.insert(std::upper_bound(
+                frontier.begin(), frontier.end(), best_travel.id, [&](travel_t a, travel_t b) {
+                    return travels[a].end_time < travels[b].end_time;
+                }
+            ), best_travel.id);
+        }
+    }
+
+    std::set<travel_t> used_travels;
+    for (auto travel_id : end_frontier) {
+        for (; travel_id >= 0 && !used_travels.count(travel_id); travel_id = travels[travel_id].last_travel) {
+            used_travels.insert(travel_id);
+        }
+    }
+    std::vector<FlightTravel> res_travels;
+    for (auto travel_id : used_travels) {
+        res_travels.push_back(travels[travel_id]);
+    }
+    std::sort(res_travels.begin(), res_travels.end(), [](const FlightTravel &a, const FlightTravel &b) {
+        return std::pair(a.end_time, a.flights_count) < std::pair(b.end_time, b.flights_count);
+    });
+    normalize_travel_ids(res_travels);
     return res_travels;
 }
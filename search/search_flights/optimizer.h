@@ -60,6 +60,44 @@ typedef struct {
     cost_t move_cost;
 } TravelSearchSettings;
 
+typedef struct {
+    FlightTravel travel;
+    cost_t price;
+    flight_duration_t duration;
+    cost_t penalty;
+    bool front;
+} ParetoTravel;
+
+typedef struct {
+    flight_duration_t min_connection_time;
+    flight_duration_t max_duration;
+    int max_flights;
+    DiffCostSettings wait_time;
+    cost_t move_cost;
+} ConnectionSearchSettings;
+
+// Optional find_best_single_trip counters, the search only updates them when given
+typedef struct {
+    std::size_t flights_scanned;    // flights tried as a travel extension
+    std::size_t travels_scanned;    // earlier travels checked in the wait windows
+    std::size_t travels_expanded;   // extensions built from the best earlier travel
+    std::size_t no_travel;          // flights with no earlier travel to continue
+    std::size_t pruned_back;        // extensions covered by an earlier cheaper travel (back_cost_factor)
+    std::size_t pruned_forward;     // extensions covered by a later travel (forward_cost_factor)
+    std::size_t replaced;           // kept travels dropped when covered by a new one
+    std::size_t pruned_top_k;       // extensions that can not make it into the top_k trips
+    std::size_t peak_frontier;      // most travels kept at once by a phase
+    double start_phase_seconds, end_phase_seconds;
+} SearchStats;
+
+typedef struct {
+    vertex_t start_city;
+    flight_time_t start_time;
+    TravelSearchSettings settings;
+    std::size_t top_k;
+    SearchStats *stats;
+} TripQuery;
+
 
 DayScorer compute_day_scores(
     const cost_t *day_costs, int ndays,
@@ -67,8 +105,30 @@ DayScorer compute_day_scores(
 );
 
 std::vector<FlightTravel> find_best_single_trip(
+    vertex_t start_city, flight_time_t start_time,
+    const std::vector<Flight> &flights,
+    const TravelSearchSettings &settings,
+    const std::map<vertex_t, cost_t> &city_costs,
+    std::size_t top_k = 0,
+    SearchStats *stats = nullptr
+);
+
+std::vector<std::vector<FlightTravel>> find_best_single_trips(
+    const std::vector<TripQuery> &queries,
+    const std::vector<Flight> &flights,
+    const std::map<vertex_t, cost_t> &city_costs,
+    int nthreads
+);
+
+std::vector<ParetoTravel> find_pareto_trips(
     vertex_t start_city, flight_time_t start_time,
     const std::vector<Flight> &flights,
     const TravelSearchSettings &settings,
     const std::map<vertex_t, cost_t> &city_costs
 );
+
+std::vector<FlightTravel> find_connections(
+    vertex_t start_city, flight_time_t start_time, vertex_t end_city,
+    const std::vector<Flight> &flights,
+    const ConnectionSearchSettings &settings
+);
@@ -0,0 +1,147 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+HISTORY_COLUMNS = ('id', 'src', 'dst', 'start_time', 'flight_number', 'fetch_time', 'cost')
+
+
+def _route_key(src, dst):
+    return (np.asarray(src, dtype=np.int64) << 32) | np.asarray(dst, dtype=np.int64)
+
+
+def _search_range(sorted_values, value) -> Tuple[int, int]:
+    return (
+        int(np.searchsorted(sorted_values, value, 'left')),
+        int(np.searchsorted(sorted_values, value, 'right'))
+    )
+
+
+# Price snapshots of every flight, built from snapshot columns (see FlightCache.load_columns),
+# all snapshots of a flight share its id. Flights are sorted by (src, dst, start_time, id)
+# and the snapshots of flight `i` are stored by fetch_time in `offsets[i]:offsets[i+1]`,
+# so a flight or a whole route departure window is one contiguous slice.
+# Appended snapshots go to a tail sorted by (id, fetch_time), which is merged into the sorted
+# history once it outgrows `merge_fraction` of it.
+class PriceHistory:
+    def __init__(
+        self, columns: Dict[str, np.ndarray],
+        merge_fraction: float = .25, min_merge_size: int = 1 << 16
+    ):
+        self.merge_fraction = merge_fraction
+        self.min_merge_size = min_merge_size
+        self._build({name: np.asarray(columns[name]) for name in HISTORY_COLUMNS})
+
+    def _build(self, columns: Dict[str, np.ndarray]):
+        self._columns = columns
+        order = np.lexsort((
+            columns['fetch_time'], columns['id'], columns['start_time'],
+            columns['dst'], columns['src']
+        ))
+        ids = columns['id'][order]
+        new_flight = np.ones(len(order), dtype=bool)
+        new_flight[1:] = ids[1:] != ids[:-1]
+        first = np.flatnonzero(new_flight)
+        self.offsets = np.append(first, len(order))
+        self.ids = ids[first]
+        self.src = columns['src'][order][first]
+        self.dst = columns['dst'][order][first]
+        self.start_time = columns['start_time'][order][first]
+        self.flight_number = columns['flight_number'][order][first]
+        self.fetch_time = columns['fetch_time'][order]
+        self.cost = columns['cost'][order]
+
+        self._route_keys = _route_key(self.src, self.dst)
+        self._ids_order = np.argsort(self.ids)
+        self._sorted_ids = self.ids[self._ids_order]
+        self._tail = {name: column[:0] for name, column in columns.items()}
+        self._tail_flights = 0
+
+    def __len__(self):
+        return len(self.ids) + self._tail_flights
+
+    def __repr__(self):
+        return f'PriceHistory(flights={len(self)}, snapshots={len(self._columns["id"]) + len(self._tail["id"])})'
+
+    def append(self, columns: Dict[str, np.ndarray]):
+        tail = {
+            name: np.concatenate((self._tail[name], columns[name]))
+            for name in HISTORY_COLUMNS
+        }
+        if len(tail['id']) > max(self.min_merge_size, self.merge_fraction * len(self._columns['id'])):
+            self._build({
+                name: np.concatenate((self._columns[name], tail[name]))
+                for name in HISTORY_COLUMNS
+            })
+            return
+
+        order = np.lexsort((tail['fetch_time'], tail['id']))
+        self._tail = {name: column[order] for name, column in tail.items()}
+        tail_ids = np.unique(self._tail['id'])
+        self._tail_flights = int(np.count_nonzero(~np.isin(tail_ids, self._sorted_ids, assume_unique=True)))
+
+    # Moves the appended snapshots into the sorted history
+    def merge(self):
+        if len(self._tail['id']):
+            self._build({
+                name: np.concatenate((self._columns[name], self._tail[name]))
+                for name in HISTORY_COLUMNS
+            })
+
+    # Position of a flight in the sorted history, appended flights are there after merge()
+    def flight_pos(self, flight_id: int) -> int:
+        pos = np.searchsorted(self._sorted_ids, flight_id)
+        if pos >= len(self._sorted_ids) or self._sorted_ids[pos] != flight_id:
+            raise KeyError(f'Unknown flight id: {flight_id}')
+        return int(self._ids_order[pos])
+
+    def price_trajectory(self, flight_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        tail_begin, tail_end = _search_range(self._tail['id'], flight_id)
+        try:
+            pos = self.flight_pos(flight_id)
+        except KeyError:
+            if tail_begin == tail_end:
+                raise
+            return self._tail['fetch_time'][tail_begin:tail_end], self._tail['cost'][tail_begin:tail_end]
+
+        begin, end = self.offsets[pos], self.offsets[pos + 1]
+        if tail_begin == tail_end:
+            return self.fetch_time[begin:end], self.cost[begin:end]
+        fetch_time = np.concatenate((self.fetch_time[begin:end], self._tail['fetch_time'][tail_begin:tail_end]))
+        cost = np.concatenate((self.cost[begin:end], self._tail['cost'][tail_begin:tail_end]))
+        order = np.argsort(fetch_time, kind='stable')
+        return fetch_time[order], cost[order]
+
+    # Range of sorted history flights of a route departing in [start_time, end_time]
+    def route_flights(self, src: int, dst: int, start_time: float, end_time: float) -> Tuple[int, int]:
+        route_begin, route_end = _search_range(self._route_keys, _route_key(src, dst))
+        route_start_time = self.start_time[route_begin:route_end]
+        return (
+            route_begin + int(np.searchsorted(route_start_time, start_time, 'left')),
+            route_begin + int(np.searchsorted(route_start_time, end_time, 'right'))
+        )
+
+    # Cheapest fare seen for departures in [start_time, end_time], per `bucket` days of fetch time
+    def route_trend(
+        self, src: int, dst: int,
+        start_time: float = -np.inf, end_time: float = np.inf, bucket: float = 1.
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        begin, end = self.route_flights(src, dst, start_time, end_time)
+        fetch_time = self.fetch_time[self.offsets[begin]:self.offsets[end]]
+        cost = self.cost[self.offsets[begin]:self.offsets[end]]
+        tail = self._tail
+        if len(tail['id']):
+            in_route = (
+                (tail['src'] == src) & (tail['dst'] == dst)
+                & (tail['start_time'] >= start_time) & (tail['start_time'] <= end_time)
+            )
+            fetch_time = np.concatenate((fetch_time, tail['fetch_time'][in_route]))
+            cost = np.concatenate((cost, tail['cost'][in_route]))
+        if not len(cost):
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=cost.dtype)
+
+        buckets = np.floor(fetch_time / bucket)
+        order = np.argsort(buckets, kind='stable')
+        buckets = buckets[order]
+        bucket_begin = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        return buckets[bucket_begin] * bucket, np.minimum.reduceat(cost[order], bucket_begin)
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import sys
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple, Union
+
+from .flight_optim import (
+    DayScorer, DiffCostSettings, FlightIndex, FlightIndexView, FlightsList, FlightTravel,
+    TravelCoverSettings, TravelSearchSettings, find_best_single_trips
+)
+from .settings import DEFAULT_SEARCH_SETTINGS
+
+
+_SETTINGS_FIELDS = {
+    DayScorer: ('day_costs_agg', 'start_time', 'day_factor'),
+    DiffCostSettings: ('desired_value', 'down_factor', 'up_factor'),
+    TravelCoverSettings: ('back_cost_factor', 'forward_cost_factor', 'time_back'),
+    TravelSearchSettings: tuple(DEFAULT_SEARCH_SETTINGS),
+}
+
+
+def _settings_values(settings):
+    fields = _SETTINGS_FIELDS.get(type(settings))
+    if fields is None:
+        return settings
+    return tuple(_settings_values(getattr(settings, name)) for name in fields)
+
+
+# Value tuple of every settings field (nested settings included), equal settings give equal keys
+def settings_key(settings: TravelSearchSettings) -> Tuple:
+    return _settings_values(settings)
+
+
+def _travels_nbytes(travels: List[FlightTravel]) -> int:
+    return sys.getsizeof(travels) + sum(map(sys.getsizeof, travels))
+
+
+# LRU cache of flight selections and trip searches over one FlightIndex, bounded by the estimated
+# size of the cached results. Entries are keyed by the query values and the cache is dropped
+# whenever the index version changes, so any index update invalidates it.
+# Thread safe, a result computed while the index changed is not stored.
+class SearchCache:
+    def __init__(self, flights: Union[FlightIndex, FlightIndexView], max_bytes: int = 256 << 20):
+        self.flights = flights
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = flights.version
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f'SearchCache(len={len(self)}, nbytes={self.nbytes}, max_bytes={self.max_bytes}, '
+            f'hits={self.hits}, misses={self.misses})'
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _check_version(self):
+        version = self.flights.version
+        if version != self._version:
+            self._entries.clear()
+            self.nbytes = 0
+            self._version = version
+        return version
+
+    def _get(self, key):
+        with self._lock:
+            version = self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return version, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return version, entry[0]
+
+    def _put(self, version, key, value, nbytes):
+        with self._lock:
+            if self._check_version() != version or nbytes > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, old_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= old_nbytes
+
+    def select_flights(
+        self, src: Iterable[int], dst: Iterable[int], start_time: float, end_time: float
+    ) -> FlightsList:
+        src, dst = frozenset(src), frozenset(dst)
+        key = ('select', src, dst, float(start_time), float(end_time))
+        version, flights = self._get(key)
+        if flights is None:
+            flights = self.flights.select_flights(set(src), set(dst), start_time, end_time)
+            self._put(version, key, flights, flights.nbytes)
+        return flights
+
+    # Searches the flights selected by (src, dst, start_time, end_time), the search itself
+    # runs with the GIL released
+    def find_best_single_trip(
+        self, start_city: int, start_time: float,
+        src: Iterable[int], dst: Iterable[int], end_time: float,
+        settings: TravelSearchSettings, city_costs: Dict[int, float], top_k: int = 0
+    ) -> List[FlightTravel]:
+        src, dst = frozenset(src), frozenset(dst)
+        key = (
+            'trip', start_city, float(start_time), src, dst, float(end_time), settings_key(settings),
+            tuple(sorted((city, float(cost)) for city, cost in city_costs.items())), top_k
+        )
+        version, travels = self._get(key)
+        if travels is None:
+            travels, = find_best_single_trips(
+                [(start_city, start_time, settings)],
+                self.select_flights(src, dst, start_time, end_time),
+                city_costs, threads=1, top_k=top_k
+            )
+            self._put(version, key, travels, _travels_nbytes(travels))
+        return list(travels)
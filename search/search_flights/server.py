@@ -0,0 +1,147 @@
+# gunicorn -b '0.0.0.0:8091' --workers=1 --threads=8 --env=DATASETS=ryanair,wizzair 'search_flights.server:make_app()'
+# many workers sharing one published index:
+# python -m search_flights.shared_index data/flight_index
+# gunicorn -b '0.0.0.0:8091' --workers=4 --threads=8 --env=FLIGHT_INDEX=data/flight_index 'search_flights.server:make_app()'
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from functools import partial
+import logging
+from os import environ, path
+from typing import Dict, Optional, Tuple
+
+from flask import Flask
+
+from .flight_cache import FlightCache
+from .flight_optim import FlightIndex
+from .interning import InternTable
+from .json_api import json_request
+from .search_cache import SearchCache
+from .shared_index import load_flight_index
+from .settings import make_search_settings
+
+
+app = Flask(__name__, static_folder=None)
+
+DATA_PATH = environ.get('DATA_PATH', 'data')
+DATASETS = environ.get('DATASETS', 'wizzair').split(',')
+# Searches run on this pool with the GIL released, the request threads only wait for them
+SEARCH_POOL = ThreadPoolExecutor(int(environ.get('SEARCH_WORKERS', 0)) or None)
+
+# Index published by `python -m search_flights.shared_index`, attached instead of loading the data
+FLIGHT_INDEX = environ.get('FLIGHT_INDEX')
+
+# Loaded once by make_app, searches only read it
+FLIGHTS = None
+SEARCH_CACHE = None
+DATETIME_BASE = None
+CITY_IDX = None
+
+
+def _city_id(code):
+    if code not in CITY_IDX:
+        raise ValueError(f'Unknown airport: {code}')
+    return CITY_IDX[code]
+
+
+def _flight_json(flight):
+    return dict(
+        id=flight.id,
+        src=CITY_IDX.code(flight.src),
+        dst=CITY_IDX.code(flight.dst),
+        start_time=flight.start_time,
+        day_start_time=flight.day_start_time,
+        day_end_time=flight.day_end_time,
+        duration=flight.duration,
+        cost=flight.cost,
+    )
+
+
+# `flight` is the last flight of the travel, None when the index changed during the search
+def _travel_json(travel, flights):
+    flight = flights.get(travel.last_flight)
+    return dict(
+        id=travel.id,
+        last_flight=travel.last_flight,
+        last_travel=travel.last_travel,
+        flights_count=travel.flights_count,
+        end_time=travel.end_time,
+        day_end_time=travel.day_end_time,
+        cost=travel.cost,
+        end_city=CITY_IDX.code(travel.end_vertex),
+        flight=_flight_json(flight) if flight is not None else None,
+    )
+
+
+def _find_trips(start_city, start_time, src, dst, end_time, settings, city_costs, top_k):
+    trips = SEARCH_CACHE.find_best_single_trip(
+        start_city, start_time, src, dst, end_time, settings, city_costs, top_k
+    )
+    # the selection is cached by the search, looking it up again is cheap
+    flights = SEARCH_CACHE.select_flights(src, dst, start_time, end_time)
+    return trips, {f.id: f for f in flights.find_flights({t.last_flight for t in trips})}
+
+
+@app.route('/info', methods=['GET'])
+@json_request
+async def info():
+    return dict(
+        flights=len(FLIGHTS),
+        version=FLIGHTS.version,
+        datetime_base=DATETIME_BASE.isoformat(),
+        airports=CITY_IDX.keys(),
+        cache=dict(
+            entries=len(SEARCH_CACHE), nbytes=SEARCH_CACHE.nbytes,
+            hits=SEARCH_CACHE.hits, misses=SEARCH_CACHE.misses,
+        ),
+    )
+
+
+# Times are days since `datetime_base` from /info, airport sets default to all airports
+@app.route('/search', methods=['POST'])
+@json_request
+async def search(
+    start_city: str, start_time: float = 0., end_time: float = 1e9,
+    src_airports: Optional[Tuple[str, ...]] = None, dst_airports: Optional[Tuple[str, ...]] = None,
+    settings: Optional[Dict] = None, city_costs: Optional[Dict[str, float]] = None, top_k: int = 10
+):
+    all_airports = CITY_IDX.keys()
+    trips, flights = await asyncio.get_running_loop().run_in_executor(SEARCH_POOL, partial(
+        _find_trips,
+        _city_id(start_city),
+        float(start_time),
+        set(map(_city_id, src_airports if src_airports is not None else all_airports)),
+        set(map(_city_id, dst_airports if dst_airports is not None else all_airports)),
+        float(end_time),
+        make_search_settings(settings),
+        {_city_id(code): float(cost) for code, cost in (city_costs or {}).items()},
+        int(top_k),
+    ))
+    return [_travel_json(travel, flights) for travel in trips]
+
+
+def make_app():
+    global FLIGHTS, SEARCH_CACHE, DATETIME_BASE, CITY_IDX
+
+    interns = InternTable(path.join(DATA_PATH, 'interns'))
+    if FLIGHT_INDEX:
+        FLIGHTS, DATETIME_BASE = load_flight_index(FLIGHT_INDEX)
+        CITY_IDX = interns.airports
+    else:
+        FLIGHTS = FlightIndex()
+        DATETIME_BASE = datetime.now(UTC)
+        cache = FlightCache(path.join(DATA_PATH, 'flights_cache'), interns)
+        cache.update({
+            dataset: path.join(DATA_PATH, dataset) for dataset in DATASETS
+        }, processes=None)
+        CITY_IDX = cache.load_index(FLIGHTS, DATETIME_BASE)
+        FLIGHTS.sort_flights()
+    SEARCH_CACHE = SearchCache(FLIGHTS, int(environ.get('SEARCH_CACHE_MB', 256)) << 20)
+    logging.info(f'Loaded {FLIGHTS} from {FLIGHT_INDEX or DATA_PATH}')
+
+    return app
+
+
+if __name__ == '__main__':
+    make_app().run(host='0.0.0.0', port=8091, threaded=True)
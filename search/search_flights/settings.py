@@ -0,0 +1,52 @@
+from typing import Dict, Optional
+
+from .flight_optim import DayScorer, DiffCostSettings, TravelCoverSettings, TravelSearchSettings
+
+
+DEFAULT_SEARCH_SETTINGS = dict(
+    day_scorer=dict(day_costs=(1, 2, 3, 4), start_time=.01),
+    search_interval=3.,
+    start_in_day_time=dict(desired_value=8/24, down_factor=5., up_factor=5.),
+    start_out_day_time=dict(desired_value=12/24, down_factor=5., up_factor=5.),
+    end_in_day_time=dict(desired_value=18/24, down_factor=5., up_factor=5.),
+    end_out_day_time=dict(desired_value=20/24, down_factor=5., up_factor=5.),
+    wait_time=dict(desired_value=2/24, down_factor=30., up_factor=5.),
+    trip_duration=dict(desired_value=2., down_factor=10., up_factor=10.),
+    flight_duration=dict(desired_value=3., down_factor=.01, up_factor=1.),
+    cover_settings=dict(back_cost_factor=100., forward_cost_factor=100., time_back=7.),
+    move_cost=100.,
+)
+
+_SETTINGS_TYPES = dict(
+    day_scorer=DayScorer,
+    start_in_day_time=DiffCostSettings,
+    start_out_day_time=DiffCostSettings,
+    end_in_day_time=DiffCostSettings,
+    end_out_day_time=DiffCostSettings,
+    wait_time=DiffCostSettings,
+    trip_duration=DiffCostSettings,
+    flight_duration=DiffCostSettings,
+    cover_settings=TravelCoverSettings,
+)
+
+
+# Builds search settings from JSON-like values, fields missing in `settings`
+# (also inside the nested settings) are taken from DEFAULT_SEARCH_SETTINGS
+def make_search_settings(settings: Optional[Dict] = None) -> TravelSearchSettings:
+    settings = settings or {}
+    unknown = set(settings) - set(DEFAULT_SEARCH_SETTINGS)
+    if unknown:
+        raise ValueError(f'Unknown search settings: {", ".join(sorted(unknown))}')
+
+    kwargs = {}
+    for name, default in DEFAULT_SEARCH_SETTINGS.items():
+        value = settings.get(name, default)
+        settings_type = _SETTINGS_TYPES.get(name)
+        try:
+            if settings_type is None:
+                kwargs[name] = float(value)
+            else:
+                kwargs[name] = settings_type(**(default | value))
+        except TypeError as e:
+            raise ValueError(f'Invalid search setting `{name}`: {e}') from e
+    return TravelSearchSettings(**kwargs)
@@ -0,0 +1,77 @@
+# python -m search_flights.shared_index data/flight_index
+# Builds the index from the flight cache once, search processes attach to it with load_flight_index
+
+from datetime import UTC, datetime
+import json
+import logging
+import os
+import sys
+from typing import Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .flight_cache import FlightCache
+from .flight_optim import FLIGHT_NBYTES, FlightIndex, FlightIndexView
+from .interning import InternTable
+
+
+# Memory layout of the C++ Flight struct
+FLIGHT_DTYPE = np.dtype([
+    ('id', np.int32), ('src', np.int32), ('dst', np.int32),
+    ('start_time', np.float32), ('day_start_time', np.float32), ('day_end_time', np.float32),
+    ('duration', np.float32), ('cost', np.float32),
+])
+assert FLIGHT_DTYPE.itemsize == FLIGHT_NBYTES
+
+
+# Writes `{path_prefix}_flights.npy`, `{path_prefix}_offsets.npy` and `{path_prefix}_meta.json`,
+# each file is replaced atomically and the metadata last
+def save_flight_index(flights: FlightIndex, datetime_base: datetime, path_prefix: str):
+    flights.sort_flights()
+    tmp_flights_path = f'{path_prefix}_flights.tmp.npy'
+    tmp_offsets_path = f'{path_prefix}_offsets.tmp.npy'
+    flights_data = open_memmap(tmp_flights_path, 'w+', FLIGHT_DTYPE, (len(flights),))
+    offsets_data = open_memmap(tmp_offsets_path, 'w+', np.uintp, (flights.nsources + 1,))
+    flights.export(flights_data.view(np.uint8), offsets_data)
+    flights_data.flush()
+    offsets_data.flush()
+    del flights_data, offsets_data
+    os.replace(tmp_flights_path, f'{path_prefix}_flights.npy')
+    os.replace(tmp_offsets_path, f'{path_prefix}_offsets.npy')
+
+    tmp_meta_path = f'{path_prefix}_meta.json.tmp'
+    with open(tmp_meta_path, 'w') as f:
+        json.dump(dict(version=flights.version, datetime_base=datetime_base.isoformat()), f)
+    os.replace(tmp_meta_path, f'{path_prefix}_meta.json')
+
+
+# Maps the saved index read-only: attaching costs no copy and processes share the page cache
+def load_flight_index(path_prefix: str) -> Tuple[FlightIndexView, datetime]:
+    with open(f'{path_prefix}_meta.json') as f:
+        meta = json.load(f)
+    flights_data = np.load(f'{path_prefix}_flights.npy', mmap_mode='r')
+    offsets_data = np.load(f'{path_prefix}_offsets.npy', mmap_mode='r')
+    if flights_data.dtype != FLIGHT_DTYPE:
+        raise ValueError(f'Unexpected flight records in `{path_prefix}`: {flights_data.dtype}')
+    view = FlightIndexView(flights_data.view(np.uint8), offsets_data, meta['version'])
+    return view, datetime.fromisoformat(meta['datetime_base'])
+
+
+def publish(path_prefix: str):
+    data_path = os.environ.get('DATA_PATH', 'data')
+    datasets = os.environ.get('DATASETS', 'wizzair').split(',')
+    cache = FlightCache(os.path.join(data_path, 'flights_cache'), InternTable(os.path.join(data_path, 'interns')))
+    cache.update({
+        dataset: os.path.join(data_path, dataset) for dataset in datasets
+    }, processes=None)
+    flights = FlightIndex()
+    datetime_base = datetime.now(UTC)
+    cache.load_index(flights, datetime_base)
+    save_flight_index(flights, datetime_base, path_prefix)
+    logging.info(f'Published {flights} to `{path_prefix}`')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    publish(sys.argv[1])
@@ -0,0 +1,160 @@
+import json
+import lzma as xz
+import os
+from datetime import UTC, datetime
+from random import Random
+
+import pytest
+
+from search_flights.flight_cache import FlightCache
+from search_flights.flight_optim import FlightIndex
+
+
+def make_wizzair_flight(number, src, dst, departure, cost):
+    return dict(
+        carrierCode='W6', flightNumber=str(number),
+        departureStation=src, arrivalStation=dst,
+        departureDateTime=f'2025-07-{departure}T10:00:00', arrivalDateTime=f'2025-07-{departure}T12:30:00',
+        departureTimeUtcOffset='02:00:00', arrivalTimeUtcOffset='02:00:00',
+        fares=[dict(bundle='basic', fullBasePrice=dict(amount=cost))],
+    )
+
+
+def write_wizzair_file(root_dir, name, fetch_time, flights):
+    os.makedirs(root_dir, exist_ok=True)
+    data = dict(body=dict(outboundFlights=flights), fetch_timestamp=fetch_time)
+    with xz.open(os.path.join(root_dir, name), 'wt', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_update_removed_files(tmp_path):
+    data_dir = str(tmp_path / 'wizzair')
+    write_wizzair_file(data_dir, 'a.json.xz', '2025-06-01T10:00:00', [
+        make_wizzair_flight(1000, 'WAW', 'ALC', 10, 30),
+        make_wizzair_flight(1001, 'ALC', 'WAW', 12, 40),
+    ])
+    cache = FlightCache(str(tmp_path / 'cache'))
+    assert cache.update({'wizzair': data_dir}) == 2
+    assert len(cache.load_columns()['id']) == 2
+
+    os.remove(os.path.join(data_dir, 'a.json.xz'))
+    assert cache.update({'wizzair': data_dir}) == 0
+    assert len(cache.load_columns()['id']) == 0
+    assert cache._load_manifest()['files'] == {}
+
+
+def test_update_keeps_flight_ids(tmp_path):
+    data_dir = str(tmp_path / 'wizzair')
+    flights = [make_wizzair_flight(1000, 'WAW', 'ALC', day, 30) for day in (10, 11)]
+    write_wizzair_file(data_dir, 'a.json.xz', '2025-06-01T10:00:00', flights)
+    cache = FlightCache(str(tmp_path / 'cache'))
+    cache.update({'wizzair': data_dir})
+    ids = cache.load_columns()['id'].tolist()
+    assert sorted(ids) == [0, 1]
+
+    for i in range(120):
+        write_wizzair_file(data_dir, f'b{i:03}.json.xz', f'2025-06-02T10:{i // 60:02}:{i % 60:02}', [
+            make_wizzair_flight(1000, 'WAW', 'ALC', 12, 35),
+            make_wizzair_flight(1001, 'ALC', 'WAW', 12, 35),
+        ] + flights[::-1])
+    assert cache.update({'wizzair': data_dir}) == 480
+    columns = cache.load_columns()
+    assert columns['id'][:2].tolist() == ids
+    keys = set(zip(columns['flight_number'].tolist(), columns['start_time'].tolist(), columns['id'].tolist()))
+    assert len(keys) == 4
+    assert sorted(flight_id for _, _, flight_id in keys) == [0, 1, 2, 3]
+
+
+def test_update_interns_flight_numbers(tmp_path):
+    data_dir = str(tmp_path / 'wizzair')
+    write_wizzair_file(data_dir, 'a.json.xz', '2025-06-01T10:00:00', [
+        make_wizzair_flight(1000, 'WAW', 'ALC', 10, 30),
+        make_wizzair_flight(2345, 'ALC', 'WAW', 12, 40),
+        make_wizzair_flight(1000, 'WAW', 'ALC', 11, 30),
+    ])
+    cache = FlightCache(str(tmp_path / 'cache'))
+    cache.update({'wizzair': data_dir})
+    columns = cache.load_columns()
+    assert columns['flight_number'].tolist() == [0, 1, 0]
+    assert [cache.interns.flight_code(n) for n in columns['flight_number'].tolist()] == ['W61000', 'W62345', 'W61000']
+
+    reloaded = FlightCache(str(tmp_path / 'cache'))
+    assert reloaded.interns.flight_code(1) == 'W62345'
+
+
+# An update interrupted after some of its column files were replaced, or before its manifest was
+@pytest.mark.parametrize('stale_file', ['manifest.json', 'cost.npy'])
+def test_update_interrupted(tmp_path, stale_file):
+    data_dir = str(tmp_path / 'wizzair')
+    cache_dir = tmp_path / 'cache'
+    write_wizzair_file(data_dir, 'a.json.xz', '2025-06-01T10:00:00', [
+        make_wizzair_flight(1000, 'WAW', 'ALC', 10, 30),
+        make_wizzair_flight(1001, 'ALC', 'WAW', 12, 40),
+    ])
+    cache = FlightCache(str(cache_dir))
+    cache.update({'wizzair': data_dir})
+    stale = (cache_dir / stale_file).read_bytes()
+
+    write_wizzair_file(data_dir, 'b.json.xz', '2025-06-02T10:00:00', [
+        make_wizzair_flight(1000, 'WAW', 'ALC', 10, 35),
+        make_wizzair_flight(1002, 'WAW', 'ALC', 11, 50),
+    ])
+    cache.update({'wizzair': data_dir})
+    expected = cache.load_columns(mmap_mode=None)
+    (cache_dir / stale_file).write_bytes(stale)
+    with pytest.raises(ValueError):
+        cache.load_columns()
+
+    assert cache.update({'wizzair': data_dir}) == 4
+    columns = cache.load_columns()
+    assert sorted(zip(*(columns[name].tolist() for name in expected))) == \
+        sorted(zip(*(values.tolist() for values in expected.values())))
+
+
+def index_flights(flights):
+    return sorted((f.id, f.src, f.dst, f.start_time, f.cost) for f in flights)
+
+
+@pytest.mark.parametrize('dedup', ['latest', 'min_price', None])
+def test_update_index(tmp_path, dedup):
+    data_dir = str(tmp_path / 'wizzair')
+    rand = Random(0)
+    datetime_base = datetime(2025, 7, 1, tzinfo=UTC)
+
+    files = {}
+
+    def write_file(i, fetch_time=None):
+        if i not in files:
+            files[i] = [
+                make_wizzair_flight(rand.choice((1000, 1001, 1002)), 'WAW', rand.choice(('ALC', 'BCN')),
+                                    rand.randrange(10, 13), rand.randrange(10, 100))
+                for _ in range(5)
+            ]
+        write_wizzair_file(data_dir, f'{i:03}.json.xz', fetch_time or f'2025-06-{1 + i:02}T10:00:00', files[i])
+
+    write_file(0)
+    cache = FlightCache(str(tmp_path / 'cache'))
+    cache.update({'wizzair': data_dir})
+    flights = FlightIndex()
+    cache.load_index(flights, datetime_base, dedup)
+    flights.sort_flights()
+    for i in range(1, 12):
+        write_file(i)
+        version, before = flights.version, index_flights(flights)
+        assert cache.update_index(flights, datetime_base, {'wizzair': data_dir}, dedup=dedup) == 5
+        assert (flights.version > version) == (index_flights(flights) != before)
+
+        expected = FlightIndex()
+        FlightCache(str(tmp_path / 'cache')).load_index(expected, datetime_base, dedup)
+        assert index_flights(flights) == index_flights(expected)
+        assert sorted((f.src, f.start_time) for f in flights) == [(f.src, f.start_time) for f in flights]
+
+    # a rewritten file rebuilds the cache with the same row count, the rows are numbered anew
+    for i in (11, 0):
+        write_file(i, f'2025-05-{1 + i:02}T10:00:00')
+        mtime = os.path.getmtime(os.path.join(data_dir, f'{i:03}.json.xz'))
+        os.utime(os.path.join(data_dir, f'{i:03}.json.xz'), (mtime + 10, mtime + 10))
+        assert cache.update_index(flights, datetime_base, {'wizzair': data_dir}, dedup=dedup) == 60
+        expected = FlightIndex()
+        FlightCache(str(tmp_path / 'cache')).load_index(expected, datetime_base, dedup)
+        assert index_flights(flights) == index_flights(expected)
@@ -0,0 +1,60 @@
+from random import Random
+
+import numpy as np
+
+from search_flights.flight_optim import FlightIndex
+from search_flights.load_flights import push_columns, merge_columns
+
+
+def make_columns(ids, seed=0):
+    rand = Random(seed)
+    return {
+        'id': np.array(ids, dtype=np.int32),
+        'src': np.array([rand.randrange(6) for _ in ids], dtype=np.int32),
+        'dst': np.array([rand.randrange(6) for _ in ids], dtype=np.int32),
+        'start_time': np.array([rand.uniform(0, 20) for _ in ids], dtype=np.float32),
+        'day_start_time': np.full(len(ids), .4, dtype=np.float32),
+        'day_end_time': np.full(len(ids), .5, dtype=np.float32),
+        'duration': np.full(len(ids), .1, dtype=np.float32),
+        'cost': np.array([rand.randrange(10, 100) for _ in ids], dtype=np.float32),
+    }
+
+
+def index_flights(flights):
+    return [(f.src, f.start_time, f.id, f.dst, f.cost) for f in flights]
+
+
+def test_merge_flights():
+    columns = make_columns(range(300))
+    flights = FlightIndex()
+    push_columns(flights, {name: c[:200] for name, c in columns.items()}, sort=True)
+    version = flights.version
+    merge_columns(flights, {name: c[200:] for name, c in columns.items()})
+    assert flights.version > version
+
+    expected = FlightIndex()
+    push_columns(expected, columns, sort=True)
+    assert len(flights) == 300
+    assert sorted(index_flights(flights)) == index_flights(flights)
+    assert index_flights(flights) == index_flights(expected)
+    assert flights.nsources == expected.nsources
+
+
+def test_remove_flights():
+    columns = make_columns(range(100))
+    flights = FlightIndex()
+    push_columns(flights, columns, sort=True)
+    version = flights.version
+    flights.remove_flights(np.array([99, 5, 17, 1000], dtype=np.int32))
+    assert flights.version > version
+    assert sorted(f.id for f in flights) == sorted(set(range(100)) - {5, 17, 99})
+    assert sorted(index_flights(flights)) == index_flights(flights)
+
+    version = flights.version
+    flights.remove_flights(np.array([1000], dtype=np.int32))
+    assert flights.version == version
+
+    src_flights = flights.select_flights({columns['src'][5]}, set(range(6)), 0, 100)
+    assert len(src_flights) == sum(
+        1 for i in range(100) if i not in (5, 17, 99) and columns['src'][i] == columns['src'][5]
+    )
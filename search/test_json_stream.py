@@ -0,0 +1,33 @@
+import io
+import json
+from random import Random
+
+from search_flights.json_stream import JsonStream
+
+
+def make_value(rand, depth=0):
+    kind = rand.randrange(7 if depth < 4 else 4)
+    if kind == 0:
+        return rand.choice((True, False, None, rand.randint(-10 ** 6, 10 ** 6), rand.uniform(-1e3, 1e3)))
+    if kind in (1, 2, 3):
+        return ''.join(rand.choice('ab"\\{}[],: \né') for _ in range(rand.randrange(12)))
+    if kind in (4, 5):
+        return [make_value(rand, depth + 1) for _ in range(rand.randrange(5))]
+    return {f'k{i}': make_value(rand, depth + 1) for i in range(rand.randrange(5))}
+
+
+def test_skip():
+    rand = Random(0)
+    for chunk_size in (1, 2, 3, 7, 64):
+        for _ in range(20):
+            doc = {f'key{i}': make_value(rand) for i in range(10)}
+            kept = {key for key in doc if rand.random() < .5}
+            stream = JsonStream(io.StringIO(json.dumps(doc, indent=rand.choice((None, 1)))), chunk_size)
+            values = {}
+            for key in stream.iter_object():
+                if key in kept:
+                    values[key] = stream.value()
+                else:
+                    stream.skip()
+            assert values == {key: doc[key] for key in kept}
+            assert stream.peek() == ''
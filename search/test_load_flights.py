@@ -0,0 +1,274 @@
+from datetime import UTC, datetime, timedelta
+import io
+import json
+import os
+from random import Random
+
+import pytest
+
+from search_flights import load_flights
+from search_flights.flight_optim import FlightIndex
+from search_flights.load_flights import (
+    _parse_time, date_to_days, get_day_time, flight_id_to_int,
+    dates_to_days, get_day_times, parse_times,
+    parse_ryanair_flights, parse_wizzair_flights,
+    dedup_columns, number_parsed_flights, rows_to_columns,
+    EPOCH, FlightFilter, days_since_epoch, iterate_flights, load_wizzair_flights, stream_wizzair_flights
+)
+from test_flight_cache import make_wizzair_flight, write_wizzair_file
+
+
+date_base = datetime(2025, 6, 30, 13, 17, 41, 123456, tzinfo=UTC)
+
+
+def make_dates(n=1000, seed=0):
+    rand = Random(seed)
+    dates = []
+    for i in range(n):
+        date = datetime(2025, 1, 1) + timedelta(
+            days=rand.randint(-400, 400), seconds=rand.randint(0, 86399),
+            microseconds=rand.choice((0, 0, rand.randint(0, 999) * 1000, rand.randint(0, 999999)))
+        )
+        date_str = date.isoformat()
+        if i % 3 == 0:
+            date_str += 'Z'
+        elif i % 3 == 1 and not date.microsecond:
+            date_str += '.000Z'
+        dates.append(date_str)
+    return dates
+
+
+def test_dates_to_days():
+    dates = make_dates()
+    assert dates_to_days(dates, date_base).tolist() == [date_to_days(d, date_base) for d in dates]
+
+
+def test_get_day_times():
+    dates = make_dates()
+    assert get_day_times(dates).tolist() == [get_day_time(d) for d in dates]
+
+
+def test_parse_times():
+    offsets = ['02:00:00', '01:00:00', '00:00:00', '-05:30:00', '05:45:00', '-03:00:00', '02:00:00']
+    assert parse_times(offsets).tolist() == [_parse_time(t) for t in offsets]
+
+
+def test_parse_wizzair_flights():
+    departures = make_dates(10, seed=1)
+    arrivals = make_dates(10, seed=2)
+    flights = [
+        dict(
+            carrierCode='W6', flightNumber=str(1000 + i),
+            departureStation='WAW', arrivalStation='ALC',
+            departureDateTime=dep.rstrip('Z'), arrivalDateTime=arr.rstrip('Z'),
+            departureTimeUtcOffset='02:00:00', arrivalTimeUtcOffset='-01:00:00',
+            fares=[dict(bundle='basic', fullBasePrice=dict(amount=10 + i))] if i % 4 else [],
+        )
+        for i, (dep, arr) in enumerate(zip(departures, arrivals))
+    ]
+    expected = []
+    for f in flights:
+        if f['fares']:
+            date_start = date_to_days(f['departureDateTime'], date_base) - _parse_time(f['departureTimeUtcOffset'])
+            date_end = date_to_days(f['arrivalDateTime'], date_base) - _parse_time(f['arrivalTimeUtcOffset'])
+            expected.append((
+                flight_id_to_int(f['carrierCode'] + f['flightNumber']), 'WAW', 'ALC',
+                date_start, get_day_time(f['departureDateTime']), get_day_time(f['arrivalDateTime']),
+                date_end - date_start, f['fares'][0]['fullBasePrice']['amount'],
+                date_to_days('2025-06-01T10:00:00', date_base)
+            ))
+    data = dict(body=dict(outboundFlights=flights), fetch_timestamp='2025-06-01T10:00:00')
+    assert list(parse_wizzair_flights(data, date_base)) == expected
+
+
+def test_parse_ryanair_flights():
+    utc_dates = make_dates(12, seed=3)
+    local_dates = make_dates(12, seed=4)
+    flights = [
+        dict(
+            flightNumber=f'FR {100 + i}',
+            segments=[dict(origin='MAN', destination='KRK')],
+            timeUTC=utc_dates[i:i + 2], time=local_dates[i:i + 2],
+            regularFare=dict(fares=[dict(publishedFare=20.5 + i)]) if i % 3 else None,
+        )
+        for i in range(0, 12, 2)
+    ]
+    expected = []
+    for f in flights:
+        if f['regularFare']:
+            date_start = date_to_days(f['timeUTC'][0], date_base)
+            date_end = date_to_days(f['timeUTC'][1], date_base)
+            expected.append((
+                flight_id_to_int(f['flightNumber']), 'MAN', 'KRK',
+                date_start, get_day_time(f['time'][0]), get_day_time(f['time'][1]),
+                date_end - date_start, f['regularFare']['fares'][0]['publishedFare'],
+                float('-inf')
+            ))
+    data = dict(booking=dict(trips=[dict(dates=[dict(flights=flights)])]))
+    assert list(parse_ryanair_flights(data, date_base)) == expected
+
+
+def test_dedup_columns():
+    # id, src, dst, start_time, day_start_time, day_end_time, duration, cost, flight_number, fetch_time
+    columns = rows_to_columns((
+        (101, 0, 1, 1.5, .5, .6, .1, 30, 1, 10.),
+        (102, 0, 1, 1.5, .5, .6, .1, 20, 1, 11.),
+        (103, 0, 1, 2.5, .5, .6, .1, 50, 1, 9.),
+        (201, 1, 0, 1.5, .5, .6, .1, 40, 2, 12.),
+        (104, 0, 1, 1.5, .5, .6, .1, 25, 1, 12.),
+    ))
+    assert dedup_columns(columns, None)['id'].tolist() == [101, 102, 103, 201, 104]
+    assert dedup_columns(columns, 'latest')['id'].tolist() == [103, 201, 104]
+    assert dedup_columns(columns, 'min_price')['id'].tolist() == [102, 103, 201]
+
+
+def test_number_parsed_flights():
+    parsed = [
+        (flight_number, 'WAW', 'ALC', float(day), .5, .6, .1, 10 + i, float(i))
+        for i in range(150) for flight_number, day in ((1000, i % 2), (1001, 0))
+    ]
+    flight_id_idx = {}
+    rows = list(number_parsed_flights(parsed, {}, flight_id_idx))
+    assert [row[0] for row in rows[:4]] == [0, 1, 2, 1]
+    assert len(flight_id_idx) == 3
+    assert {(row[8], row[3]): row[0] for row in rows} == flight_id_idx
+
+
+def test_flight_filter():
+    flight_filter = FlightFilter(['WAW'], ['ALC', 'BCN'], datetime(2025, 7, 11, tzinfo=UTC), datetime(2025, 7, 13, tzinfo=UTC))
+    start, end = days_since_epoch(datetime(2025, 7, 11, tzinfo=UTC)), days_since_epoch(datetime(2025, 7, 13, tzinfo=UTC))
+    assert flight_filter.match_file([('MAN', 'KRK'), ('WAW', 'BCN')], (start - 5, start))
+    assert flight_filter.match_file([('WAW', 'ALC')], (end, end + 1))
+    assert not flight_filter.match_file([('ALC', 'WAW'), ('WAW', 'KRK')], (start, end))
+    assert not flight_filter.match_file([('WAW', 'ALC')], (end + .1, end + 1))
+    assert not flight_filter.match_file([], (start, end))
+    assert FlightFilter().match_file([('MAN', 'KRK')], (0, 1))
+
+    base_days = days_since_epoch(date_base)
+    flights = [
+        (1000, src, dst, start_time - base_days, .5, .6, .1, 10, 0.)
+        for src, dst in (('WAW', 'ALC'), ('ALC', 'WAW'), ('WAW', 'KRK'))
+        for start_time in (start - 1, start, end, end + 1)
+    ]
+    assert list(flight_filter.filter_flights(flights, base_days)) == [
+        f for f in flights if f[1:3] == ('WAW', 'ALC') and start <= f[3] + base_days <= end
+    ]
+
+
+ROUTES = (('WAW', 'ALC'), ('ALC', 'WAW'), ('MAN', 'KRK'), ('KRK', 'MAN'), ('WAW', 'BCN'))
+
+
+def test_filter_pushdown(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'wizzair')
+
+    def write_file(i, route, day):
+        write_wizzair_file(data_dir, f'{i:02}.json.xz', f'2025-06-01T10:{i:02}:00', [
+            make_wizzair_flight(1000 + i, *route, day, 10 + i),
+            make_wizzair_flight(2000 + i, *route, day + 1, 20 + i),
+        ])
+        return os.path.join(data_dir, f'{i:02}.json.xz')
+
+    for i in range(20):
+        write_file(i, ROUTES[i % len(ROUTES)], 10 + i // len(ROUTES))
+
+    opened = []
+    load_json_xz = load_flights.load_json_xz
+    monkeypatch.setattr(load_flights, 'load_json_xz', lambda path: opened.append(path) or load_json_xz(path))
+
+    def load(flight_filter):
+        opened.clear()
+        rows = list(iterate_flights(data_dir, parse_wizzair_flights, EPOCH, flight_filter=flight_filter))
+        return sorted(rows), sorted(os.path.basename(path) for path in opened)
+
+    all_rows = sorted(iterate_flights(data_dir, parse_wizzair_flights, EPOCH, use_manifest=False))
+    flight_filter = FlightFilter(['WAW'], ['ALC'], datetime(2025, 7, 12, tzinfo=UTC))
+
+    def expected_rows():
+        return [row for row in all_rows if row[1:3] == ('WAW', 'ALC') and row[3] >= flight_filter.start_time]
+
+    # without a manifest entry every file is read, then only files that can match are opened
+    rows, files = load(flight_filter)
+    assert rows == expected_rows() and len(files) == 20
+    rows, files = load(flight_filter)
+    assert rows == expected_rows()
+    assert files == ['05.json.xz', '10.json.xz', '15.json.xz']
+
+    # a modified and a new file are read again
+    modified = write_file(2, ('WAW', 'ALC'), 20)
+    mtime = os.path.getmtime(modified)
+    os.utime(modified, (mtime + 10, mtime + 10))
+    write_file(20, ('ALC', 'WAW'), 25)
+    all_rows = sorted(iterate_flights(data_dir, parse_wizzair_flights, EPOCH, use_manifest=False))
+    rows, files = load(flight_filter)
+    assert rows == expected_rows()
+    assert files == ['02.json.xz', '05.json.xz', '10.json.xz', '15.json.xz', '20.json.xz']
+    rows, files = load(flight_filter)
+    assert rows == expected_rows()
+    assert files == ['02.json.xz', '05.json.xz', '10.json.xz', '15.json.xz']
+
+
+AIRPORTS = ('WAW', 'ALC', 'BCN', 'KTW', 'LTN')
+
+
+# Flight numbers and days repeat across files, so most flights have several snapshots
+def write_random_dataset(data_dir, nfiles=30, seed=0):
+    rand = Random(seed)
+    for i in range(nfiles):
+        flights = []
+        for _ in range(rand.randrange(6)):
+            flight = make_wizzair_flight(
+                rand.randrange(1000, 1005), *rand.sample(AIRPORTS, 2), rand.randrange(10, 14), rand.randrange(10, 200)
+            )
+            if rand.random() < .2:
+                flight['fares'] = []
+            flights.append(flight)
+        write_wizzair_file(data_dir, f'{i:03}.json.xz', f'2025-06-{1 + i // 24:02}T{i % 24:02}:00:00', flights)
+
+
+@pytest.mark.parametrize('processes', [2, 4, None])
+def test_iterate_flights_processes(tmp_path, processes):
+    data_dir = str(tmp_path / 'wizzair')
+    write_random_dataset(data_dir)
+    expected = list(iterate_flights(data_dir, parse_wizzair_flights, date_base, use_manifest=False))
+    assert expected
+    assert list(iterate_flights(data_dir, parse_wizzair_flights, date_base, processes, use_manifest=False)) == expected
+
+    def load(processes):
+        flights, city_idx, flight_id_idx = FlightIndex(), {}, {}
+        load_wizzair_flights(flights, data_dir, date_base, city_idx, flight_id_idx, processes, dedup=None)
+        return [(f.id, f.src, f.dst, f.start_time, f.cost) for f in flights], city_idx, flight_id_idx
+
+    assert load(processes) == load(1)
+
+
+STREAM_FLIGHTS = [
+    make_wizzair_flight(1000, 'WAW', 'ALC', 10, 30),
+    make_wizzair_flight(1001, 'ALC', 'WAW', 12, 40) | dict(fares=[]),
+    make_wizzair_flight(1002, 'WAW', 'BCN', 11, 25.5) | dict(extra=dict(notes=['a', {'b': None}], name='Łódź "x"')),
+]
+
+
+@pytest.mark.parametrize('data', [
+    dict(body=dict(outboundFlights=STREAM_FLIGHTS), fetch_timestamp='2025-06-01T10:00:00'),
+    dict(fetch_timestamp='2025-06-01T10:00:00', body=dict(returnFlights=STREAM_FLIGHTS, outboundFlights=STREAM_FLIGHTS)),
+    dict(headers=dict(body=[1, 2]), body=dict(outboundFlights=STREAM_FLIGHTS[::-1], x=None), fetch_timestamp=None),
+    dict(body=dict(outboundFlights=None), fetch_timestamp='2025-06-01T10:00:00'),
+    dict(body=dict(outboundFlights=[]), fetch_timestamp='2025-06-01T10:00:00'),
+    dict(body=dict(), fetch_timestamp='2025-06-01T10:00:00'),
+])
+def test_stream_wizzair_flights(data):
+    expected = list(parse_wizzair_flights(data, date_base))
+    for indent in (None, 2):
+        f = io.StringIO(json.dumps(data, indent=indent, ensure_ascii=False))
+        assert list(stream_wizzair_flights(f, date_base)) == expected
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_stream_wizzair_dataset(tmp_path, processes):
+    data_dir = str(tmp_path / 'wizzair')
+    write_random_dataset(data_dir, seed=1)
+    expected = list(iterate_flights(data_dir, parse_wizzair_flights, date_base, use_manifest=False))
+    assert expected
+    assert list(iterate_flights(
+        data_dir, stream_wizzair_flights, date_base, processes, use_manifest=False, stream=True
+    )) == expected
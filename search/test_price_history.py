@@ -0,0 +1,46 @@
+from random import Random
+
+import numpy as np
+
+from search_flights.price_history import HISTORY_COLUMNS, PriceHistory
+
+
+def make_snapshots(n=2000, nflights=150, seed=0):
+    rand = Random(seed)
+    flights = [
+        (i, rand.randrange(4), rand.randrange(4), float(rand.randrange(30)), 1000 + i % 40)
+        for i in range(nflights)
+    ]
+    rows = []
+    for _ in range(n):
+        flight_id, src, dst, start_time, flight_number = rand.choice(flights)
+        rows.append((flight_id, src, dst, start_time, flight_number, rand.uniform(-60, 0), float(rand.randrange(10, 200))))
+    return {
+        name: np.array(column) for name, column in zip(HISTORY_COLUMNS, zip(*rows))
+    }
+
+
+def slice_columns(columns, begin, end):
+    return {name: column[begin:end] for name, column in columns.items()}
+
+
+def test_append_matches_full_history():
+    columns = make_snapshots()
+    full = PriceHistory(columns)
+    history = PriceHistory(slice_columns(columns, 0, 500), min_merge_size=300)
+    for begin in range(500, 2000, 100):
+        history.append(slice_columns(columns, begin, begin + 100))
+        assert len(history._tail['id']) < 400
+
+    assert len(history) == len(full)
+    for flight_id in np.unique(columns['id']).tolist():
+        for expected, values in zip(full.price_trajectory(flight_id), history.price_trajectory(flight_id)):
+            assert expected.tolist() == values.tolist()
+    for src in range(4):
+        for dst in range(4):
+            for expected, values in zip(full.route_trend(src, dst, 5, 20), history.route_trend(src, dst, 5, 20)):
+                assert expected.tolist() == values.tolist()
+
+    history.merge()
+    assert not len(history._tail['id'])
+    assert history.ids.tolist() == full.ids.tolist()
@@ -0,0 +1,292 @@
+import numpy as np
+import pytest
+
+from search_flights.benchmark import make_flight_columns
+from search_flights.flight_optim import (
+    ConnectionSearchSettings, DiffCostSettings, FlightIndex, SearchStats,
+    find_best_single_trip, find_best_single_trips, find_connections, find_pareto_trips
+)
+from search_flights.settings import make_search_settings
+
+
+def make_flights(airports=25, flights_per_day=3, days=20, seed=0, start_time=-np.inf):
+    columns = make_flight_columns(airports, flights_per_day, days, seed=seed)
+    departs = columns['start_time'] >= start_time
+    flights = FlightIndex()
+    flights.push_flights(*(column[departs] for column in columns.values()))
+    return flights
+
+
+def select_all(flights):
+    airports = set(range(flights.nsources))
+    return flights.select_flights(airports, airports, -1., 1e9)
+
+
+def travels_repr(travels):
+    return [repr(t) for t in travels]
+
+
+def test_start_time():
+    flights = make_flights()
+    settings = make_search_settings(dict(search_interval=2.))
+    for start_time in (0., 3.5, 7.):
+        trips = find_best_single_trip(0, start_time, select_all(flights), settings, {})
+        assert trips
+        # flights before start_time can not be taken, so leaving them out changes nothing
+        assert travels_repr(trips) == travels_repr(
+            find_best_single_trip(0, -1., select_all(make_flights(start_time=start_time)), settings, {})
+        )
+
+
+def test_batch_order():
+    flights = make_flights()
+    selected = select_all(flights)
+    queries = [
+        (start_city, start_time, make_search_settings(dict(search_interval=search_interval)))
+        for start_city in (3, 0, 7) for start_time, search_interval in ((0., 2.), (4., 1.))
+    ]
+    expected = [
+        travels_repr(find_best_single_trip(start_city, start_time, selected, settings, {}, top_k=5))
+        for start_city, start_time, settings in queries
+    ]
+    for threads in (1, 3, 0):
+        results = find_best_single_trips(queries, selected, {}, threads=threads, top_k=5)
+        assert [travels_repr(travels) for travels in results] == expected
+
+
+def test_batch_errors():
+    flights = make_flights()
+    settings = make_search_settings()
+    with pytest.raises(TypeError):
+        find_best_single_trips([(0, 0., None)], flights, {})
+    with pytest.raises(ValueError):
+        find_best_single_trips([(0, 0., settings)], flights, {}, top_k=-1)
+    # raised by a worker thread and passed on after all threads stopped
+    queries = [(start_city, 0., settings) for start_city in (0, 1, -1, 2, 3)]
+    for threads in (1, 2, 4):
+        with pytest.raises(ValueError, match='start_city'):
+            find_best_single_trips(queries, flights, {}, threads=threads)
+
+
+def travel_chains(travels):
+    by_id = {t.id: t for t in travels}
+    chains = set()
+    for travel in travels:
+        chain = [travel.last_flight]
+        while travel.last_travel >= 0:
+            travel = by_id[travel.last_travel]
+            chain.append(travel.last_flight)
+        chains.add(tuple(reversed(chain)))
+    return chains
+
+
+def cheapest_trips(travels, travels_end_scored, k):
+    # end scoring is added to the trips only, so the trips are the travels it changes
+    trips = sorted(
+        (t for t, scored in zip(travels, travels_end_scored) if t.cost != scored.cost),
+        key=lambda t: t.cost
+    )
+    by_id = {t.id: t for t in travels}
+    used = []
+    for travel in trips[:k]:
+        used.append(travel)
+        while travel.last_travel >= 0:
+            travel = by_id[travel.last_travel]
+            used.append(travel)
+    return used
+
+
+@pytest.mark.parametrize('seed,start_city,search_interval', [
+    (17, 0, 2.), (3, 5, 1.), (8, 11, 3.), (21, 2, 2.),
+])
+def test_top_k(seed, start_city, search_interval):
+    selected = select_all(make_flights(seed=seed))
+    settings = make_search_settings(dict(search_interval=search_interval))
+    travels = find_best_single_trip(start_city, 0., selected, settings, {})
+    travels_end_scored = find_best_single_trip(start_city, 0., selected, make_search_settings(dict(
+        search_interval=search_interval,
+        end_out_day_time=dict(desired_value=-1., down_factor=0., up_factor=1000.)
+    )), {})
+    for k in (1, 5, 20, 60):
+        assert travel_chains(find_best_single_trip(start_city, 0., selected, settings, {}, top_k=k)) == travel_chains(
+            cheapest_trips(travels, travels_end_scored, k)
+        )
+
+
+COUNTERS = (
+    'flights_scanned', 'travels_scanned', 'travels_expanded', 'no_travel',
+    'pruned_back', 'pruned_forward', 'replaced', 'pruned_top_k'
+)
+
+
+def counters(stats):
+    return {name: getattr(stats, name) for name in COUNTERS}
+
+
+@pytest.mark.parametrize('top_k', [0, 5])
+def test_search_stats(top_k):
+    selected = select_all(make_flights())
+    settings = make_search_settings(dict(search_interval=2.))
+    stats = SearchStats()
+    travels = find_best_single_trip(0, 0., selected, settings, {}, top_k=top_k, stats=stats)
+    # counting does not change the search
+    assert travels_repr(travels) == travels_repr(find_best_single_trip(0, 0., selected, settings, {}, top_k=top_k))
+
+    # both phases scan every flight, each extension is pruned or kept and only kept travels are replaced
+    assert stats.flights_scanned == 2 * len(selected)
+    kept = stats.travels_expanded - stats.pruned_back - stats.pruned_forward - stats.pruned_top_k
+    assert len(travels) <= kept
+    assert stats.replaced <= kept and stats.peak_frontier <= kept
+    assert (stats.pruned_top_k > 0) == (top_k > 0)
+    assert stats.start_phase_seconds > 0 and stats.end_phase_seconds > 0
+
+    # counters add up over searches, the peak frontier is the largest one
+    single = counters(stats)
+    find_best_single_trip(0, 0., selected, settings, {}, top_k=top_k, stats=stats)
+    assert counters(stats) == {name: 2 * value for name, value in single.items()}
+    peak_frontier = stats.peak_frontier
+    stats.reset()
+    assert stats.as_dict() == dict.fromkeys(stats.as_dict(), 0)
+
+    queries = [(start_city, 0., settings) for start_city in (0, 3, 7)]
+    expected = SearchStats()
+    for start_city, start_time, query_settings in queries:
+        find_best_single_trip(start_city, start_time, selected, query_settings, {}, top_k=top_k, stats=expected)
+    find_best_single_trips(queries, selected, {}, threads=3, top_k=top_k, stats=stats)
+    assert counters(stats) == counters(expected)
+    assert stats.peak_frontier == expected.peak_frontier >= peak_frontier
+
+
+def brute_force_connections(columns, start_city, start_time, end_city, settings):
+    end_time = start_time + settings.max_duration
+    flights = [
+        i for i in range(len(columns['id']))
+        if columns['start_time'][i] >= start_time and columns['src'][i] != end_city
+        and columns['start_time'][i] + columns['duration'][i] <= end_time
+    ]
+    wait = settings.wait_time
+    arrivals = []
+
+    def extend(city, arrival, cost, flights_count):
+        if city == end_city:
+            arrivals.append((arrival, cost))
+            return
+        if flights_count >= settings.max_flights:
+            return
+        for i in flights:
+            if columns['src'][i] != city:
+                continue
+            flight_cost = cost + columns['cost'][i]
+            if flights_count:
+                wait_time = columns['start_time'][i] - arrival
+                if wait_time < settings.min_connection_time:
+                    continue
+                diff = wait_time - wait.desired_value
+                flight_cost += settings.move_cost + (diff * wait.up_factor if diff >= 0 else -diff * wait.down_factor)
+            elif columns['start_time'][i] < start_time:
+                continue
+            extend(columns['dst'][i], columns['start_time'][i] + columns['duration'][i], flight_cost, flights_count + 1)
+
+    extend(start_city, start_time, 0., 0)
+    front = []
+    for arrival, cost in sorted(arrivals):
+        if not front or cost < front[-1][1] - 1e-3:
+            front.append((arrival, cost))
+    return front
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('max_flights', [1, 2, 3])
+def test_connections(seed, max_flights):
+    columns = make_flight_columns(8, 3, 4, routes_per_airport=2, seed=seed)
+    flights = FlightIndex()
+    flights.push_flights(*columns.values())
+    settings = ConnectionSearchSettings(
+        min_connection_time=1 / 24, max_duration=3., max_flights=max_flights,
+        wait_time=DiffCostSettings(desired_value=2 / 24, down_factor=10., up_factor=20.), move_cost=5.
+    )
+    for start_city, end_city in ((0, 1), (2, 5), (4, 3), (6, 7)):
+        travels = find_connections(start_city, .5, end_city, select_all(flights), settings)
+        front = sorted((t.end_time, t.cost) for t in travels if t.end_vertex == end_city)
+        expected = brute_force_connections(columns, start_city, .5, end_city, settings)
+        assert len(front) == len(expected)
+        assert np.allclose(front, expected, rtol=1e-4)
+
+
+def test_connections_flights_count():
+    # 0 -> 1 -> 3 -> 4 is the only itinerary within 3 flights, the cheaper way to 1 takes 2 flights
+    src, dst, start_time, duration, cost = zip(
+        (0, 1, .1, .1, 100.),
+        (0, 2, .1, .05, 5.),
+        (2, 1, .2, .05, 5.),
+        (1, 3, .4, .1, 10.),
+        (3, 4, .7, .1, 10.),
+    )
+    start_time, duration = np.array(start_time, dtype=np.float32), np.array(duration, dtype=np.float32)
+    flights = FlightIndex()
+    flights.push_flights(
+        np.arange(len(src), dtype=np.int32), np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32),
+        start_time, start_time, start_time + duration, duration, np.array(cost, dtype=np.float32)
+    )
+    settings = ConnectionSearchSettings(min_connection_time=.01, max_flights=3)
+    travels = find_connections(0, 0., 4, flights.select_flights(set(range(5)), set(range(5)), -1., 1.), settings)
+    assert [t.last_flight for t in travels] == [0, 3, 4]
+    assert travels[-1].cost == 120.
+
+
+def push_test_flights(*flights):
+    src, dst, start_time, duration, cost = zip(*flights)
+    start_time, duration = np.array(start_time, dtype=np.float32), np.array(duration, dtype=np.float32)
+    index = FlightIndex()
+    index.push_flights(
+        np.arange(len(src), dtype=np.int32), np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32),
+        start_time, start_time % 1, (start_time + duration) % 1, duration, np.array(cost, dtype=np.float32)
+    )
+    return index
+
+
+def pareto_dominates(a, b):
+    return a.price <= b.price and a.duration <= b.duration and a.penalty <= b.penalty and (
+        (a.price, a.duration, a.penalty) != (b.price, b.duration, b.penalty)
+    )
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('start_time', [0., 2.])
+def test_pareto_trips(seed, start_time):
+    flights = make_flights(airports=12, flights_per_day=2, days=12, seed=seed)
+    selected = select_all(flights)
+    settings = make_search_settings()
+    travels = find_pareto_trips(seed, start_time, selected, settings, {})
+    front = [t for t in travels if t.front]
+    assert front
+    for trip in front:
+        assert trip.travel.cost == pytest.approx(trip.price + trip.penalty)
+        assert not any(pareto_dominates(other, trip) for other in front)
+
+    first_flights = selected.find_flights({chain[0] for chain in travel_chains([t.travel for t in travels])})
+    assert {f.src for f in first_flights} == {seed}
+    assert min(f.start_time for f in first_flights) >= start_time
+
+    # the cheapest trip of the scalar search is on the front
+    scalar_travels = find_best_single_trip(seed, start_time, selected, settings, {})
+    scalar_trips = cheapest_trips(scalar_travels, find_best_single_trip(seed, start_time, selected, make_search_settings(dict(
+        end_out_day_time=dict(desired_value=-1., down_factor=0., up_factor=1000.)
+    )), {}), 1)
+    assert min(t.travel.cost for t in front) == pytest.approx(scalar_trips[0].cost)
+
+
+def test_pareto_trips_end_scoring():
+    # flight 1 dominates flight 0 until start_out_day_time scores the day time they end the first leg at
+    flights = push_test_flights(
+        (0, 1, .5, .1, 10.),
+        (0, 1, .501, .09, 10.),
+        (1, 0, 2.6, .1, 10.),
+    )
+    settings = make_search_settings(dict(
+        start_in_day_time=dict(desired_value=.9, down_factor=1000., up_factor=1000.),
+        start_out_day_time=dict(desired_value=.5, down_factor=10000., up_factor=10000.),
+    ))
+    travels = find_pareto_trips(0, 0., flights.select_flights({0, 1}, {0, 1}, -1., 10.), settings, {})
+    trips = {chain for chain in travel_chains([t.travel for t in travels]) if len(chain) == 2}
+    assert trips == {(0, 2), (1, 2)}
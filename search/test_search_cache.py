@@ -0,0 +1,28 @@
+from search_flights.search_cache import settings_key
+from search_flights.settings import DEFAULT_SEARCH_SETTINGS, make_search_settings
+
+
+def test_settings_key():
+    key = settings_key(make_search_settings())
+    assert key == settings_key(make_search_settings(dict(DEFAULT_SEARCH_SETTINGS)))
+    hash(key)
+
+    changes = [
+        dict(search_interval=4.),
+        dict(move_cost=101.),
+        dict(day_scorer=dict(day_costs=(1, 2, 3, 5))),
+        dict(day_scorer=dict(start_time=.02)),
+        dict(day_scorer=dict(day_factor=2.)),
+        dict(cover_settings=dict(time_back=8.)),
+        dict(cover_settings=dict(back_cost_factor=99.)),
+    ] + [
+        {name: {field: 1.5}}
+        for name in (
+            'start_in_day_time', 'start_out_day_time', 'end_in_day_time', 'end_out_day_time',
+            'wait_time', 'trip_duration', 'flight_duration'
+        )
+        for field in ('desired_value', 'down_factor', 'up_factor')
+    ]
+    keys = [settings_key(make_search_settings(change)) for change in changes]
+    assert key not in keys
+    assert len(set(keys)) == len(keys)
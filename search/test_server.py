@@ -0,0 +1,72 @@
+from datetime import UTC, datetime
+
+import pytest
+
+from search_flights import server
+from search_flights.benchmark import make_flight_columns
+from search_flights.flight_optim import FlightIndex
+from search_flights.interning import CodeTable
+from search_flights.search_cache import SearchCache
+
+
+AIRPORTS = ('WAW', 'ALC', 'BCN', 'MAN', 'KRK', 'LTN')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    flights = FlightIndex()
+    flights.push_flights(*make_flight_columns(len(AIRPORTS), 2, 10).values())
+    city_idx = CodeTable.empty(36 ** 3, 3)
+    for i, code in enumerate(AIRPORTS):
+        city_idx[code] = i
+    monkeypatch.setattr(server, 'FLIGHTS', flights)
+    monkeypatch.setattr(server, 'CITY_IDX', city_idx)
+    monkeypatch.setattr(server, 'SEARCH_CACHE', SearchCache(flights))
+    monkeypatch.setattr(server, 'DATETIME_BASE', datetime(2025, 7, 1, tzinfo=UTC))
+    return server.app.test_client()
+
+
+def test_info(client):
+    response = client.get('/info')
+    assert response.status_code == 200
+    assert response.json['flights'] == len(server.FLIGHTS)
+    assert response.json['airports'] == list(AIRPORTS)
+    assert response.json['datetime_base'] == '2025-07-01T00:00:00+00:00'
+
+
+def test_search(client):
+    response = client.post('/search', json=dict(start_city='WAW', top_k=3))
+    assert response.status_code == 200
+    travels = response.json
+    assert travels
+    flights = {f.id: f for f in server.FLIGHTS}
+    by_id = {t['id']: t for t in travels}
+    for travel in travels:
+        flight = flights[travel['last_flight']]
+        assert travel['flight'] == dict(
+            id=flight.id, src=AIRPORTS[flight.src], dst=AIRPORTS[flight.dst],
+            start_time=flight.start_time, day_start_time=flight.day_start_time,
+            day_end_time=flight.day_end_time, duration=flight.duration, cost=flight.cost,
+        )
+        assert travel['end_city'] == travel['flight']['dst']
+        if travel['last_travel'] < 0:
+            assert travel['flight']['src'] == 'WAW'
+        else:
+            assert by_id[travel['last_travel']]['end_city'] == travel['flight']['src']
+
+    # the second search is served from the cache
+    assert client.post('/search', json=dict(start_city='WAW', top_k=3)).json == travels
+    assert client.get('/info').json['cache']['hits'] >= 1
+
+
+def test_search_errors(client):
+    response = client.post('/search', json=dict(start_city='XXX'))
+    assert response.status_code == 400
+    assert response.json == dict(error='Unknown airport: XXX')
+
+    response = client.post('/search', json=dict(start_city='WAW', settings=dict(unknown=1)))
+    assert response.status_code == 400
+
+    response = client.post('/search', json=dict())
+    assert response.status_code == 500
+    assert response.json['type'] == 'TypeError'
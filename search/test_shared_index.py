@@ -0,0 +1,103 @@
+from datetime import UTC, datetime
+
+import numpy as np
+import pytest
+
+from search_flights.flight_optim import FLIGHT_NBYTES, FlightIndex, FlightIndexView
+from search_flights.load_flights import push_columns
+from search_flights.shared_index import FLIGHT_DTYPE, load_flight_index, save_flight_index
+from test_flight_index import make_columns
+
+
+def flight_records(flights):
+    return [
+        (f.id, f.src, f.dst, f.start_time, f.day_start_time, f.day_end_time, f.duration, f.cost)
+        for f in flights
+    ]
+
+
+def selected_records(flights, src, dst, start_time, end_time):
+    selected = flights.select_flights(src, dst, start_time, end_time)
+    return flight_records(selected.find_flights(range(300)))
+
+
+SELECTIONS = [
+    (set(range(6)), set(range(6)), 0., 20.),
+    ({0, 2}, {1, 3, 5}, 2., 15.),
+    ({5}, set(range(6)), 10., 11.),
+    ({1}, {4}, 30., 40.),
+    ({7}, {0}, 0., 20.),
+]
+
+
+@pytest.mark.parametrize('size', [0, 1, 300])
+def test_save_load_flight_index(tmp_path, size):
+    flights = FlightIndex()
+    push_columns(flights, make_columns(range(size)), sort=True)
+    datetime_base = datetime(2025, 7, 1, 12, tzinfo=UTC)
+    path_prefix = str(tmp_path / 'flight_index')
+    save_flight_index(flights, datetime_base, path_prefix)
+
+    view, loaded_base = load_flight_index(path_prefix)
+    assert loaded_base == datetime_base
+    assert view.version == flights.version
+    assert len(view) == size
+    for selection in SELECTIONS:
+        assert selected_records(view, *selection) == selected_records(flights, *selection)
+
+    # the saved records are the C++ structs, field by field
+    records = np.load(f'{path_prefix}_flights.npy')
+    assert [tuple(r) for r in records.tolist()] == flight_records(flights)
+    assert np.load(f'{path_prefix}_offsets.npy')[-1] == size
+
+
+def test_export_view():
+    flights = FlightIndex()
+    push_columns(flights, make_columns(range(100), seed=1), sort=True)
+    flights_data = np.empty(len(flights) * FLIGHT_NBYTES, dtype=np.uint8)
+    offsets_data = np.empty(flights.nsources + 1, dtype=np.uintp)
+    flights.export(flights_data, offsets_data)
+
+    view = FlightIndexView(flights_data, offsets_data)
+    for selection in SELECTIONS:
+        assert selected_records(view, *selection) == selected_records(flights, *selection)
+
+
+def test_export_bad_buffers():
+    flights = FlightIndex()
+    push_columns(flights, make_columns(range(10)), sort=True)
+    with pytest.raises(ValueError):
+        flights.export(np.empty((len(flights) - 1) * FLIGHT_NBYTES, dtype=np.uint8),
+                       np.empty(flights.nsources + 1, dtype=np.uintp))
+    with pytest.raises(ValueError):
+        flights.export(np.empty(len(flights) * FLIGHT_NBYTES, dtype=np.uint8),
+                       np.empty(flights.nsources, dtype=np.uintp))
+
+    unsorted = FlightIndex()
+    push_columns(unsorted, make_columns(range(10)))
+    with pytest.raises(ValueError):
+        unsorted.export(np.empty(len(unsorted) * FLIGHT_NBYTES, dtype=np.uint8),
+                        np.empty(1, dtype=np.uintp))
+
+
+def test_view_bad_buffers():
+    flights_data = np.zeros(3 * FLIGHT_NBYTES, dtype=np.uint8)
+    with pytest.raises(ValueError):
+        FlightIndexView(flights_data[:-1], np.array([0, 3], dtype=np.uintp))
+    with pytest.raises(ValueError):
+        FlightIndexView(flights_data, np.array([0, 2], dtype=np.uintp))
+    with pytest.raises(ValueError):
+        FlightIndexView(flights_data, np.empty(0, dtype=np.uintp))
+    assert len(FlightIndexView(flights_data, np.array([0, 1, 3], dtype=np.uintp))) == 3
+
+
+def test_load_bad_records(tmp_path):
+    flights = FlightIndex()
+    push_columns(flights, make_columns(range(10)), sort=True)
+    path_prefix = str(tmp_path / 'flight_index')
+    save_flight_index(flights, datetime.now(UTC), path_prefix)
+
+    records = np.load(f'{path_prefix}_flights.npy')
+    np.save(f'{path_prefix}_flights.npy', records.astype([(name, np.float64) for name in FLIGHT_DTYPE.names]))
+    with pytest.raises(ValueError):
+        load_flight_index(path_prefix)
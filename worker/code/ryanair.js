@@ -1,5 +1,5 @@
 import { sleep } from './utils.js';
-import { fetch_job, save_flight_dates, save_data, complete_job } from './scheduler.js'
+import { JobBuffer, save_flight_dates, save_data } from './scheduler.js'
 
 
 const common_headers = {
@@ -95,8 +95,10 @@ const process_fetch_details = async (src_code, dst_code, date) => {
     await save_data('ryanair', details);
 };
 
+const jobs = new JobBuffer('ryanair');
+
 const process_job = async () => {
-    const job_data = await fetch_job('ryanair');
+    const job_data = await jobs.next();
     console.log(job_data);
     if (!job_data) {
         console.log('No jobs available');
@@ -115,7 +117,7 @@ const process_job = async () => {
             throw new Error(`Unknown job type ${job_data.type}`);
     }
 
-    await complete_job('ryanair', job_data.id);
+    jobs.complete(job_data.id);
 };
 
 const worker_process = async () => {
@@ -130,6 +132,7 @@ const worker_process = async () => {
         await sleep();
         await sleep();
     }
+    await jobs.flush();
     window.close();
 };
 
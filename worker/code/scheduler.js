@@ -17,8 +17,9 @@ export const save_data = async (dataset_name, data) => {
 };
 
 
-export const fetch_job = async (storage_name) => {
-    const url = `${manager_url}/${storage_name}/fetch_job`;
+// With wait_s > 0 an empty queue holds the request up to wait_s for new jobs
+export const fetch_job = async (storage_name, wait_s = 0) => {
+    const url = `${manager_url}/${storage_name}/fetch_job?wait_s=${wait_s}`;
     const response = await fetch(url, {
         method: 'POST',
         body: '',
@@ -46,6 +47,68 @@ export const complete_job = async (storage_name, job_id) => {
 };
 
 
+export const fetch_jobs = async (storage_name, n, wait_s = 0) => {
+    const url = `${manager_url}/${storage_name}/fetch_jobs?n=${n}&wait_s=${wait_s}`;
+    const response = await fetch(url, {
+        method: 'POST',
+        body: '',
+        mode: "cors",
+    });
+    if (response.status !== 200) {
+        throw new Error(`Server responded with status ${response.status} ${response.statusText} for ${url}`);
+    }
+    return await response.json();
+};
+
+
+export const complete_jobs = async (storage_name, job_ids) => {
+    const url = `${manager_url}/${storage_name}/complete_jobs`;
+    const response = await fetch(url, {
+        method: 'POST',
+        body: JSON.stringify({
+            job_ids: job_ids,
+        }),
+        mode: "cors",
+    });
+    if (response.status !== 200) {
+        throw new Error(`Server responded with status ${response.status} ${response.statusText} for ${url}`);
+    }
+};
+
+
+// Leases jobs batch_size at a time and reports the completed ones with the next lease,
+// one round trip per batch. A batch has to be done within the scheduler lease time (4 min).
+// An empty queue is long-polled for wait_s.
+export class JobBuffer {
+    constructor(storage_name, batch_size = 8, wait_s = 20) {
+        this.storage_name = storage_name;
+        this.batch_size = batch_size;
+        this.wait_s = wait_s;
+        this.jobs = [];
+        this.completed = [];
+    }
+
+    async next() {
+        if (!this.jobs.length) {
+            await this.flush();
+            this.jobs = await fetch_jobs(this.storage_name, this.batch_size, this.wait_s);
+        }
+        return this.jobs.shift();
+    }
+
+    complete(job_id) {
+        this.completed.push(job_id);
+    }
+
+    async flush() {
+        if (this.completed.length) {
+            await complete_jobs(this.storage_name, this.completed);
+            this.completed = [];
+        }
+    }
+}
+
+
 export const save_ryanair_flight_dates = async (src_code, dst_code, dates) => {
     const url = `${manager_url}/ryanair/save_flight_dates`;
     const response = await fetch(url, {